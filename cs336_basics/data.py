@@ -0,0 +1,84 @@
+import numpy as np
+import numpy.typing as npt
+import torch
+
+
+def _sample_windows(
+    dataset: npt.NDArray, batch_size: int, context_length: int
+) -> tuple[np.ndarray, torch.Tensor]:
+    # Sample random starting indices
+    starts = np.random.randint(0, len(dataset) - context_length, size=batch_size)
+
+    # Gather all windows with one fancy-indexing read: (batch_size, context_length + 1)
+    windows = np.asarray(dataset[starts[:, None] + np.arange(context_length + 1)], dtype=np.int64)
+    return starts, torch.from_numpy(windows)
+
+
+def _to_device(t: torch.Tensor, device: str) -> torch.Tensor:
+    if torch.device(device).type == "cuda":
+        return t.pin_memory().to(device, non_blocking=True)
+    return t.to(device)
+
+
+def get_batch(
+    dataset: npt.NDArray, batch_size: int, context_length: int, device: str
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Sample `batch_size` random windows of `context_length` tokens from `dataset`
+    (a 1D array of token ids, e.g. an `np.memmap`) together with their next-token labels.
+
+    Returns:
+        (inputs, targets), both LongTensors of shape (batch_size, context_length) on `device`.
+    """
+    _, windows = _sample_windows(dataset, batch_size, context_length)
+    windows = _to_device(windows, device)
+    return windows[:, :-1], windows[:, 1:]
+
+
+def build_eot_index(dataset: npt.NDArray, eot_token_id: int, chunk_size: int = 1 << 24) -> np.ndarray:
+    """
+    Sorted positions of every `eot_token_id` (end-of-text) token in `dataset`. The dataset is
+    scanned `chunk_size` tokens at a time, so a large memmap is never loaded at once.
+    """
+    positions = [
+        np.flatnonzero(np.asarray(dataset[start : start + chunk_size]) == eot_token_id) + start
+        for start in range(0, len(dataset), chunk_size)
+    ]
+    return np.concatenate(positions).astype(np.int64) if positions else np.empty(0, dtype=np.int64)
+
+
+def get_packed_batch(
+    dataset: npt.NDArray, batch_size: int, context_length: int, device: str, eot_index: np.ndarray
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Like `get_batch`, but also returns which document each input token belongs to, so that
+    attention can be restricted to tokens of the same document (see TransformerLM).
+    A document ends with its end-of-text token; `eot_index` comes from `build_eot_index`.
+
+    Returns:
+        (inputs, targets, document_ids), all LongTensors of shape (batch_size, context_length).
+        Document ids count up from 0 within each row.
+    """
+    starts, windows = _sample_windows(dataset, batch_size, context_length)
+
+    # The document of a token is the number of end-of-text tokens before it
+    positions = starts[:, None] + np.arange(context_length)
+    document_ids = np.searchsorted(eot_index, positions, side="left")
+    document_ids = torch.from_numpy(document_ids - document_ids[:, :1])
+
+    windows = _to_device(windows, device)
+    return windows[:, :-1], windows[:, 1:], _to_device(document_ids, device)
+
+
+def cu_seqlens(document_ids: torch.Tensor) -> torch.Tensor:
+    """
+    Cumulative document lengths, starting at 0, of a (batch_size, seq_len) batch of document ids
+    laid out row after row: the int32 boundaries expected by variable-length attention kernels.
+    A document cut by a row boundary counts as two sequences.
+    """
+    batch_size, seq_len = document_ids.shape
+    # Make document ids unique across rows (they are < seq_len within a row)
+    flat = (document_ids + seq_len * torch.arange(batch_size, device=document_ids.device)[:, None]).flatten()
+    starts = torch.nonzero(flat[1:] != flat[:-1]).flatten() + 1
+    bounds = [torch.zeros(1, dtype=starts.dtype, device=starts.device), starts, starts.new_tensor([flat.numel()])]
+    return torch.cat(bounds).to(torch.int32)
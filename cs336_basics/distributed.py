@@ -0,0 +1,294 @@
+"""
+Multi-process training helpers on top of `torch.distributed`.
+
+Processes are either started by `torchrun` (which sets RANK, WORLD_SIZE, MASTER_ADDR and
+MASTER_PORT) or spawned locally with `spawn`, e.g. for CPU-only data parallelism with gloo.
+"""
+
+import math
+import os
+import socket
+from collections.abc import Callable
+from contextlib import contextmanager
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import nn
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+from torch.optim import Optimizer
+
+from cs336_basics.optimizer import AdamW
+
+
+def get_rank() -> int:
+    return dist.get_rank() if dist.is_initialized() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawned_worker(rank: int, fn: Callable, world_size: int, backend: str, port: int, args: tuple):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+    try:
+        fn(*args)
+    finally:
+        dist.destroy_process_group()
+
+
+def spawn(fn: Callable, world_size: int, *args, backend: str = "gloo"):
+    """
+    Run `fn(*args)` in `world_size` local processes, each with an initialized process group.
+    `fn` must be picklable (a module-level function).
+    """
+    mp.spawn(_spawned_worker, args=(fn, world_size, backend, _free_port(), args), nprocs=world_size, join=True)
+
+
+class GradientAllReducer:
+    """
+    Data-parallel gradient averaging for `module`, overlapped with the backward pass.
+
+    Parameters are grouped into buckets of about `bucket_size_mb`, in reverse order of
+    registration (roughly the order in which backward produces their gradients). As soon as
+    every gradient of a bucket has been accumulated, the bucket is flattened and all-reduced
+    asynchronously while backward continues; `synchronize()` waits for the outstanding
+    all-reduces and writes the averaged gradients back. After it, every rank holds identical
+    gradients, so gradient clipping and the optimizer step stay consistent across ranks.
+
+    Parameters are broadcast from rank 0 on construction, so all replicas start identical.
+    """
+
+    def __init__(self, module: nn.Module, bucket_size_mb: float = 25.0):
+        self.world_size = dist.get_world_size()
+        for t in module.state_dict().values():
+            dist.broadcast(t, src=0)
+
+        params = [p for p in module.parameters() if p.requires_grad]
+        bucket_bytes = bucket_size_mb * 1024**2
+        self.buckets: list[list[nn.Parameter]] = [[]]
+        size = 0
+        for p in reversed(params):
+            if self.buckets[-1] and size + p.numel() * p.element_size() > bucket_bytes:
+                self.buckets.append([])
+                size = 0
+            self.buckets[-1].append(p)
+            size += p.numel() * p.element_size()
+        self._bucket_of = {p: i for i, bucket in enumerate(self.buckets) for p in bucket}
+
+        self._sync = True
+        self._num_ready = [0] * len(self.buckets)
+        self._in_flight: dict[int, tuple[torch.Tensor, dist.Work]] = {}
+        for p in params:
+            p.register_post_accumulate_grad_hook(self._on_grad_ready)
+
+    @contextmanager
+    def no_sync(self):
+        """Accumulate gradients locally, e.g. on all but the last of several micro-batches."""
+        self._sync = False
+        try:
+            yield
+        finally:
+            self._sync = True
+
+    def _on_grad_ready(self, param: nn.Parameter):
+        if not self._sync:
+            return
+        i = self._bucket_of[param]
+        self._num_ready[i] += 1
+        if self._num_ready[i] == len(self.buckets[i]):
+            self._launch(i)
+
+    def _launch(self, i: int):
+        for p in self.buckets[i]:
+            # Parameters unused in this step still take part, so that every rank reduces the same buffers
+            if p.grad is None:
+                p.grad = torch.zeros_like(p)
+        flat = _flatten_dense_tensors([p.grad for p in self.buckets[i]])
+        self._in_flight[i] = (flat, dist.all_reduce(flat, async_op=True))
+
+    def synchronize(self):
+        """Wait for all gradient all-reduces and replace each gradient by the average over ranks."""
+        # Buckets left incomplete (some parameters got no gradient) are reduced now, in bucket order
+        for i in range(len(self.buckets)):
+            if i not in self._in_flight:
+                self._launch(i)
+        for i, (flat, work) in self._in_flight.items():
+            work.wait()
+            flat.div_(self.world_size)
+            grads = [p.grad for p in self.buckets[i]]
+            for grad, reduced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+                grad.copy_(reduced)
+        self._in_flight.clear()
+        self._num_ready = [0] * len(self.buckets)
+
+
+class ShardedOptimizer(Optimizer):
+    """
+    Optimizer state sharding across data-parallel ranks (ZeRO stage 1).
+
+    The parameters of each param group are viewed as one flat vector, split into `world_size`
+    equal slices. Each rank runs `optimizer_cls` (`AdamW` by default) on its own slice only,
+    so it holds 1/world_size of the optimizer state, then the updated slices are all-gathered
+    into every replica. Gradients must already be identical on all ranks (e.g. after
+    `GradientAllReducer.synchronize()`); AdamW being elementwise, the result matches the
+    unsharded optimizer. Parameters without a gradient are updated as if it were zero.
+
+    Checkpoints use the full, unsharded layout of `optimizer_cls`: `consolidate_state_dict()`
+    must be called on every rank before `state_dict()` is called on the receiving rank, and
+    `load_state_dict()` accepts a full state dict on every rank and keeps its own slice.
+    """
+
+    def __init__(self, params, optimizer_cls: type[Optimizer] = AdamW, **optimizer_kwargs):
+        super().__init__(params, optimizer_kwargs)
+        self.rank, self.world_size = get_rank(), get_world_size()
+        self._consolidated: dict | None = None
+
+        self._shards = []
+        inner_groups = []
+        for group in self.param_groups:
+            params = group["params"]
+            if len({(p.device, p.dtype) for p in params}) > 1:
+                raise ValueError("All parameters of a group must share a device and dtype")
+            numels = [p.numel() for p in params]
+            shard_size = math.ceil(sum(numels) / self.world_size)
+            start = min(self.rank * shard_size, sum(numels))
+            end = min(start + shard_size, sum(numels))
+            # This rank's master slice; its values are refreshed from the parameters at each step
+            shard = torch.zeros(shard_size, device=params[0].device, dtype=params[0].dtype)
+            self._shards.append(
+                {
+                    "params": params,
+                    "numels": numels,
+                    "start": start,
+                    "end": end,
+                    "shard": shard,
+                    "grad": torch.zeros_like(shard),
+                    # Flat buffer the updated slices of all ranks are gathered into
+                    "gathered": shard if self.world_size == 1 else shard.new_empty(shard_size * self.world_size),
+                }
+            )
+            inner_groups.append({**self._hyperparameters(group), "params": [shard]})
+        self.optimizer = optimizer_cls(inner_groups, **optimizer_kwargs)
+        # Expose the wrapped optimizer's defaults (e.g. betas), as its own state dict would
+        for group, inner_group in zip(self.param_groups, self.optimizer.param_groups):
+            for key, value in self._hyperparameters(inner_group).items():
+                group.setdefault(key, value)
+
+    @staticmethod
+    def _hyperparameters(group: dict) -> dict:
+        return {k: v for k, v in group.items() if k != "params"}
+
+    def _local_slice(
+        self, tensors: list[torch.Tensor | None], shard: dict, out: torch.Tensor | None = None
+    ) -> torch.Tensor:
+        """
+        This rank's slice of the concatenation of `tensors` (flattened, None counting as zeros),
+        zero-padded to the shard size and written into `out` (default: a new tensor). Only the
+        parts overlapping the slice are read.
+        """
+        out = shard["shard"].new_zeros(shard["shard"].shape) if out is None else out.zero_()
+        offset = 0
+        for t, numel in zip(tensors, shard["numels"]):
+            lo, hi = max(shard["start"] - offset, 0), min(shard["end"] - offset, numel)
+            if t is not None and lo < hi:
+                out[offset + lo - shard["start"] : offset + hi - shard["start"]].copy_(t.reshape(-1)[lo:hi])
+            offset += numel
+        return out
+
+    def _gather(self, tensor: torch.Tensor, dst: int | None = None) -> list[torch.Tensor] | None:
+        """The `tensor` of every rank, in rank order, on all ranks (or only on rank `dst`)."""
+        if self.world_size == 1:
+            return [tensor]
+        if dst is None:
+            gathered = [torch.empty_like(tensor) for _ in range(self.world_size)]
+            dist.all_gather(gathered, tensor)
+            return gathered
+        gathered = [torch.empty_like(tensor) for _ in range(self.world_size)] if self.rank == dst else None
+        dist.gather(tensor, gathered, dst=dst)
+        return gathered
+
+    @torch.no_grad()
+    def step(self, closure: Callable | None = None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group, inner_group, shard in zip(self.param_groups, self.optimizer.param_groups, self._shards):
+            # Learning rate schedules update the outer param groups
+            inner_group.update(self._hyperparameters(group))
+            params = shard["params"]
+            self._local_slice(params, shard, out=shard["shard"])
+            shard["shard"].grad = self._local_slice([p.grad for p in params], shard, out=shard["grad"])
+
+        self.optimizer.step()
+
+        for shard in self._shards:
+            shard["shard"].grad = None
+            flat = shard["gathered"]
+            if self.world_size > 1:
+                # Each rank's slice lands directly in its part of the flat buffer
+                dist.all_gather(list(flat.chunk(self.world_size)), shard["shard"])
+            params, numels = shard["params"], shard["numels"]
+            # Drop the padding of the last slice before splitting into parameters
+            torch._foreach_copy_(params, [t.view_as(p) for t, p in zip(flat[: sum(numels)].split(numels), params)])
+        return loss
+
+    def consolidate_state_dict(self, to: int = 0):
+        """
+        Gather the full optimizer state on rank `to`, for its next `state_dict()` call.
+        This is a collective: every rank must call it.
+        """
+        inner_state = self.optimizer.state_dict()["state"]
+        state: dict[int, dict] = {}
+        index = 0
+        for i, shard in enumerate(self._shards):
+            params = shard["params"]
+            for key, value in inner_state.get(i, {}).items():
+                if not torch.is_tensor(value) or value.shape != shard["shard"].shape:
+                    for j in range(len(params)):
+                        state.setdefault(index + j, {})[key] = value
+                    continue
+                gathered = self._gather(value.contiguous(), dst=to)
+                if gathered is None:
+                    continue
+                flat = torch.cat(gathered)[: sum(shard["numels"])]
+                for j, (t, p) in enumerate(zip(flat.split(shard["numels"]), params)):
+                    state.setdefault(index + j, {})[key] = t.view_as(p).clone()
+            index += len(params)
+        if self.rank == to:
+            self._consolidated = state
+
+    def state_dict(self) -> dict:
+        """The full state dict, in the layout of `optimizer_cls` (see `consolidate_state_dict`)."""
+        if self._consolidated is None:
+            if self.world_size > 1:
+                raise RuntimeError("Call consolidate_state_dict() on every rank before state_dict()")
+            self.consolidate_state_dict()
+        state_dict = super().state_dict()
+        state_dict["state"], self._consolidated = self._consolidated, None
+        return state_dict
+
+    def load_state_dict(self, state_dict: dict):
+        """Load a full (unsharded) state dict and keep this rank's slice of it."""
+        super().load_state_dict({"state": {}, "param_groups": state_dict["param_groups"]})
+        inner_state: dict[int, dict] = {}
+        for i, (saved_group, shard) in enumerate(zip(state_dict["param_groups"], self._shards)):
+            param_states = [state_dict["state"].get(index, {}) for index in saved_group["params"]]
+            for key in {key for param_state in param_states for key in param_state}:
+                values = [param_state.get(key) for param_state in param_states]
+                value = next(v for v in values if v is not None)
+                if torch.is_tensor(value) and value.dim() > 0:
+                    value = self._local_slice(values, shard)
+                inner_state.setdefault(i, {})[key] = value
+        inner_groups = [{**self._hyperparameters(group), "params": [i]} for i, group in enumerate(self.param_groups)]
+        self.optimizer.load_state_dict({"state": inner_state, "param_groups": inner_groups})
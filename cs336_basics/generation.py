@@ -0,0 +1,271 @@
+from collections.abc import Iterator
+from typing import Any
+
+import torch
+
+from cs336_basics.model import TransformerLM
+from cs336_basics.nn_utils import softmax
+
+
+def sampling_probs(
+    logits: torch.Tensor,
+    temperature: float = 1.0,
+    top_k: int | None = None,
+    top_p: float | None = None,
+) -> torch.Tensor:
+    """
+    The distribution that `sample_next_token` samples from, as fp32 probabilities of the
+    same shape as `logits` (..., vocab_size). Temperature 0 gives a one-hot argmax.
+    """
+    if temperature == 0:
+        return torch.zeros_like(logits, dtype=torch.float32).scatter_(-1, logits.argmax(dim=-1, keepdim=True), 1.0)
+
+    logits = logits.float() / temperature
+    if top_k is not None and top_k < logits.shape[-1]:
+        kth_largest = torch.topk(logits, top_k, dim=-1).values[..., -1:]
+        logits = logits.masked_fill(logits < kth_largest, float("-inf"))
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, dim=-1, descending=True)
+        sorted_probs = softmax(sorted_logits, dim=-1)
+        # Drop a token if the tokens before it already reach `top_p`; the most likely is always kept
+        mass_before = torch.cumsum(sorted_probs, dim=-1) - sorted_probs
+        sorted_logits = sorted_logits.masked_fill(mass_before >= top_p, float("-inf"))
+        logits = torch.empty_like(logits).scatter_(-1, sorted_indices, sorted_logits)
+    return softmax(logits, dim=-1)
+
+
+def sample_next_token(
+    logits: torch.Tensor,
+    temperature: float = 1.0,
+    top_k: int | None = None,
+    top_p: float | None = None,
+    generator: torch.Generator | None = None,
+) -> torch.Tensor:
+    """
+    Sample one token id per row of `logits` (batch, vocab_size).
+
+    Args:
+        temperature: softmax temperature; 0 means greedy decoding.
+        top_k: if set, sample only among the `top_k` most likely tokens.
+        top_p: if set, sample only from the smallest set of most likely tokens whose
+            total probability is at least `top_p` (nucleus sampling).
+
+    Returns:
+        (batch,) LongTensor of token ids.
+    """
+    if temperature == 0:
+        return logits.argmax(dim=-1)
+    probs = sampling_probs(logits, temperature, top_k, top_p)
+    return torch.multinomial(probs, num_samples=1, generator=generator).squeeze(-1)
+
+
+@torch.no_grad()
+def generate_stream(
+    model: TransformerLM,
+    prompts: list[list[int]],
+    max_new_tokens: int,
+    temperature: float = 1.0,
+    top_k: int | None = None,
+    top_p: float | None = None,
+    eos_token_id: int | None = None,
+    generator: torch.Generator | None = None,
+    quantize_kv_cache: bool = False,
+) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Sample continuations of a batch of prompts, one step at a time.
+
+    Prompts are left-padded and prefilled together; each step then feeds only the newly
+    sampled tokens through the model, reusing the keys/values of earlier tokens from a KVCache.
+    Generation stops once every sequence has produced `eos_token_id` or after `max_new_tokens`.
+    With `quantize_kv_cache`, the cached keys and values are stored in int8.
+
+    Yields:
+        (token_ids, active) per step, both of shape (batch,): the sampled ids and whether each
+        sequence was still generating (False once it has emitted `eos_token_id`).
+    """
+    if max_new_tokens <= 0:
+        return
+    device = model.ln_final.weight.device
+    lengths = [len(prompt) for prompt in prompts]
+    if min(lengths) == 0:
+        raise ValueError("prompts must not be empty")
+    prompt_len = max(lengths)
+    # The last sampled token is never fed back through the model
+    max_seq_len = prompt_len + max_new_tokens - 1
+    if max_seq_len > model.context_length:
+        raise ValueError(
+            f"prompt length {prompt_len} + max_new_tokens {max_new_tokens} exceeds the context length "
+            f"{model.context_length}"
+        )
+
+    in_indices = torch.zeros(len(prompts), prompt_len, dtype=torch.long)
+    for i, prompt in enumerate(prompts):
+        in_indices[i, prompt_len - len(prompt) :] = torch.tensor(prompt, dtype=torch.long)
+    padding = torch.tensor([prompt_len - n for n in lengths], dtype=torch.long)
+
+    kv_cache = model.init_kv_cache(len(prompts), max_seq_len, padding=padding.to(device), quantize=quantize_kv_cache)
+    logits = model(in_indices.to(device), kv_cache=kv_cache)[:, -1]
+    active = torch.ones(len(prompts), dtype=torch.bool, device=device)
+    for step in range(max_new_tokens):
+        token_ids = sample_next_token(logits, temperature, top_k, top_p, generator)
+        yield token_ids, active.clone()
+
+        if eos_token_id is not None:
+            active &= token_ids != eos_token_id
+            if not active.any():
+                return
+        if step + 1 < max_new_tokens:
+            logits = model(token_ids[:, None], kv_cache=kv_cache)[:, -1]
+
+
+def generate(
+    model: TransformerLM,
+    prompts: list[list[int]],
+    max_new_tokens: int,
+    temperature: float = 1.0,
+    top_k: int | None = None,
+    top_p: float | None = None,
+    eos_token_id: int | None = None,
+    generator: torch.Generator | None = None,
+    quantize_kv_cache: bool = False,
+) -> list[list[int]]:
+    """
+    Sample a continuation of each prompt (see `generate_stream`).
+
+    Returns:
+        The generated token ids of each prompt, without the prompt and without `eos_token_id`.
+    """
+    outputs: list[list[int]] = [[] for _ in prompts]
+    for token_ids, active in generate_stream(
+        model, prompts, max_new_tokens, temperature, top_k, top_p, eos_token_id, generator, quantize_kv_cache
+    ):
+        for i, (token_id, is_active) in enumerate(zip(token_ids.tolist(), active.tolist())):
+            if is_active and token_id != eos_token_id:
+                outputs[i].append(token_id)
+    return outputs
+
+
+def stream_text(
+    model: TransformerLM,
+    tokenizer: Any,
+    prompt: str,
+    max_new_tokens: int,
+    eos_token: str = "<|endoftext|>",
+    **sampling_kwargs,
+) -> Iterator[str]:
+    """
+    Generate a continuation of `prompt` and yield it as text, piece by piece, as tokens
+    are sampled. `tokenizer` needs `encode(str) -> list[int]` and `decode(list[int]) -> str`.
+    Generation stops at `eos_token`.
+    """
+    eos_ids = tokenizer.encode(eos_token)
+    eos_token_id = eos_ids[0] if len(eos_ids) == 1 else None
+
+    token_ids: list[int] = []
+    text = ""
+    for step_ids, _ in generate_stream(
+        model, [tokenizer.encode(prompt)], max_new_tokens, eos_token_id=eos_token_id, **sampling_kwargs
+    ):
+        token_id = step_ids[0].item()
+        if token_id == eos_token_id:
+            break
+        token_ids.append(token_id)
+        decoded = tokenizer.decode(token_ids)
+        # A token may end inside a multi-byte character, which decodes to U+FFFD until completed
+        if decoded.endswith("\ufffd"):
+            continue
+        yield decoded[len(text) :]
+        text = decoded
+
+
+@torch.no_grad()
+def speculative_generate(
+    model: TransformerLM,
+    draft_model: TransformerLM,
+    prompt: list[int],
+    max_new_tokens: int,
+    num_speculative: int = 4,
+    temperature: float = 1.0,
+    top_k: int | None = None,
+    top_p: float | None = None,
+    eos_token_id: int | None = None,
+    generator: torch.Generator | None = None,
+) -> list[int]:
+    """
+    Sample a continuation of `prompt` from `model` using speculative decoding.
+
+    Each round the (smaller) `draft_model` proposes `num_speculative` tokens one at a time,
+    and `model` scores all of them in a single forward. Draft token x is accepted with
+    probability min(1, p(x) / q(x)), p and q being the target and draft sampling distributions;
+    at the first rejection a replacement is drawn from max(p - q, 0), and if all are accepted
+    one more token is drawn from p. The output is thus distributed exactly as sampling from
+    `model` alone, while `model` runs about once per accepted run of tokens.
+
+    Both models must share the tokenizer, and neither may use sliding-window attention (rejected
+    draft tokens could not be removed from its ring KV cache). Returns the generated token ids,
+    without the prompt and without `eos_token_id`.
+    """
+    device = model.ln_final.weight.device
+    if not prompt:
+        raise ValueError("prompt must not be empty")
+    if any(m.layers[0].attn.window_size is not None for m in (model, draft_model)):
+        raise ValueError("speculative decoding does not support sliding-window attention models")
+    # Drafts are capped so that no round scores a position past the last token to return,
+    # which is never fed back: the same bound as for `generate`
+    max_seq_len = len(prompt) + max_new_tokens - 1
+    if max_seq_len > min(model.context_length, draft_model.context_length):
+        raise ValueError(
+            f"prompt length {len(prompt)} + max_new_tokens {max_new_tokens} exceeds the context length"
+        )
+
+    def probs(logits: torch.Tensor) -> torch.Tensor:
+        return sampling_probs(logits, temperature, top_k, top_p)
+
+    def sample(p: torch.Tensor) -> int:
+        return torch.multinomial(p, num_samples=1, generator=generator).item()
+
+    # Both caches hold every token but the last one, which is fed at the start of the next round
+    tokens = list(prompt)
+    target_cache = model.init_kv_cache(1, max_seq_len)
+    draft_cache = draft_model.init_kv_cache(1, max_seq_len)
+    if len(prompt) > 1:
+        prefix = torch.tensor([prompt[:-1]], device=device)
+        model(prefix, kv_cache=target_cache)
+        draft_model(prefix, kv_cache=draft_cache)
+
+    generated: list[int] = []
+    while len(generated) < max_new_tokens:
+        num_draft = min(num_speculative, max_new_tokens - len(generated) - 1)
+
+        # Draft: feed the tokens it has not seen yet, then extend one token at a time
+        draft_tokens, draft_probs = [], []
+        next_input = tokens[draft_cache.length :]
+        for _ in range(num_draft):
+            q = probs(draft_model(torch.tensor([next_input], device=device), kv_cache=draft_cache)[0, -1])
+            draft_tokens.append(sample(q))
+            draft_probs.append(q)
+            next_input = draft_tokens[-1:]
+
+        # Target: score the last token and all draft tokens at once
+        logits = model(torch.tensor([tokens[-1:] + draft_tokens], device=device), kv_cache=target_cache)[0]
+        target_probs = probs(logits)
+
+        accepted = []
+        for token, q, p in zip(draft_tokens, draft_probs, target_probs):
+            if torch.rand((), generator=generator, device=p.device) * q[token] < p[token]:
+                accepted.append(token)
+                continue
+            residual = (p - q).clamp_(min=0)
+            accepted.append(sample(residual if residual.sum() > 0 else p))
+            break
+        else:
+            accepted.append(sample(target_probs[num_draft]))
+
+        for token in accepted:
+            if token == eos_token_id:
+                return generated
+            tokens.append(token)
+            generated.append(token)
+        target_cache.truncate(len(tokens) - 1)
+        draft_cache.truncate(min(draft_cache.length, len(tokens) - 1))
+    return generated
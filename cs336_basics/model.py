@@ -0,0 +1,684 @@
+import math
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+from cs336_basics.nn_utils import chunked_cross_entropy, softmax
+
+
+class Linear(nn.Module):
+    def __init__(self, in_features: int, out_features: int, device=None, dtype=None):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+
+        self.weight = nn.Parameter(torch.empty((out_features, in_features), device=device, dtype=dtype))
+        std = math.sqrt(2 / (in_features + out_features))
+        nn.init.trunc_normal_(self.weight, std=std, a=-3 * std, b=3 * std)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.einsum("...i, oi -> ...o", x, self.weight)
+
+
+class Embedding(nn.Module):
+    def __init__(self, num_embeddings: int, embedding_dim: int, device=None, dtype=None):
+        super().__init__()
+        self.weight = nn.Parameter(torch.empty((num_embeddings, embedding_dim), device=device, dtype=dtype))
+        nn.init.trunc_normal_(self.weight, std=1.0, a=-3.0, b=3.0)
+
+    def forward(self, token_ids: torch.Tensor) -> torch.Tensor:
+        return self.weight[token_ids]
+
+
+class RMSNorm(nn.Module):
+    def __init__(self, d_model: int, eps: float = 1e-5, device=None, dtype=None):
+        super().__init__()
+        self.eps = eps
+
+        # Learnable scale parameter
+        self.weight = nn.Parameter(torch.ones(d_model, device=device, dtype=dtype))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        in_dtype = x.dtype
+        x = x.to(dtype=torch.float32)
+
+        rms = torch.sqrt(torch.mean(x * x, dim=-1, keepdim=True) + self.eps)
+        result = x / rms * self.weight
+        return result.to(dtype=in_dtype)
+
+
+def silu(x: torch.Tensor) -> torch.Tensor:
+    return x * torch.sigmoid(x)
+
+
+class SwiGLU(nn.Module):
+    def __init__(self, d_model: int, d_ff: int, device=None, dtype=None):
+        super().__init__()
+        self.w1 = Linear(d_model, d_ff, device=device, dtype=dtype)
+        self.w2 = Linear(d_ff, d_model, device=device, dtype=dtype)
+        self.w3 = Linear(d_model, d_ff, device=device, dtype=dtype)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.w2(silu(self.w1(x)) * self.w3(x))
+
+
+class RotaryPositionalEmbedding(nn.Module):
+    def __init__(self, theta: float, d_k: int, max_seq_len: int, device=None):
+        super().__init__()
+        assert d_k % 2 == 0
+
+        # Rotation angle for each (position, pair of dimensions)
+        inv_freq = 1.0 / (theta ** (torch.arange(0, d_k, 2, device=device, dtype=torch.float32) / d_k))
+        positions = torch.arange(max_seq_len, device=device, dtype=torch.float32)
+        angles = torch.einsum("s, f -> sf", positions, inv_freq)
+
+        self.register_buffer("cos", torch.cos(angles), persistent=False)
+        self.register_buffer("sin", torch.sin(angles), persistent=False)
+
+    def forward(self, x: torch.Tensor, token_positions: torch.Tensor) -> torch.Tensor:
+        """
+        :param x: (..., seq_len, d_k)
+        :param token_positions: (..., seq_len), broadcastable against the leading dims of x
+        :return: (..., seq_len, d_k)
+        """
+        cos = self.cos[token_positions]
+        sin = self.sin[token_positions]
+
+        x1, x2 = x[..., 0::2], x[..., 1::2]
+        rotated = torch.stack((x1 * cos - x2 * sin, x1 * sin + x2 * cos), dim=-1)
+        return rotated.flatten(-2).to(x.dtype)
+
+
+def scaled_dot_product_attention(
+    q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, mask: torch.Tensor | None = None
+) -> torch.Tensor:
+    """
+    :param q: (..., seq_len_q, d_k)
+    :param k: (..., seq_len_k, d_k)
+    :param v: (..., seq_len_k, d_v)
+    :param mask: optional (..., seq_len_q, seq_len_k) of bool, True where attention is allowed
+    :return: output (..., seq_len_q, d_v)
+    """
+    d_k = q.size(-1)
+
+    # Matmuls may run in lower precision under autocast; the softmax is always done in fp32
+    scores = torch.einsum("...qd, ...kd -> ...qk", q, k).float() / math.sqrt(d_k)
+
+    if mask is not None:
+        scores = scores.masked_fill(~mask, float("-inf"))
+
+    attn_weights = softmax(scores, dim=-1)
+
+    return torch.einsum("...qk, ...kd -> ...qd", attn_weights.to(v.dtype), v)
+
+
+class Int8KVBuffer:
+    """
+    Int8 storage for a key or value cache buffer of shape (..., d_k), with one scale per
+    vector of d_k entries, i.e. per layer, sequence, head and token. It supports the indexing
+    the KV caches use (never indexing the last dimension): assignment quantizes and reading
+    dequantizes to `dtype`, so attention always sees floating-point keys and values while the
+    cache holds about a byte per entry, instead of two (bf16) or four (fp32).
+    """
+
+    def __init__(self, shape: tuple[int, ...], device=None, dtype=None):
+        self.data = torch.zeros(shape, device=device, dtype=torch.int8)
+        self.scales = torch.zeros((*shape[:-1], 1), device=device, dtype=dtype or torch.get_default_dtype())
+
+    @property
+    def shape(self) -> torch.Size:
+        return self.data.shape
+
+    @property
+    def device(self) -> torch.device:
+        return self.data.device
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.scales.dtype
+
+    def __getitem__(self, index) -> torch.Tensor:
+        return self.data[index].to(self.dtype) * self.scales[index]
+
+    def __setitem__(self, index, value: torch.Tensor):
+        value = value.float()
+        scales = (value.abs().amax(dim=-1, keepdim=True) / 127).clamp(min=1e-12).to(self.dtype)
+        self.data[index] = (value / scales.float()).round_().clamp_(-127, 127).to(torch.int8)
+        self.scales[index] = scales
+
+
+class KVCache:
+    """
+    Keys and values of the tokens processed so far, for incremental decoding: one
+    (batch_size, num_heads, max_seq_len, d_k) buffer pair per layer.
+
+    Prompts of different lengths are left-padded to a common length; `padding` gives the
+    number of padding slots at the start of each row. Those slots are never attended to,
+    and RoPE positions of each row start at 0 at its first real token.
+
+    With `quantize`, keys and values are stored in int8 (see Int8KVBuffer).
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        batch_size: int,
+        num_heads: int,
+        d_k: int,
+        max_seq_len: int,
+        padding: torch.Tensor | None = None,
+        quantize: bool = False,
+        device=None,
+        dtype=None,
+    ):
+        shape = (num_layers, batch_size, num_heads, max_seq_len, d_k)
+        buffer_cls = Int8KVBuffer if quantize else torch.zeros
+        self.keys = buffer_cls(shape, device=device, dtype=dtype)
+        self.values = buffer_cls(shape, device=device, dtype=dtype)
+        if padding is None:
+            padding = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.padding = padding.to(device)
+        self.key_mask = torch.arange(max_seq_len, device=device) >= self.padding[:, None]
+        self.length = 0
+
+    @property
+    def max_seq_len(self) -> int:
+        return self.keys.shape[-2]
+
+    def positions(self, num_new: int) -> torch.Tensor:
+        """RoPE positions (batch_size, num_new) of the next `num_new` tokens."""
+        slots = torch.arange(self.length, self.length + num_new, device=self.padding.device)
+        return (slots - self.padding[:, None]).clamp(min=0)
+
+    def mask(self, num_new: int) -> torch.Tensor:
+        """Attention mask (batch_size, 1, num_new, length + num_new) of the next `num_new` queries."""
+        end = self.length + num_new
+        query_slots = torch.arange(self.length, end, device=self.key_mask.device)[:, None]
+        key_slots = torch.arange(end, device=self.key_mask.device)
+        # Padding queries attend to themselves only, so they never produce NaNs
+        allowed = self.key_mask[:, None, None, :end] | (key_slots == query_slots)
+        return allowed & (key_slots <= query_slots)
+
+    def update(self, layer_idx: int, k: torch.Tensor, v: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """Store the new keys/values of layer `layer_idx` and return all of its keys/values so far."""
+        end = self.length + k.shape[-2]
+        if end > self.max_seq_len:
+            raise ValueError(f"KV cache is full ({self.max_seq_len} slots)")
+        self.keys[layer_idx, :, :, self.length : end] = k
+        self.values[layer_idx, :, :, self.length : end] = v
+        return self.keys[layer_idx, :, :, :end], self.values[layer_idx, :, :, :end]
+
+    def advance(self, num_new: int):
+        self.length += num_new
+
+    def truncate(self, length: int):
+        """Forget every token after the first `length`, e.g. rejected speculative tokens."""
+        assert length <= self.length
+        self.length = length
+
+
+class RingKVCache:
+    """
+    KV cache for sliding-window attention: only the last `window_size` tokens of each layer are
+    kept, in a ring buffer indexed by token slot modulo `window_size`, so decode memory stays
+    bounded however long the sequence grows. Same interface and padding convention as KVCache.
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        batch_size: int,
+        num_heads: int,
+        d_k: int,
+        window_size: int,
+        padding: torch.Tensor | None = None,
+        quantize: bool = False,
+        device=None,
+        dtype=None,
+    ):
+        shape = (num_layers, batch_size, num_heads, window_size, d_k)
+        buffer_cls = Int8KVBuffer if quantize else torch.zeros
+        self.keys = buffer_cls(shape, device=device, dtype=dtype)
+        self.values = buffer_cls(shape, device=device, dtype=dtype)
+        self.window_size = window_size
+        if padding is None:
+            padding = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.padding = padding.to(device)
+        # Token slot stored in each ring entry, -1 if empty
+        self.ring_slots = torch.full((window_size,), -1, dtype=torch.long, device=device)
+        self.length = 0
+
+    def positions(self, num_new: int) -> torch.Tensor:
+        """RoPE positions (batch_size, num_new) of the next `num_new` tokens."""
+        slots = torch.arange(self.length, self.length + num_new, device=self.padding.device)
+        return (slots - self.padding[:, None]).clamp(min=0)
+
+    def _new_slots(self, num_new: int) -> torch.Tensor:
+        return torch.arange(self.length, self.length + num_new, device=self.ring_slots.device)
+
+    def mask(self, num_new: int) -> torch.Tensor:
+        """Attention mask (batch_size, 1, num_new, window_size + num_new) over the keys returned by `update`."""
+        query_slots = self._new_slots(num_new)[:, None]
+        key_slots = torch.cat([self.ring_slots, self._new_slots(num_new)])
+        valid = (key_slots >= 0) & (key_slots >= self.padding[:, None])
+        # Padding queries attend to themselves only, so they never produce NaNs
+        allowed = valid[:, None, None, :] | (key_slots == query_slots)
+        return allowed & (key_slots <= query_slots) & (key_slots > query_slots - self.window_size)
+
+    def update(self, layer_idx: int, k: torch.Tensor, v: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the ring's keys/values followed by the new ones (the queries may need ring entries
+        that the new tokens overwrite), then store the last `window_size` new tokens in the ring.
+        """
+        keys = torch.cat([self.keys[layer_idx], k.to(self.keys.dtype)], dim=-2)
+        values = torch.cat([self.values[layer_idx], v.to(self.values.dtype)], dim=-2)
+
+        num_kept = min(k.shape[-2], self.window_size)
+        ring_idx = self._new_slots(k.shape[-2])[-num_kept:] % self.window_size
+        self.keys[layer_idx, :, :, ring_idx] = keys[:, :, -num_kept:]
+        self.values[layer_idx, :, :, ring_idx] = values[:, :, -num_kept:]
+        return keys, values
+
+    def advance(self, num_new: int):
+        num_kept = min(num_new, self.window_size)
+        new_slots = self._new_slots(num_new)[-num_kept:]
+        self.ring_slots[new_slots % self.window_size] = new_slots
+        self.length += num_new
+
+    def truncate(self, length: int):
+        raise NotImplementedError("tokens overwritten in a ring buffer cannot be restored")
+
+
+# Queries per block when attention is computed blockwise without a sliding window
+_ATTENTION_BLOCK_SIZE = 256
+
+
+class MultiHeadSelfAttention(nn.Module):
+    def __init__(
+        self,
+        d_model: int,
+        num_heads: int,
+        rope: RotaryPositionalEmbedding | None = None,
+        num_kv_heads: int | None = None,
+        window_size: int | None = None,
+        layer_idx: int = 0,
+        device=None,
+        dtype=None,
+    ):
+        super().__init__()
+        assert d_model % num_heads == 0
+
+        self.d_model = d_model
+        self.num_heads = num_heads
+        self.d_k = d_model // num_heads
+        # Grouped-query attention: each key/value head is shared by num_heads // num_kv_heads
+        # query heads (1 for standard multi-head attention, num_heads for multi-query attention)
+        self.num_kv_heads = num_kv_heads or num_heads
+        assert num_heads % self.num_kv_heads == 0
+        # Sliding-window attention: each query attends to itself and the window_size - 1 tokens before it
+        self.window_size = window_size
+        # Index of this layer's buffers in a KVCache
+        self.layer_idx = layer_idx
+
+        d_kv = self.num_kv_heads * self.d_k
+        self.q_proj = Linear(d_model, d_model, device=device, dtype=dtype)
+        self.k_proj = Linear(d_model, d_kv, device=device, dtype=dtype)
+        self.v_proj = Linear(d_model, d_kv, device=device, dtype=dtype)
+        self.output_proj = Linear(d_model, d_model, device=device, dtype=dtype)
+
+        self.rope = rope
+
+    def forward(
+        self,
+        x: torch.Tensor,
+        token_positions: torch.Tensor | None = None,
+        kv_cache: KVCache | None = None,
+        document_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        :param x: (..., seq_len, d_model)
+        :param token_positions: (..., seq_len) RoPE positions, default 0..seq_len-1
+        :param kv_cache: if given, `x` continues the sequence stored in the cache: its keys and
+            values are appended and it attends to all cached tokens
+        :param document_ids: optional (batch, seq_len) ids of the packed document each token
+            belongs to; tokens only attend to earlier tokens of the same document
+        :return: (..., seq_len, d_model)
+        """
+        *batch, seq_len, _ = x.shape
+
+        # Reshape: (..., seq_len, num_heads * d_k) -> (..., num_heads, seq_len, d_k)
+        def split_heads(t, num_heads):
+            return t.view(*batch, seq_len, num_heads, self.d_k).transpose(-3, -2)
+
+        q = split_heads(self.q_proj(x), self.num_heads)
+        k = split_heads(self.k_proj(x), self.num_kv_heads)
+        v = split_heads(self.v_proj(x), self.num_kv_heads)
+
+        # Apply RoPE
+        if self.rope is not None:
+            if token_positions is None:
+                token_positions = torch.arange(seq_len, device=x.device)
+            # Broadcast the positions over the head dimension
+            token_positions = token_positions.unsqueeze(-2)
+            q = self.rope(q, token_positions)
+            k = self.rope(k, token_positions)
+
+        if kv_cache is not None:
+            k, v = kv_cache.update(self.layer_idx, k, v)
+            attn_output = self._attend(q, k, v, kv_cache.mask(seq_len))
+        elif document_ids is not None or (self.window_size is not None and seq_len > self.window_size):
+            attn_output = self._blocked_attend(q, k, v, document_ids)
+        else:
+            # Create causal mask
+            mask = torch.ones(seq_len, seq_len, device=x.device, dtype=torch.bool).tril()
+            attn_output = self._attend(q, k, v, mask)
+
+        # Merge heads: (..., num_heads, seq_len, d_k) -> (..., seq_len, d_model)
+        attn_output = attn_output.transpose(-3, -2).reshape(*batch, seq_len, self.d_model)
+
+        return self.output_proj(attn_output)
+
+    def _attend(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        if self.num_kv_heads == self.num_heads:
+            return scaled_dot_product_attention(q, k, v, mask=mask)
+        # Group the query heads by the key/value head they share and broadcast the keys and
+        # values over each group, instead of materializing them once per query head
+        group_size = self.num_heads // self.num_kv_heads
+        q = q.unflatten(-3, (self.num_kv_heads, group_size))
+        k, v, mask = k.unsqueeze(-3), v.unsqueeze(-3), mask.unsqueeze(-3)
+        return scaled_dot_product_attention(q, k, v, mask=mask).flatten(-4, -3)
+
+    def _blocked_attend(
+        self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, document_ids: torch.Tensor | None
+    ) -> torch.Tensor:
+        """
+        Causal attention restricted to the sliding window and/or to same-document tokens,
+        computed in blocks of queries. Each block only reads keys from the earliest position any
+        of its queries can see, so blocks that are entirely out of window or in earlier documents
+        are never computed: the cost is O(seq_len * window_size) with a window, and with packed
+        documents it shrinks with the document lengths.
+        """
+        seq_len, window = q.shape[-2], self.window_size
+        block_size = window or _ATTENTION_BLOCK_SIZE
+        positions = torch.arange(seq_len, device=q.device)
+        if document_ids is not None:
+            # Position where the document of each token starts: (batch, seq_len)
+            is_start = torch.ones_like(document_ids, dtype=torch.bool)
+            is_start[..., 1:] = document_ids[..., 1:] != document_ids[..., :-1]
+            document_starts = torch.where(is_start, positions, 0).cummax(dim=-1).values
+
+        outputs = []
+        for start in range(0, seq_len, block_size):
+            end = min(start + block_size, seq_len)
+            key_start = max(0, start - window + 1) if window is not None else 0
+            if document_ids is not None:
+                key_start = max(key_start, int(document_starts[..., start].min()))
+
+            query_pos, key_pos = positions[start:end, None], positions[key_start:end]
+            mask = key_pos <= query_pos
+            if window is not None:
+                mask = mask & (key_pos > query_pos - window)
+            if document_ids is not None:
+                same_document = document_ids[..., start:end, None] == document_ids[..., None, key_start:end]
+                # (batch, 1, queries, keys), broadcast over the heads
+                mask = (mask & same_document).unsqueeze(-3)
+            outputs.append(
+                self._attend(q[..., start:end, :], k[..., key_start:end, :], v[..., key_start:end, :], mask)
+            )
+        return torch.cat(outputs, dim=-2)
+
+
+class TransformerBlock(nn.Module):
+    def __init__(
+        self,
+        d_model: int,
+        num_heads: int,
+        d_ff: int,
+        rope: RotaryPositionalEmbedding | None = None,
+        num_kv_heads: int | None = None,
+        window_size: int | None = None,
+        layer_idx: int = 0,
+        device=None,
+        dtype=None,
+    ):
+        super().__init__()
+        self.ln1 = RMSNorm(d_model, device=device, dtype=dtype)
+        self.attn = MultiHeadSelfAttention(
+            d_model,
+            num_heads,
+            rope=rope,
+            num_kv_heads=num_kv_heads,
+            window_size=window_size,
+            layer_idx=layer_idx,
+            device=device,
+            dtype=dtype,
+        )
+        self.ln2 = RMSNorm(d_model, device=device, dtype=dtype)
+        self.ffn = SwiGLU(d_model, d_ff, device=device, dtype=dtype)
+
+        # Activation recompute policy, see TransformerLM.set_recompute
+        self.recompute: str | None = None
+
+    def forward(
+        self,
+        x: torch.Tensor,
+        token_positions: torch.Tensor | None = None,
+        kv_cache: KVCache | None = None,
+        document_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        if self.recompute == "block" and torch.is_grad_enabled():
+            # Keep only the block input; everything inside is recomputed during backward
+            return checkpoint(self._forward, x, token_positions, kv_cache, document_ids, use_reentrant=False)
+        return self._forward(x, token_positions, kv_cache, document_ids)
+
+    def _forward(
+        self,
+        x: torch.Tensor,
+        token_positions: torch.Tensor | None,
+        kv_cache: KVCache | None,
+        document_ids: torch.Tensor | None,
+    ) -> torch.Tensor:
+        # Sublayer 1: MHA with residual
+        if self.recompute == "attn" and torch.is_grad_enabled():
+            # Drop the (seq_len, seq_len) attention scores and weights, recompute them in backward
+            x = x + checkpoint(self.attn, self.ln1(x), token_positions, kv_cache, document_ids, use_reentrant=False)
+        else:
+            x = x + self.attn(self.ln1(x), token_positions, kv_cache, document_ids)
+
+        # Sublayer 2: FF with residual
+        x = x + self.ffn(self.ln2(x))
+
+        return x
+
+
+class TransformerLM(nn.Module):
+    def __init__(
+        self,
+        vocab_size: int,
+        context_length: int,
+        d_model: int,
+        num_layers: int,
+        num_heads: int,
+        d_ff: int,
+        rope_theta: float = 10000.0,
+        num_kv_heads: int | None = None,
+        window_size: int | None = None,
+        autocast_dtype: torch.dtype | None = None,
+        recompute: str | None = None,
+        recompute_every: int = 1,
+        compile: bool = False,
+        device=None,
+        dtype=None,
+    ):
+        super().__init__()
+        self.vocab_size = vocab_size
+        self.context_length = context_length
+        # e.g. torch.bfloat16: run matmuls under autocast while the parameters
+        # (master weights), RMSNorm and softmax stay in fp32
+        self.autocast_dtype = autocast_dtype
+
+        self.token_embeddings = Embedding(vocab_size, d_model, device=device, dtype=dtype)
+
+        # One RoPE table shared by every layer
+        rope = RotaryPositionalEmbedding(rope_theta, d_model // num_heads, context_length, device=device)
+        self.layers = nn.ModuleList(
+            [
+                TransformerBlock(
+                    d_model,
+                    num_heads,
+                    d_ff,
+                    rope=rope,
+                    num_kv_heads=num_kv_heads,
+                    window_size=window_size,
+                    layer_idx=i,
+                    device=device,
+                    dtype=dtype,
+                )
+                for i in range(num_layers)
+            ]
+        )
+
+        self.ln_final = RMSNorm(d_model, device=device, dtype=dtype)
+        self.lm_head = Linear(d_model, vocab_size, device=device, dtype=dtype)
+        self.set_recompute(recompute, recompute_every)
+        if compile:
+            self.compile_blocks()
+
+    def set_recompute(self, policy: str | None, every: int = 1):
+        """
+        Choose which activations are recomputed during backward instead of kept from forward.
+
+        Args:
+            policy: None (keep everything), "block" (keep only each block's input) or
+                "attn" (recompute just the attention sublayer, whose activations grow with seq_len^2).
+            every: apply the policy to every `every`-th block (0, every, 2 * every, ...) only,
+                trading memory against recompute time.
+        """
+        assert policy in (None, "block", "attn"), f"unknown recompute policy {policy!r}"
+        assert every >= 1
+        for i, layer in enumerate(self.layers):
+            layer.recompute = policy if i % every == 0 else None
+
+    def compile_blocks(self, mode: str | None = None, backend="inductor"):
+        """
+        Compile each transformer block and the final norm with `torch.compile`, so that
+        RMSNorm, RoPE and SwiGLU are fused into fewer kernels. The blocks share their code,
+        so one graph is traced and reused by every layer.
+
+        Sequence length is treated as dynamic, so truncated inputs (e.g. evaluation on a shorter
+        tail) do not trigger a recompile. The chunked loss stays eager. Inductor's on-disk caches
+        are process-wide settings and are left to the caller (see `train.py`).
+
+        Args:
+            mode: passed to `torch.compile`, e.g. "max-autotune".
+        """
+        for layer in self.layers:
+            layer.compile(dynamic=True, mode=mode, backend=backend)
+        self.ln_final.compile(dynamic=True, mode=mode, backend=backend)
+
+    def warmup(self, batch_size: int, seq_lens: list[int] | None = None):
+        """
+        Run a forward and backward pass for each sequence length in `seq_lens` (default: the
+        context length), so that compilation happens here rather than in the first timed steps.
+        Gradients already accumulated are restored afterwards and the RNG state is left untouched.
+        """
+        grads = [p.grad for p in self.parameters()]
+        self.zero_grad(set_to_none=True)
+        device = self.ln_final.weight.device
+        for seq_len in seq_lens or [self.context_length]:
+            in_indices = torch.zeros(batch_size, seq_len, dtype=torch.long, device=device)
+            self.loss(in_indices, in_indices).backward()
+        for p, grad in zip(self.parameters(), grads):
+            p.grad = grad
+
+    def init_kv_cache(
+        self, batch_size: int, max_seq_len: int, padding: torch.Tensor | None = None, quantize: bool = False
+    ) -> KVCache | RingKVCache:
+        """
+        Empty KV cache for `batch_size` sequences of up to `max_seq_len` tokens (see KVCache).
+        With sliding-window attention this is a RingKVCache holding only the last window.
+        With `quantize`, keys and values are stored in int8.
+        """
+        attn = self.layers[0].attn
+        args = (len(self.layers), batch_size, attn.num_kv_heads, attn.d_k)
+        kwargs = {
+            "padding": padding,
+            "quantize": quantize,
+            "device": self.ln_final.weight.device,
+            "dtype": self.autocast_dtype or self.ln_final.weight.dtype,
+        }
+        if attn.window_size is not None:
+            return RingKVCache(*args, attn.window_size, **kwargs)
+        return KVCache(*args, max_seq_len, **kwargs)
+
+    def _autocast(self, device: torch.device):
+        return torch.autocast(device.type, dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None)
+
+    def hidden_states(
+        self,
+        in_indices: torch.Tensor,
+        kv_cache: KVCache | None = None,
+        document_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        :param in_indices: (batch, seq_len)
+        :param kv_cache: if given, `in_indices` continue the sequences stored in the cache,
+            which is advanced past them
+        :param document_ids: optional (batch, seq_len) document of each token, for packed
+            sequences (see `get_packed_batch`): attention never crosses document boundaries
+        :return: (batch, seq_len, d_model) final normalized hidden states, before the LM head
+        """
+        assert kv_cache is None or document_ids is None, "packed documents are not supported with a KV cache"
+        seq_len = in_indices.shape[-1]
+        if kv_cache is not None:
+            token_positions = kv_cache.positions(seq_len)
+        else:
+            # Positions need not restart per document: RoPE scores only depend on relative positions
+            token_positions = torch.arange(seq_len, device=in_indices.device)
+
+        with self._autocast(in_indices.device):
+            x = self.token_embeddings(in_indices)
+            for layer in self.layers:
+                x = layer(x, token_positions, kv_cache, document_ids)
+        # The final norm (and the LM head in `forward`) run outside autocast, so the hidden
+        # states and logits stay in the parameters' dtype
+        x = self.ln_final(x.to(self.ln_final.weight.dtype))
+
+        if kv_cache is not None:
+            kv_cache.advance(seq_len)
+        return x
+
+    def forward(
+        self,
+        in_indices: torch.Tensor,
+        kv_cache: KVCache | None = None,
+        document_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        :param in_indices: (batch, seq_len)
+        :param kv_cache, document_ids: see `hidden_states`
+        :return: (batch, seq_len, vocab_size), in the parameters' dtype even with `autocast_dtype` set
+        """
+        return self.lm_head(self.hidden_states(in_indices, kv_cache, document_ids))
+
+    def loss(
+        self,
+        in_indices: torch.Tensor,
+        targets: torch.Tensor,
+        chunk_size: int = 1024,
+        document_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        Average next-token cross entropy, computed with the LM head fused into the loss
+        so that the (batch, seq_len, vocab_size) logits are never materialized.
+        """
+        # A quantized LM head (see quantization.py) has no `weight`, only a dequantized copy
+        lm_head_weight = self.lm_head.dequantize() if hasattr(self.lm_head, "dequantize") else self.lm_head.weight
+        return chunked_cross_entropy(
+            self.hidden_states(in_indices, document_ids=document_ids),
+            lm_head_weight,
+            targets,
+            chunk_size,
+            compute_dtype=self.autocast_dtype,
+        )
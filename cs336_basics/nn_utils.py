@@ -0,0 +1,162 @@
+from collections.abc import Iterable
+
+import torch
+
+
+def global_grad_norm(tensors: list[torch.Tensor]) -> torch.Tensor:
+    """
+    L2 norm over all `tensors` taken together, as a 0-dim float32 tensor.
+
+    Per-tensor norms come from one `torch._foreach_norm` call per (device, dtype) group
+    and are combined with a single stack, so nothing is synchronized with the host.
+    """
+    groups: dict[tuple[torch.device, torch.dtype], list[torch.Tensor]] = {}
+    for t in tensors:
+        groups.setdefault((t.device, t.dtype), []).append(t)
+
+    device = tensors[0].device
+    norms = []
+    for group in groups.values():
+        norms.extend(n.to(device=device, dtype=torch.float32) for n in torch._foreach_norm(group))
+    return torch.linalg.vector_norm(torch.stack(norms))
+
+
+@torch.no_grad()
+def clip_gradients(
+    parameters: Iterable[torch.nn.Parameter], max_l2_norm: float, eps: float = 1e-6
+) -> torch.Tensor | None:
+    """
+    Clip the combined gradient of `parameters` in place to an L2 norm of at most `max_l2_norm`.
+
+    Gradients are scaled by `max_l2_norm / (total_norm + eps)` when the total norm exceeds
+    `max_l2_norm`. The scale is applied with `torch._foreach_mul_` whether or not clipping
+    is needed, so the decision never requires a device-to-host sync.
+
+    Returns:
+        The total gradient norm before clipping as a 0-dim tensor (call `.item()` only if
+        the value is needed on the host), or None if no parameter has a gradient.
+    """
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if not grads:
+        return None
+
+    total_norm = global_grad_norm(grads)
+    clip_coef = (max_l2_norm / (total_norm + eps)).clamp(max=1.0)
+
+    groups: dict[tuple[torch.device, torch.dtype], list[torch.Tensor]] = {}
+    for g in grads:
+        groups.setdefault((g.device, g.dtype), []).append(g)
+    for (device, dtype), group in groups.items():
+        torch._foreach_mul_(group, clip_coef.to(device=device, dtype=dtype))
+    return total_norm
+
+
+def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
+    """
+    Numerically stable softmax over dimension `dim`. The reduction is done in fp32
+    and the result is returned in the input dtype.
+    """
+    in_dtype = x.dtype
+    x = x.float()
+    x_max = torch.amax(x, dim, keepdim=True)
+    exp_x = torch.exp(x - x_max)
+    return (exp_x / torch.sum(exp_x, dim, keepdim=True)).to(in_dtype)
+
+
+def cross_entropy(logits: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+    """
+    Average cross entropy between `logits` (..., vocab_size) and integer `targets` (...).
+    """
+    logits = logits.float()
+    lse = torch.logsumexp(logits, dim=-1)
+    target_logits = logits.gather(-1, targets.unsqueeze(-1)).squeeze(-1)
+    return (lse - target_logits).mean()
+
+
+class _ChunkedLMHeadCrossEntropy(torch.autograd.Function):
+    """
+    cross_entropy(hidden @ weight.T, targets) computed `chunk_size` rows at a time.
+
+    Forward keeps only the per-row log-sum-exp; backward recomputes each chunk's logits
+    and turns them into the softmax gradient in place, so at most a (chunk_size, vocab_size)
+    block of logits exists at any time. The matmuls run in `compute_dtype` and everything
+    else in fp32, independently of any surrounding autocast region.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, targets, chunk_size: int, compute_dtype: torch.dtype):
+        num_rows = hidden.shape[0]
+        w = weight.to(compute_dtype)
+        lse = torch.empty(num_rows, device=hidden.device, dtype=torch.float32)
+        loss = torch.zeros((), device=hidden.device, dtype=torch.float32)
+        with torch.autocast(hidden.device.type, enabled=False):
+            for start in range(0, num_rows, chunk_size):
+                end = min(start + chunk_size, num_rows)
+                logits = (hidden[start:end].to(compute_dtype) @ w.T).float()
+                lse[start:end] = torch.logsumexp(logits, dim=-1)
+                target_logits = logits.gather(-1, targets[start:end].unsqueeze(-1)).squeeze(-1)
+                loss += (lse[start:end] - target_logits).sum()
+
+        ctx.save_for_backward(hidden, weight, targets, lse)
+        ctx.chunk_size = chunk_size
+        ctx.compute_dtype = compute_dtype
+        return loss / num_rows
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor):
+        hidden, weight, targets, lse = ctx.saved_tensors
+        num_rows = hidden.shape[0]
+        scale = grad_output / num_rows
+        compute_dtype = ctx.compute_dtype
+        w = weight.to(compute_dtype)
+
+        grad_hidden = torch.empty_like(hidden) if ctx.needs_input_grad[0] else None
+        grad_weight = None
+        if ctx.needs_input_grad[1]:
+            grad_weight = torch.zeros(weight.shape, device=weight.device, dtype=torch.float32)
+        with torch.autocast(hidden.device.type, enabled=False):
+            for start in range(0, num_rows, ctx.chunk_size):
+                end = min(start + ctx.chunk_size, num_rows)
+                h = hidden[start:end].to(compute_dtype)
+                # d loss / d logits = (softmax(logits) - one_hot(targets)) / num_rows
+                grad_logits = (h @ w.T).float().sub_(lse[start:end].unsqueeze(-1)).exp_()
+                rows = torch.arange(end - start, device=grad_logits.device)
+                grad_logits[rows, targets[start:end]] -= 1
+                grad_logits = grad_logits.mul_(scale).to(compute_dtype)
+
+                if grad_hidden is not None:
+                    grad_hidden[start:end] = (grad_logits @ w).to(hidden.dtype)
+                if grad_weight is not None:
+                    grad_weight += (grad_logits.T @ h).float()
+
+        if grad_weight is not None:
+            grad_weight = grad_weight.to(weight.dtype)
+        return grad_hidden, grad_weight, None, None, None
+
+
+def chunked_cross_entropy(
+    hidden: torch.Tensor,
+    weight: torch.Tensor,
+    targets: torch.Tensor,
+    chunk_size: int = 1024,
+    compute_dtype: torch.dtype | None = None,
+) -> torch.Tensor:
+    """
+    Average cross entropy of the LM head `hidden @ weight.T` against `targets`,
+    without materializing the full (..., vocab_size) logits.
+
+    Args:
+        hidden: (..., d_model) final hidden states (after the last norm).
+        weight: (vocab_size, d_model) LM head weight.
+        targets: (...) integer next-token targets.
+        chunk_size: number of positions whose logits are materialized at once.
+        compute_dtype: dtype of the LM head matmuls (default: the dtype of `weight`),
+            e.g. torch.bfloat16 for mixed-precision training. The log-sum-exp is always fp32.
+    """
+    return _ChunkedLMHeadCrossEntropy.apply(
+        hidden.reshape(-1, hidden.shape[-1]),
+        weight,
+        targets.reshape(-1),
+        chunk_size,
+        compute_dtype or weight.dtype,
+    )
@@ -0,0 +1,424 @@
+import itertools
+import math
+from collections.abc import Callable
+
+import numpy as np
+import numpy.typing as npt
+import torch
+from torch.optim import Optimizer
+
+from cs336_basics.nn_utils import global_grad_norm
+
+
+class AdamW(Optimizer):
+    """
+    AdamW with decoupled weight decay (Loshchilov & Hutter, 2019).
+
+    State is kept per parameter as `step`, `exp_avg` (m) and `exp_avg_sq` (v).
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.01):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError(f"Invalid betas: {betas}")
+        defaults = {"lr": lr, "betas": betas, "eps": eps, "weight_decay": weight_decay}
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure: Callable | None = None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            eps = group["eps"]
+            lr = group["lr"]
+            weight_decay = group["weight_decay"]
+
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                grad = param.grad
+                if grad.is_sparse:
+                    raise RuntimeError("AdamW does not support sparse gradients")
+
+                state = self.state[param]
+                if len(state) == 0:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(param)  # m
+                    state["exp_avg_sq"] = torch.zeros_like(param)  # v
+
+                state["step"] += 1
+                step = state["step"]
+                m, v = state["exp_avg"], state["exp_avg_sq"]
+
+                # Apply weight decay
+                if weight_decay != 0:
+                    param.mul_(1 - lr * weight_decay)
+
+                # Update first and second moment estimates
+                m.lerp_(grad, 1 - beta1)
+                v.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+                # Compute bias correction
+                bias_correction1 = 1 - beta1**step
+                bias_correction2 = 1 - beta2**step
+
+                # Parameter update
+                denom = (v.sqrt() / math.sqrt(bias_correction2)).add_(eps)
+                param.addcdiv_(m, denom, value=-lr / bias_correction1)
+
+        return loss
+
+
+def _stochastic_round_(out: torch.Tensor, src: torch.Tensor) -> torch.Tensor:
+    """
+    Write the float32 tensor `src` into the bfloat16 tensor `out` with stochastic rounding.
+
+    bfloat16 is the upper half of a float32, so adding uniform noise to the lower 16 bits
+    before truncating rounds up with probability proportional to the discarded fraction.
+    This keeps tiny moment updates (e.g. (1 - beta2) * g^2) from being rounded away.
+    """
+    bits = src.contiguous().view(torch.int32)
+    noise = torch.randint(0, 1 << 16, bits.shape, dtype=torch.int32, device=bits.device)
+    rounded = (bits + noise).bitwise_and_(-65536)
+    # The lower 16 bits are now zero, so the cast to bfloat16 is exact.
+    return out.copy_(rounded.view(torch.float32))
+
+
+class FlatAdamW(Optimizer):
+    """
+    AdamW whose moment estimates live in one flat contiguous buffer per
+    (param group, device, dtype) bucket.
+
+    The update is computed on the flat buffers in a handful of large kernels instead of
+    several small ones per parameter. With `bf16_states=True` the moments are stored in
+    bfloat16 (written with stochastic rounding), halving optimizer memory relative to fp32.
+
+    Buckets are updated `chunk_size` elements at a time, so the gradient copies and the fp32
+    temporaries of the update stay bounded by the chunk rather than growing with the bucket.
+    As in `AdamW`, parameters without a gradient are skipped: their moments, values and step
+    count are left untouched.
+
+    `self.state[p]["exp_avg"]` / `["exp_avg_sq"]` are views into the flat buffers, and
+    `state_dict()` materializes them per parameter in the parameter's dtype, so checkpoints
+    have the same layout as `AdamW` and can be loaded by either optimizer.
+
+    With `max_grad_norm` set, the gradient copies are clipped to that global L2 norm inside
+    `step()`, which replaces a separate `clip_gradients` pass over `p.grad`.
+    """
+
+    def __init__(
+        self,
+        params,
+        lr=1e-3,
+        betas=(0.9, 0.999),
+        eps=1e-8,
+        weight_decay=0.01,
+        bf16_states=False,
+        max_grad_norm: float | None = None,
+        chunk_size: int = 1 << 22,
+    ):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError(f"Invalid betas: {betas}")
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+        defaults = {"lr": lr, "betas": betas, "eps": eps, "weight_decay": weight_decay}
+        super().__init__(params, defaults)
+        self.bf16_states = bf16_states
+        self.max_grad_norm = max_grad_norm
+        self.chunk_size = chunk_size
+        self._buckets: list[dict] | None = None
+
+    def _state_dtype(self, param_dtype: torch.dtype) -> torch.dtype:
+        return torch.bfloat16 if self.bf16_states else param_dtype
+
+    def _build_buckets(self) -> list[dict]:
+        """
+        Allocate the flat moment buffers and point the per-parameter state at views of them.
+        Any per-parameter state that already exists (e.g. after `load_state_dict`) is copied in.
+        """
+        buckets = []
+        for group in self.param_groups:
+            by_key: dict[tuple[torch.device, torch.dtype], list[torch.Tensor]] = {}
+            for param in group["params"]:
+                by_key.setdefault((param.device, param.dtype), []).append(param)
+
+            for (device, dtype), params in by_key.items():
+                numels = [p.numel() for p in params]
+                state_dtype = self._state_dtype(dtype)
+                exp_avg = torch.zeros(sum(numels), device=device, dtype=state_dtype)
+                exp_avg_sq = torch.zeros(sum(numels), device=device, dtype=state_dtype)
+
+                for p, m, v in zip(params, exp_avg.split(numels), exp_avg_sq.split(numels)):
+                    state = self.state[p]
+                    if "exp_avg" in state:
+                        m.copy_(state["exp_avg"].reshape(-1))
+                        v.copy_(state["exp_avg_sq"].reshape(-1))
+                    state["step"] = int(state.get("step", 0))
+                    state["exp_avg"] = m.view_as(p)
+                    state["exp_avg_sq"] = v.view_as(p)
+
+                offsets = [0]
+                for n in numels[:-1]:
+                    offsets.append(offsets[-1] + n)
+                buckets.append(
+                    {
+                        "group": group,
+                        "params": params,
+                        "offsets": offsets,
+                        "exp_avg": exp_avg,
+                        "exp_avg_sq": exp_avg_sq,
+                    }
+                )
+        return buckets
+
+    def _chunks(self, bucket: dict, active: list[int]):
+        """
+        Split the `active` parameters of `bucket` into chunks of at most `chunk_size` elements
+        that are contiguous in the flat buffers. A chunk is a list of (index, start, end):
+        elements start:end of the flattened parameter `bucket["params"][index]`.
+        """
+        params, offsets = bucket["params"], bucket["offsets"]
+        chunk, chunk_numel, next_offset = [], 0, None
+        for i in active:
+            if chunk and offsets[i] != next_offset:
+                yield chunk
+                chunk, chunk_numel = [], 0
+            start, numel = 0, params[i].numel()
+            while start < numel:
+                end = min(numel, start + self.chunk_size - chunk_numel)
+                chunk.append((i, start, end))
+                chunk_numel += end - start
+                start = end
+                if chunk_numel == self.chunk_size:
+                    yield chunk
+                    chunk, chunk_numel = [], 0
+            next_offset = offsets[i] + numel
+        if chunk:
+            yield chunk
+
+    def add_param_group(self, param_group: dict):
+        super().add_param_group(param_group)
+        self._buckets = None
+
+    def load_state_dict(self, state_dict: dict):
+        super().load_state_dict(state_dict)
+        # The loaded per-parameter tensors are copied into fresh flat buffers on the next step.
+        self._buckets = None
+
+    def state_dict(self) -> dict:
+        state_dict = super().state_dict()
+        params = [p for group in self.param_groups for p in group["params"]]
+        # `super().state_dict()` aliases our live state dicts, so build new ones
+        # instead of mutating them.
+        state_dict["state"] = {
+            index: {
+                key: value.to(params[index].dtype, copy=True) if torch.is_tensor(value) else value
+                for key, value in param_state.items()
+            }
+            for index, param_state in state_dict["state"].items()
+        }
+        return state_dict
+
+    @torch.no_grad()
+    def step(self, closure: Callable | None = None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        if self._buckets is None:
+            self._buckets = self._build_buckets()
+
+        # Parameters without a gradient this step are skipped, as in the per-parameter AdamW
+        pending = []
+        for bucket in self._buckets:
+            active = [i for i, p in enumerate(bucket["params"]) if p.grad is not None]
+            if not active:
+                continue
+            if any(bucket["params"][i].grad.is_sparse for i in active):
+                raise RuntimeError("FlatAdamW does not support sparse gradients")
+            pending.append((bucket, active))
+
+        # Clip the gradient copies by the global norm; `p.grad` itself is left as is
+        clip_coef = None
+        if self.max_grad_norm is not None and pending:
+            total_norm = global_grad_norm([bucket["params"][i].grad for bucket, active in pending for i in active])
+            clip_coef = (self.max_grad_norm / (total_norm + 1e-6)).clamp(max=1.0)
+
+        for bucket, active in pending:
+            params = bucket["params"]
+            group = bucket["group"]
+            beta1, beta2 = group["betas"]
+            eps = group["eps"]
+            lr = group["lr"]
+            weight_decay = group["weight_decay"]
+
+            for i in active:
+                self.state[params[i]]["step"] += 1
+
+            for chunk in self._chunks(bucket, active):
+                first, first_start, _ = chunk[0]
+                offset = bucket["offsets"][first] + first_start
+                numels = [end - start for _, start, end in chunk]
+                exp_avg = bucket["exp_avg"][offset : offset + sum(numels)]
+                exp_avg_sq = bucket["exp_avg_sq"][offset : offset + sum(numels)]
+                param_slices = [params[i].view(-1)[start:end] for i, start, end in chunk]
+
+                grad = torch.cat([params[i].grad.reshape(-1)[start:end] for i, start, end in chunk])
+                if self.bf16_states:
+                    grad = grad.float()
+                if clip_coef is not None:
+                    grad.mul_(clip_coef.to(device=grad.device, dtype=grad.dtype))
+
+                if self.bf16_states:
+                    m = exp_avg.float()
+                    v = exp_avg_sq.float()
+                else:
+                    m, v = exp_avg, exp_avg_sq
+
+                # Update first and second moment estimates over the whole chunk
+                m.lerp_(grad, 1 - beta1)
+                v.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+                if self.bf16_states:
+                    _stochastic_round_(exp_avg, m)
+                    _stochastic_round_(exp_avg_sq, v)
+
+                # Apply weight decay as one multi-tensor kernel
+                if weight_decay != 0:
+                    torch._foreach_mul_(param_slices, 1 - lr * weight_decay)
+
+                # Bias correction depends on the step count, which differs for parameters that
+                # skipped steps, so the update is computed per run of parameters with equal steps
+                steps = [self.state[params[i]]["step"] for i, _, _ in chunk]
+                run_start = 0
+                for step, run in itertools.groupby(zip(numels, param_slices, steps), key=lambda item: item[2]):
+                    run_numels, run_params, _ = zip(*run)
+                    run_end = run_start + sum(run_numels)
+                    bias_correction1 = 1 - beta1**step
+                    bias_correction2 = 1 - beta2**step
+
+                    m_run, v_run = m[run_start:run_end], v[run_start:run_end]
+                    update = m_run / (v_run.sqrt() / math.sqrt(bias_correction2)).add_(eps)
+                    updates = [u.to(p.dtype) for u, p in zip(update.split(list(run_numels)), run_params)]
+                    torch._foreach_add_(list(run_params), updates, alpha=-lr / bias_correction1)
+                    run_start = run_end
+
+        return loss
+
+
+def lr_cosine_schedule(
+    it: npt.ArrayLike,
+    max_learning_rate: npt.ArrayLike,
+    min_learning_rate: npt.ArrayLike,
+    warmup_iters: npt.ArrayLike,
+    cosine_cycle_iters: npt.ArrayLike,
+) -> np.ndarray:
+    """
+    Vectorized cosine learning rate schedule with linear warmup.
+
+    All arguments broadcast against each other, so a whole curve (`it=np.arange(T)`)
+    or a sweep over configurations (e.g. `max_learning_rate[:, None]`) is evaluated
+    in a single call.
+    """
+    t = np.asarray(it, dtype=np.float64)
+    alpha_max = np.asarray(max_learning_rate, dtype=np.float64)
+    alpha_min = np.asarray(min_learning_rate, dtype=np.float64)
+    T_w = np.asarray(warmup_iters, dtype=np.float64)
+    T_c = np.asarray(cosine_cycle_iters, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        warmup = t / T_w * alpha_max
+        progress = (t - T_w) / (T_c - T_w)
+        cosine = alpha_min + 0.5 * (1 + np.cos(progress * math.pi)) * (alpha_max - alpha_min)
+
+    return np.where(t < T_w, warmup, np.where(t <= T_c, cosine, alpha_min))
+
+
+def get_lr_cosine_schedule(
+    it: int,
+    max_learning_rate: float,
+    min_learning_rate: float,
+    warmup_iters: int,
+    cosine_cycle_iters: int,
+) -> float:
+    """
+    Learning rate at iteration `it` of a cosine schedule with linear warmup.
+    """
+    if it < warmup_iters:
+        return it / warmup_iters * max_learning_rate
+    if it <= cosine_cycle_iters:
+        progress = (it - warmup_iters) / (cosine_cycle_iters - warmup_iters)
+        return min_learning_rate + 0.5 * (1 + math.cos(progress * math.pi)) * (max_learning_rate - min_learning_rate)
+    return min_learning_rate
+
+
+class CosineLRScheduler:
+    """
+    Cosine learning rate schedule with linear warmup, precomputed as a table.
+
+    The whole curve for iterations `0..cosine_cycle_iters` is evaluated once with
+    `lr_cosine_schedule`, so `get_lr` is a table lookup and `step()` sets the learning
+    rate of every param group of `optimizer` in one call.
+    """
+
+    def __init__(
+        self,
+        optimizer: Optimizer,
+        max_learning_rate: float,
+        min_learning_rate: float,
+        warmup_iters: int,
+        cosine_cycle_iters: int,
+        last_iter: int = -1,
+    ):
+        self.optimizer = optimizer
+        self.max_learning_rate = max_learning_rate
+        self.min_learning_rate = min_learning_rate
+        self.warmup_iters = warmup_iters
+        self.cosine_cycle_iters = cosine_cycle_iters
+        self.table = lr_cosine_schedule(
+            np.arange(cosine_cycle_iters + 1), max_learning_rate, min_learning_rate, warmup_iters, cosine_cycle_iters
+        ).tolist()
+        self.last_iter = last_iter
+        self.step()
+
+    def get_lr(self, it: int) -> float:
+        if it < len(self.table):
+            return self.table[it]
+        return self.min_learning_rate
+
+    def step(self) -> float:
+        """
+        Advance to the next iteration and write its learning rate into every param group.
+        """
+        self.last_iter += 1
+        lr = self.get_lr(self.last_iter)
+        for group in self.optimizer.param_groups:
+            group["lr"] = lr
+        return lr
+
+    def state_dict(self) -> dict:
+        return {
+            "max_learning_rate": self.max_learning_rate,
+            "min_learning_rate": self.min_learning_rate,
+            "warmup_iters": self.warmup_iters,
+            "cosine_cycle_iters": self.cosine_cycle_iters,
+            "last_iter": self.last_iter,
+        }
+
+    def load_state_dict(self, state_dict: dict):
+        self.__init__(
+            self.optimizer,
+            state_dict["max_learning_rate"],
+            state_dict["min_learning_rate"],
+            state_dict["warmup_iters"],
+            state_dict["cosine_cycle_iters"],
+            last_iter=state_dict["last_iter"] - 1,
+        )
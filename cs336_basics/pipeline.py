@@ -0,0 +1,223 @@
+"""
+Pipeline parallelism for TransformerLM: the `layers` are split into contiguous stages, one
+per rank of the default process group, and each batch is run as a sequence of micro-batches
+under a one-forward-one-backward (1F1B) schedule (Narayanan et al., 2021).
+
+Stage boundaries are chosen by `balance_stages` from the per-layer costs of `layer_costs`,
+so that the slowest stage, which sets the pace of the whole pipeline, is as fast as possible.
+"""
+
+import torch
+import torch.distributed as dist
+from torch import nn
+
+from cs336_basics.distributed import get_rank, get_world_size
+from cs336_basics.model import Embedding, Linear, RMSNorm, RotaryPositionalEmbedding, TransformerBlock, TransformerLM
+from cs336_basics.nn_utils import chunked_cross_entropy
+
+
+def layer_costs(model: TransformerLM, seq_len: int | None = None) -> list[float]:
+    """
+    Training FLOPs per token of each of `model.layers`: 6 per parameter plus the attention
+    score and weighted-sum matmuls over `seq_len` (default: the context length) tokens, as in
+    `train.flops_per_token`. The LM head is charged to the last layer; the embedding lookup
+    does no matmul and is free.
+    """
+    seq_len = seq_len or model.context_length
+    d_model = model.ln_final.weight.numel()
+    costs = [6 * sum(p.numel() for p in layer.parameters()) + 12 * d_model * seq_len for layer in model.layers]
+    costs[-1] += 6 * model.lm_head.weight.numel()
+    return costs
+
+
+def balance_stages(costs: list[float], num_stages: int) -> list[int]:
+    """
+    Split layers with the given `costs` into `num_stages` contiguous, non-empty stages that
+    minimize the cost of the most expensive stage.
+
+    Returns:
+        The num_stages + 1 stage boundaries: stage s holds layers boundaries[s]:boundaries[s + 1].
+    """
+    n = len(costs)
+    assert 1 <= num_stages <= n, f"cannot split {n} layers into {num_stages} stages"
+    prefix = [0.0]
+    for cost in costs:
+        prefix.append(prefix[-1] + cost)
+
+    # best[s][i]: lowest maximum stage cost when the first i layers form s stages
+    best = [[float("inf")] * (n + 1) for _ in range(num_stages + 1)]
+    split = [[0] * (n + 1) for _ in range(num_stages + 1)]
+    best[0][0] = 0.0
+    for s in range(1, num_stages + 1):
+        for i in range(s, n + 1):
+            for j in range(s - 1, i):
+                cost = max(best[s - 1][j], prefix[i] - prefix[j])
+                if cost < best[s][i]:
+                    best[s][i], split[s][i] = cost, j
+
+    boundaries = [n]
+    for s in range(num_stages, 0, -1):
+        boundaries.append(split[s][boundaries[-1]])
+    return boundaries[::-1]
+
+
+class PipelineStage(nn.Module):
+    """
+    The part of a TransformerLM run by this rank: its stage's blocks, plus the token
+    embeddings on the first stage and the final norm and LM head on the last. The arguments
+    are those of `TransformerLM`, and only this stage's modules are built, so no rank ever
+    holds the full model.
+
+    Parameter names are those of the full model (e.g. `layers.5.attn.q_proj.weight`), so a
+    stage loads its subset of a full state dict with `load_state_dict(state_dict, strict=False)`.
+    """
+
+    def __init__(
+        self,
+        vocab_size: int,
+        context_length: int,
+        d_model: int,
+        num_layers: int,
+        num_heads: int,
+        d_ff: int,
+        rope_theta: float = 10000.0,
+        num_kv_heads: int | None = None,
+        window_size: int | None = None,
+        autocast_dtype: torch.dtype | None = None,
+        recompute: str | None = None,
+        recompute_every: int = 1,
+        boundaries: list[int] | None = None,
+        loss_chunk_size: int = 1024,
+        device=None,
+        dtype=None,
+    ):
+        super().__init__()
+        self.stage, self.num_stages = get_rank(), get_world_size()
+        if boundaries is None:
+            # The costs only need parameter shapes, which a model on the meta device has without storage
+            meta_model = TransformerLM(
+                vocab_size,
+                context_length,
+                d_model,
+                num_layers,
+                num_heads,
+                d_ff,
+                num_kv_heads=num_kv_heads,
+                device="meta",
+            )
+            boundaries = balance_stages(layer_costs(meta_model), self.num_stages)
+        self.boundaries = boundaries
+        self.is_first = self.stage == 0
+        self.is_last = self.stage == self.num_stages - 1
+
+        start, end = boundaries[self.stage], boundaries[self.stage + 1]
+        rope = RotaryPositionalEmbedding(rope_theta, d_model // num_heads, context_length, device=device)
+        self.layers = nn.ModuleDict(
+            {
+                str(i): TransformerBlock(
+                    d_model,
+                    num_heads,
+                    d_ff,
+                    rope=rope,
+                    num_kv_heads=num_kv_heads,
+                    window_size=window_size,
+                    layer_idx=i,
+                    device=device,
+                    dtype=dtype,
+                )
+                for i in range(start, end)
+            }
+        )
+        for i, layer in self.layers.items():
+            layer.recompute = recompute if int(i) % recompute_every == 0 else None
+        self.token_embeddings = Embedding(vocab_size, d_model, device=device, dtype=dtype) if self.is_first else None
+        self.ln_final = RMSNorm(d_model, device=device, dtype=dtype) if self.is_last else None
+        self.lm_head = Linear(d_model, vocab_size, device=device, dtype=dtype) if self.is_last else None
+
+        self.d_model = d_model
+        self.dtype = dtype or torch.get_default_dtype()
+        self.device = torch.device(device or "cpu")
+        self.autocast_dtype = autocast_dtype
+        self.loss_chunk_size = loss_chunk_size
+
+    def forward(self, x: torch.Tensor, targets: torch.Tensor | None = None) -> torch.Tensor:
+        """
+        :param x: (batch, seq_len) token ids on the first stage, else the previous stage's
+            (batch, seq_len, d_model) output
+        :param targets: (batch, seq_len) next-token targets, used by the last stage only
+        :return: the average loss on the last stage, else the (batch, seq_len, d_model) activations
+        """
+        seq_len = x.shape[1]
+        token_positions = torch.arange(seq_len, device=x.device)
+        with torch.autocast(x.device.type, dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None):
+            if self.is_first:
+                x = self.token_embeddings(x)
+            for layer in self.layers.values():
+                x = layer(x, token_positions)
+            if not self.is_last:
+                return x
+        # As in TransformerLM.hidden_states, the final norm runs outside autocast
+        hidden = self.ln_final(x.to(self.dtype))
+        return chunked_cross_entropy(
+            hidden, self.lm_head.weight, targets, self.loss_chunk_size, compute_dtype=self.autocast_dtype
+        )
+
+    def train_step(self, inputs: torch.Tensor, targets: torch.Tensor, num_micro_batches: int) -> torch.Tensor | None:
+        """
+        Forward and backward over a (batch, seq_len) batch split into `num_micro_batches`,
+        accumulating into the `.grad` of this stage's parameters the gradient of the average loss.
+        Every stage is given the same batch (only the first reads `inputs`, only the last `targets`).
+
+        1F1B schedule: stage s runs num_stages - s - 1 warmup forwards, then alternates one
+        forward and one backward, so at most num_stages - s micro-batches' activations are alive
+        at once (instead of all of them, as when every forward runs before any backward).
+
+        Returns:
+            The average loss on the last stage, None on the others.
+        """
+        micro_inputs = inputs.chunk(num_micro_batches)
+        micro_targets = targets.chunk(num_micro_batches)
+        num_micro_batches = len(micro_inputs)
+        num_warmup = min(self.num_stages - self.stage - 1, num_micro_batches)
+
+        # Sends are asynchronous, so that neighbouring stages never block sending to each other
+        sends: list[dist.Work] = []
+        saved: dict[int, tuple[torch.Tensor | None, torch.Tensor]] = {}
+        losses = []
+
+        def forward(i: int):
+            x = micro_inputs[i].to(self.device)
+            if not self.is_first:
+                x = torch.empty(*x.shape, self.d_model, device=self.device, dtype=self.dtype)
+                dist.recv(x, src=self.stage - 1)
+                x.requires_grad_()
+            output = self(x, micro_targets[i].to(self.device))
+            if self.is_last:
+                losses.append(output.detach())
+                output = output / num_micro_batches
+            else:
+                sends.append(dist.isend(output.detach().contiguous(), dst=self.stage + 1))
+            saved[i] = (None if self.is_first else x, output)
+
+        def backward(i: int):
+            x, output = saved.pop(i)
+            if self.is_last:
+                output.backward()
+            else:
+                grad_output = torch.empty_like(output)
+                dist.recv(grad_output, src=self.stage + 1)
+                output.backward(grad_output)
+            if not self.is_first:
+                sends.append(dist.isend(x.grad, dst=self.stage - 1))
+
+        for i in range(num_warmup):
+            forward(i)
+        for i in range(num_micro_batches - num_warmup):
+            forward(i + num_warmup)
+            backward(i)
+        for i in range(num_micro_batches - num_warmup, num_micro_batches):
+            backward(i)
+        for work in sends:
+            work.wait()
+
+        return torch.stack(losses).mean() if self.is_last else None
@@ -0,0 +1,128 @@
+import itertools
+
+import torch
+
+
+class _Node:
+    __slots__ = ("children", "keys", "last_access", "parent", "tokens", "values")
+
+    def __init__(self, tokens: tuple[int, ...], keys, values, parent: "_Node | None"):
+        self.tokens = tokens
+        # (num_layers, num_heads, len(tokens), d_k), or None for the root
+        self.keys = keys
+        self.values = values
+        self.parent = parent
+        self.children: dict[int, _Node] = {}
+        self.last_access = 0
+
+    @property
+    def num_bytes(self) -> int:
+        if self.keys is None:
+            return 0
+        return self.keys.numel() * self.keys.element_size() + self.values.numel() * self.values.element_size()
+
+
+class PrefixCache:
+    """
+    Per-layer keys and values of previously processed token sequences, stored in a radix tree
+    keyed on token ids so that sequences sharing a prefix share its entries.
+
+    Keys and values of a token depend only on the tokens before it (and its position, which
+    is the same for a shared prefix), so a new prompt only needs to run its unseen suffix
+    through the model. When the stored tensors exceed `max_bytes`, least recently used
+    leaves are evicted first.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.root = _Node((), None, None, None)
+        self._clock = itertools.count(1)
+
+    def match(self, tokens: list[int]) -> tuple[int, torch.Tensor | None, torch.Tensor | None]:
+        """
+        Find the longest cached prefix of `tokens`.
+
+        Returns:
+            (length, keys, values): the prefix length and its (num_layers, num_heads, length, d_k)
+            keys and values, or (0, None, None) if nothing matches.
+        """
+        keys, values = [], []
+        node, pos = self.root, 0
+        while pos < len(tokens) and (child := node.children.get(tokens[pos])) is not None:
+            n = _common_prefix_length(child.tokens, tokens[pos:])
+            child.last_access = next(self._clock)
+            keys.append(child.keys[:, :, :n])
+            values.append(child.values[:, :, :n])
+            pos += n
+            if n < len(child.tokens):
+                break
+            node = child
+        if pos == 0:
+            return 0, None, None
+        return pos, torch.cat(keys, dim=2), torch.cat(values, dim=2)
+
+    def insert(self, tokens: list[int], keys: torch.Tensor, values: torch.Tensor):
+        """
+        Store the (num_layers, num_heads, len(tokens), d_k) `keys` and `values` of `tokens`.
+        Only the part not already cached is copied.
+        """
+        node, pos = self.root, 0
+        while pos < len(tokens):
+            child = node.children.get(tokens[pos])
+            if child is None:
+                leaf = _Node(tuple(tokens[pos:]), keys[:, :, pos:].clone(), values[:, :, pos:].clone(), parent=node)
+                node.children[tokens[pos]] = leaf
+                self.num_bytes += leaf.num_bytes
+                node = leaf
+                break
+            n = _common_prefix_length(child.tokens, tokens[pos:])
+            if n < len(child.tokens):
+                child = self._split(child, n)
+            pos += n
+            node = child
+
+        # Refresh the whole path, so that it is evicted after anything older
+        now = next(self._clock)
+        while node is not self.root:
+            node.last_access = now
+            node = node.parent
+        self._evict()
+
+    def _split(self, node: _Node, n: int) -> _Node:
+        """Split `node` after its first `n` tokens and return the new upper node."""
+        upper = _Node(node.tokens[:n], node.keys[:, :, :n].clone(), node.values[:, :, :n].clone(), node.parent)
+        upper.last_access = node.last_access
+        upper.children[node.tokens[n]] = node
+        node.parent.children[node.tokens[0]] = upper
+
+        node.tokens = node.tokens[n:]
+        node.keys = node.keys[:, :, n:].clone()
+        node.values = node.values[:, :, n:].clone()
+        node.parent = upper
+        return upper
+
+    def _evict(self):
+        while self.num_bytes > self.max_bytes:
+            leaves = [node for node in self._nodes() if not node.children]
+            if not leaves:
+                break
+            victim = min(leaves, key=lambda node: node.last_access)
+            del victim.parent.children[victim.tokens[0]]
+            self.num_bytes -= victim.num_bytes
+
+    def _nodes(self):
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+
+def _common_prefix_length(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
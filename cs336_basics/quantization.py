@@ -0,0 +1,175 @@
+"""
+Weight-only quantization of the Linear layers of a trained model, for inference.
+
+Weights are quantized symmetrically, `w ~= scale * q`, either to int8 with one scale per output
+channel or to int4 (two values packed per byte) with one scale per `group_size` consecutive
+input features of a channel. Activations stay in floating point: per-channel int8 weights go
+straight into PyTorch's int8 weight-only matmul on the CPU, and otherwise are dequantized a block
+of output channels at a time, so memory (and the memory traffic that bounds decoding on a CPU)
+shrinks about 4x with int8 and 8x with int4.
+"""
+
+import torch
+from torch import nn
+
+from cs336_basics.model import Linear
+
+
+def _pack_int4(q: torch.Tensor) -> torch.Tensor:
+    # Values in [-7, 7], stored offset by 8 as the low and high nibbles of a byte
+    q = (q + 8).to(torch.uint8)
+    return q[..., 0::2] | (q[..., 1::2] << 4)
+
+
+def _unpack_int4(packed: torch.Tensor) -> torch.Tensor:
+    low = (packed & 0xF).to(torch.int8) - 8
+    high = (packed >> 4).to(torch.int8) - 8
+    return torch.stack((low, high), dim=-1).flatten(-2)
+
+
+def quantize_weight(
+    weight: torch.Tensor, bits: int = 8, group_size: int | None = None
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Symmetric quantization of an (out_features, in_features) weight.
+
+    Args:
+        bits: 8 (int8) or 4 (int4, packed two per uint8 along the input features).
+        group_size: input features sharing a scale; default all of them (one scale per channel).
+
+    Returns:
+        (qweight, scales): the (out_features, in_features) int8 or (out_features, in_features // 2)
+        uint8 values, and the (out_features, in_features // group_size) scales in `weight.dtype`.
+    """
+    assert bits in (4, 8), f"unsupported bit width {bits}"
+    out_features, in_features = weight.shape
+    group_size = group_size or in_features
+    assert in_features % group_size == 0, f"{in_features} input features in groups of {group_size}"
+    assert bits == 8 or in_features % 2 == 0, "int4 packs pairs of input features"
+
+    qmax = 2 ** (bits - 1) - 1
+    groups = weight.detach().float().reshape(out_features, in_features // group_size, group_size)
+    scales = groups.abs().amax(dim=-1, keepdim=True).clamp(min=1e-12) / qmax
+    q = (groups / scales).round_().clamp_(-qmax, qmax).to(torch.int8).reshape(out_features, in_features)
+    if bits == 4:
+        q = _pack_int4(q)
+    return q, scales.squeeze(-1).to(weight.dtype)
+
+
+class QuantizedLinear(nn.Module):
+    """
+    Drop-in inference replacement for `Linear` with weight-only quantized weights (see
+    `quantize_weight`). Loading a state dict accepts the floating-point `weight` of a `Linear`,
+    which is quantized on the fly, so a trained checkpoint loads without conversion.
+
+    There is no `weight` attribute; `dequantize()` gives the full floating-point weight for code
+    that needs it (e.g. the fused LM head loss). The forward pass never materializes it in full:
+    per-channel int8 on the CPU uses `torch._weight_int8pack_mm`, and otherwise at most
+    `block_rows` output channels are dequantized at a time.
+    """
+
+    block_rows = 1024
+
+    def __init__(
+        self, in_features: int, out_features: int, bits: int = 8, group_size: int | None = None, device=None, dtype=None
+    ):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size or in_features
+        assert bits in (4, 8), f"unsupported bit width {bits}"
+        assert in_features % self.group_size == 0, f"{in_features} input features in groups of {self.group_size}"
+        assert bits == 8 or in_features % 2 == 0, "int4 packs pairs of input features"
+        # Same shapes and dtypes as `quantize_weight` returns, to be filled by `from_linear` or a state dict
+        packed_features, qdtype = (in_features, torch.int8) if bits == 8 else (in_features // 2, torch.uint8)
+        self.register_buffer("qweight", torch.zeros(out_features, packed_features, device=device, dtype=qdtype))
+        num_groups = in_features // self.group_size
+        self.register_buffer("scales", torch.ones(out_features, num_groups, device=device, dtype=dtype))
+
+    @classmethod
+    def from_linear(cls, linear: Linear, bits: int = 8, group_size: int | None = None) -> "QuantizedLinear":
+        weight = linear.weight
+        module = cls(weight.shape[1], weight.shape[0], bits, group_size, device=weight.device, dtype=weight.dtype)
+        module.qweight, module.scales = quantize_weight(weight, bits, group_size)
+        return module
+
+    def _dequantize_rows(self, start: int, end: int, dtype: torch.dtype) -> torch.Tensor:
+        """Output channels start:end of the weight, as an (end - start, in_features) tensor in `dtype`."""
+        q = self.qweight[start:end]
+        q = _unpack_int4(q) if self.bits == 4 else q
+        groups = q.view(end - start, -1, self.group_size).to(dtype)
+        return (groups * self.scales[start:end].to(dtype)[..., None]).reshape(end - start, self.in_features)
+
+    def dequantize(self, dtype: torch.dtype | None = None) -> torch.Tensor:
+        """The (out_features, in_features) weight in `dtype` (default: that of the scales)."""
+        return self._dequantize_rows(0, self.out_features, dtype or self.scales.dtype)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if (
+            self.bits == 8
+            and self.group_size == self.in_features
+            and x.device.type == "cpu"
+            and x.dtype in (torch.float32, torch.bfloat16, torch.float16)
+            and hasattr(torch, "_weight_int8pack_mm")
+        ):
+            y = torch._weight_int8pack_mm(
+                x.reshape(-1, self.in_features).contiguous(), self.qweight, self.scales[:, 0].to(x.dtype)
+            )
+            return y.view(*x.shape[:-1], self.out_features)
+
+        y = x.new_empty(*x.shape[:-1], self.out_features)
+        for start in range(0, self.out_features, self.block_rows):
+            end = min(start + self.block_rows, self.out_features)
+            y[..., start:end] = torch.einsum("...i, oi -> ...o", x, self._dequantize_rows(start, end, x.dtype))
+        return y
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        weight = state_dict.pop(prefix + "weight", None)
+        if weight is not None:
+            state_dict[prefix + "qweight"], state_dict[prefix + "scales"] = quantize_weight(
+                weight, self.bits, None if self.group_size == self.in_features else self.group_size
+            )
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def extra_repr(self) -> str:
+        return (
+            f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}, "
+            f"group_size={self.group_size}"
+        )
+
+
+def quantize_model(model: nn.Module, bits: int = 8, group_size: int | None = None) -> nn.Module:
+    """
+    Replace every `Linear` of `model` (including the LM head) in place by a `QuantizedLinear`
+    holding its quantized weights. Embeddings and norms stay in floating point.
+
+    Either quantize a trained model, or quantize a freshly built one and then load a
+    floating-point state dict into it.
+    """
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Linear):
+                setattr(module, child_name, QuantizedLinear.from_linear(child, bits, group_size))
+    return model
+
+
+def model_bytes(model: nn.Module) -> int:
+    """Memory held by the parameters and buffers of `model`."""
+    tensors = [*model.parameters(), *model.buffers()]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+@torch.no_grad()
+def compare_outputs(reference: torch.Tensor, actual: torch.Tensor) -> dict[str, float]:
+    """
+    Accuracy delta of (..., vocab_size) logits, e.g. of a quantized model, against `reference`:
+    the largest absolute difference, the relative L2 error, and the fraction of positions whose
+    most likely token is unchanged.
+    """
+    reference, actual = reference.float(), actual.float()
+    return {
+        "max_abs_error": (actual - reference).abs().max().item(),
+        "relative_error": (torch.linalg.vector_norm(actual - reference) / torch.linalg.vector_norm(reference)).item(),
+        "top1_agreement": (actual.argmax(dim=-1) == reference.argmax(dim=-1)).float().mean().item(),
+    }
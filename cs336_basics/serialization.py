@@ -0,0 +1,692 @@
+import json
+import mmap
+import os
+import struct
+import typing
+import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+
+# Tensor-store layout: magic, little-endian u64 header length, JSON header, then the raw
+# bytes of every tensor, each starting at a multiple of _ALIGNMENT from the file start.
+_MAGIC = b"CS336TS1"
+_ALIGNMENT = 64
+
+_DTYPES = {
+    str(dtype).removeprefix("torch."): dtype
+    for dtype in (
+        torch.float64,
+        torch.float32,
+        torch.float16,
+        torch.bfloat16,
+        torch.int64,
+        torch.int32,
+        torch.int16,
+        torch.int8,
+        torch.uint8,
+        torch.bool,
+    )
+}
+
+
+def _fsync_dir(path: Path):
+    """
+    Persist a rename within `path` (no-op on platforms without directory fds).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_save(obj: typing.Any, path: str | os.PathLike):
+    """
+    `torch.save` to a temporary file next to `path`, fsync it, then rename it into place,
+    so a reader (or a crash) never observes a partially written checkpoint.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _as_bytes(tensor: torch.Tensor) -> torch.Tensor:
+    return tensor.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8)
+
+
+def save_tensors(
+    tensors: dict[str, torch.Tensor],
+    out: str | os.PathLike | typing.BinaryIO | typing.IO[bytes],
+    metadata: dict | None = None,
+):
+    """
+    Write `tensors` in the tensor-store format: a JSON header describing every tensor
+    (dtype, shape, byte offset) followed by the aligned raw tensor bytes.
+    `metadata` must be JSON-serializable and is stored in the header as-is.
+    """
+    header = {"__metadata__": metadata or {}, "tensors": {}}
+    offset = 0
+    for name, tensor in tensors.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        header["tensors"][name] = {
+            "dtype": str(tensor.dtype).removeprefix("torch."),
+            "shape": list(tensor.shape),
+            "offset": offset,
+            "nbytes": nbytes,
+        }
+        offset = _align(offset + nbytes)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(_MAGIC) + 8 + len(header_bytes))
+    header_bytes += b" " * (data_start - len(_MAGIC) - 8 - len(header_bytes))
+
+    if isinstance(out, (str, os.PathLike)):
+        path = Path(out)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            _write_tensors(f, header_bytes, header, tensors)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(path.parent)
+    else:
+        _write_tensors(out, header_bytes, header, tensors)
+
+
+def _write_tensors(f: typing.BinaryIO, header_bytes: bytes, header: dict, tensors: dict[str, torch.Tensor]):
+    f.write(_MAGIC)
+    f.write(struct.pack("<Q", len(header_bytes)))
+    f.write(header_bytes)
+    position = 0
+    for name, tensor in tensors.items():
+        offset = header["tensors"][name]["offset"]
+        f.write(b"\0" * (offset - position))
+        data = _as_bytes(tensor)
+        f.write(memoryview(data.numpy()))
+        position = offset + data.numel()
+
+
+def is_tensor_store(src: str | os.PathLike | typing.BinaryIO | typing.IO[bytes]) -> bool:
+    if isinstance(src, (str, os.PathLike)):
+        with open(src, "rb") as f:
+            return f.read(len(_MAGIC)) == _MAGIC
+    position = src.tell()
+    magic = src.read(len(_MAGIC))
+    src.seek(position)
+    return magic == _MAGIC
+
+
+def load_tensors(
+    src: str | os.PathLike | typing.BinaryIO | typing.IO[bytes],
+    mmap_file: bool = True,
+    keys: typing.Iterable[str] | None = None,
+) -> tuple[dict[str, torch.Tensor], dict]:
+    """
+    Read a tensor-store file written by `save_tensors`.
+
+    With `mmap_file=True` (and a path as `src`) the file is memory-mapped copy-on-write and
+    every returned tensor is a view into the mapping: nothing is read until it is touched,
+    and writing to a tensor never modifies the file.
+
+    Returns:
+        (tensors, metadata) for the requested `keys` (all tensors by default).
+    """
+    if isinstance(src, (str, os.PathLike)) and mmap_file:
+        with open(src, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        buffer = torch.frombuffer(mapping, dtype=torch.uint8)
+    elif isinstance(src, (str, os.PathLike)):
+        with open(src, "rb") as f:
+            buffer = torch.frombuffer(bytearray(f.read()), dtype=torch.uint8)
+    else:
+        buffer = torch.frombuffer(bytearray(src.read()), dtype=torch.uint8)
+
+    if bytes(buffer[: len(_MAGIC)].numpy()) != _MAGIC:
+        raise ValueError("Not a tensor-store file")
+    (header_length,) = struct.unpack("<Q", bytes(buffer[len(_MAGIC) : len(_MAGIC) + 8].numpy()))
+    data_start = len(_MAGIC) + 8 + header_length
+    header = json.loads(bytes(buffer[len(_MAGIC) + 8 : data_start].numpy()))
+
+    entries = header["tensors"]
+    names = list(entries) if keys is None else list(keys)
+    tensors = {}
+    for name in names:
+        entry = entries[name]
+        start = data_start + entry["offset"]
+        data = buffer[start : start + entry["nbytes"]]
+        tensors[name] = data.view(_DTYPES[entry["dtype"]]).view(entry["shape"])
+    return tensors, header["__metadata__"]
+
+
+_MANIFEST = "manifest.json"
+
+
+def save_sharded_tensors(
+    tensors: dict[str, torch.Tensor],
+    out_dir: str | os.PathLike,
+    metadata: dict | None = None,
+    shard_size_mb: float = 512,
+    max_workers: int | None = None,
+):
+    """
+    Write `tensors` as tensor-store shards of roughly `shard_size_mb` each plus a manifest.
+
+    Shards are written concurrently by a thread pool (the copies and file writes release
+    the GIL). Every save gets shard names of its own, and the manifest mapping every tensor
+    name to its shard is atomically replaced last, so saving over an existing directory never
+    touches the shards its current manifest points at: a crash leaves the previous save
+    readable. Shards the new manifest does not list are deleted afterwards.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    shard_size = int(shard_size_mb * 2**20)
+    shards: list[dict[str, torch.Tensor]] = [{}]
+    current_size = 0
+    for name, tensor in tensors.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        if shards[-1] and current_size + nbytes > shard_size:
+            shards.append({})
+            current_size = 0
+        shards[-1][name] = tensor
+        current_size += nbytes
+
+    save_id = uuid.uuid4().hex[:8]
+    shard_names = [f"shard_{save_id}_{i:05d}_of_{len(shards):05d}.tensors" for i in range(len(shards))]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-writer") as executor:
+        futures = [executor.submit(save_tensors, shard, out_dir / name) for shard, name in zip(shards, shard_names)]
+        for future in futures:
+            future.result()
+
+    manifest = {
+        "metadata": metadata or {},
+        "shards": shard_names,
+        "tensors": {name: shard_name for shard, shard_name in zip(shards, shard_names) for name in shard},
+    }
+    tmp_path = out_dir / f".{_MANIFEST}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, out_dir / _MANIFEST)
+    _fsync_dir(out_dir)
+
+    # Shards of earlier saves, and temporary files of interrupted ones
+    for path in [*out_dir.glob("shard_*.tensors"), *out_dir.glob(".shard_*.tensors.tmp")]:
+        if path.name not in shard_names:
+            path.unlink(missing_ok=True)
+
+
+def is_sharded(src: typing.Any) -> bool:
+    return isinstance(src, (str, os.PathLike)) and (Path(src) / _MANIFEST).is_file()
+
+
+def load_sharded_tensors(
+    src_dir: str | os.PathLike,
+    keys: typing.Iterable[str] | None = None,
+    mmap_file: bool = True,
+    max_workers: int | None = None,
+) -> tuple[dict[str, torch.Tensor], dict]:
+    """
+    Read a directory written by `save_sharded_tensors`, loading shards concurrently.
+
+    Only the shards that contain the requested `keys` are opened, so e.g.
+    `keys=["model.lm_head.weight"]` reads a single shard.
+
+    Returns:
+        (tensors, metadata) for the requested `keys` (all tensors by default).
+    """
+    src_dir = Path(src_dir)
+    with open(src_dir / _MANIFEST) as f:
+        manifest = json.load(f)
+
+    keys = list(manifest["tensors"]) if keys is None else list(keys)
+    by_shard: dict[str, list[str]] = {}
+    for key in keys:
+        by_shard.setdefault(manifest["tensors"][key], []).append(key)
+
+    tensors: dict[str, torch.Tensor] = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-reader") as executor:
+        futures = [
+            executor.submit(load_tensors, src_dir / shard_name, mmap_file, shard_keys)
+            for shard_name, shard_keys in by_shard.items()
+        ]
+        for future in futures:
+            tensors.update(future.result()[0])
+    return {key: tensors[key] for key in keys}, manifest["metadata"]
+
+
+def _flatten_checkpoint(
+    model: torch.nn.Module, optimizer: torch.optim.Optimizer | None, iteration: int
+) -> tuple[dict[str, torch.Tensor], dict]:
+    """
+    Split a checkpoint into named tensors and a JSON-serializable remainder.
+    """
+    tensors = {f"model.{k}": v for k, v in model.state_dict().items()}
+    metadata: dict[str, typing.Any] = {"iteration": iteration}
+    if optimizer is not None:
+        optimizer_state = optimizer.state_dict()
+        scalars: dict[str, dict] = {}
+        for index, param_state in optimizer_state["state"].items():
+            for key, value in param_state.items():
+                if torch.is_tensor(value):
+                    tensors[f"optimizer.state.{index}.{key}"] = value
+                else:
+                    scalars.setdefault(str(index), {})[key] = value
+        metadata["optimizer"] = {"param_groups": optimizer_state["param_groups"], "scalars": scalars}
+    return tensors, metadata
+
+
+def _unflatten_optimizer_state(
+    tensors: dict[str, torch.Tensor], metadata: dict, optimizer: torch.optim.Optimizer
+) -> dict:
+    state: dict[int, dict] = {}
+    for name, tensor in tensors.items():
+        if name.startswith("optimizer.state."):
+            index, key = name.removeprefix("optimizer.state.").split(".", 1)
+            state.setdefault(int(index), {})[key] = tensor
+    for index, scalars in metadata["optimizer"]["scalars"].items():
+        state.setdefault(int(index), {}).update(scalars)
+
+    # JSON turns tuples (e.g. `betas`) into lists; restore the optimizer's own types
+    param_groups = []
+    for saved_group, group in zip(metadata["optimizer"]["param_groups"], optimizer.param_groups):
+        param_groups.append(
+            {
+                k: tuple(v) if isinstance(v, list) and isinstance(group.get(k), tuple) else v
+                for k, v in saved_group.items()
+            }
+        )
+    return {"state": state, "param_groups": param_groups}
+
+
+def _load_model_tensors(model: torch.nn.Module, tensors: dict[str, torch.Tensor], assign: bool):
+    state_dict = {k.removeprefix("model."): v for k, v in tensors.items() if k.startswith("model.")}
+    # Assigning the mapped tensors as parameters avoids a second copy of the weights,
+    # but only makes sense when the model already lives on the CPU.
+    assign = assign and all(t.device.type == "cpu" for t in model.state_dict().values())
+    model.load_state_dict(state_dict, assign=assign)
+
+
+def load_model_weights(src: str | os.PathLike, model: torch.nn.Module, mmap_file: bool = True) -> torch.nn.Module:
+    """
+    Load only the model weights of a (possibly sharded) tensor-store checkpoint, e.g. for evaluation.
+
+    The parameters of a CPU model become views into the memory-mapped file, so loading is
+    nearly free and does not need memory for a second copy of the weights.
+    """
+    keys = [f"model.{k}" for k in model.state_dict()]
+    if is_sharded(src):
+        tensors, _ = load_sharded_tensors(src, keys=keys, mmap_file=mmap_file)
+    else:
+        tensors, _ = load_resolved_tensors(src, mmap_file=mmap_file)
+    _load_model_tensors(model, tensors, assign=mmap_file)
+    return model
+
+
+def _encode_delta(tensor: torch.Tensor, base: torch.Tensor, level: int) -> torch.Tensor:
+    """
+    XOR the bit patterns of `tensor` and `base`, group the result into byte planes and
+    zlib-compress it. After a few hundred optimizer steps the sign, exponent and high
+    mantissa bytes rarely change, so those planes are long runs of zeros.
+    """
+    element_size = tensor.element_size()
+    xor = torch.bitwise_xor(_as_bytes(tensor), _as_bytes(base))
+    planes = xor.view(-1, element_size).T.contiguous()
+    return torch.frombuffer(bytearray(zlib.compress(memoryview(planes.numpy()), level)), dtype=torch.uint8)
+
+
+def _decode_delta(data: torch.Tensor, base: torch.Tensor) -> torch.Tensor:
+    element_size = base.element_size()
+    planes = torch.frombuffer(bytearray(zlib.decompress(memoryview(data.numpy()))), dtype=torch.uint8)
+    xor = planes.view(element_size, -1).T.reshape(-1)
+    return torch.bitwise_xor(xor, _as_bytes(base)).view(base.dtype).view(base.shape)
+
+
+def save_delta_tensors(
+    tensors: dict[str, torch.Tensor],
+    out: str | os.PathLike,
+    base: str | os.PathLike,
+    metadata: dict | None = None,
+    level: int = 1,
+    base_tensors: dict[str, torch.Tensor] | None = None,
+    optimizer_state_dtype: torch.dtype | None = None,
+):
+    """
+    Write `tensors` as a delta against the full tensor-store file `base`.
+
+    Tensors that are bitwise identical to the base are not stored at all, changed tensors
+    are stored XOR-encoded and compressed (see `_encode_delta`), and tensors that are new
+    or changed shape are stored as-is. `out` records the base's file name, so the base must
+    stay in the same directory; `load_resolved_tensors` reassembles the full set.
+
+    Pass the base's tensors as `base_tensors` if they are at hand (e.g. kept in host memory
+    since the base was written) to avoid reading the base file back.
+
+    Only the sign, exponent and high mantissa bits of a float that changed compress well, so
+    when every parameter trains a lossless delta is still about 80% of a full checkpoint. With
+    `optimizer_state_dtype=torch.bfloat16` the optimizer state (`optimizer.state.*`, e.g. the
+    AdamW moments, which make up two thirds of the checkpoint) is stored rounded to bfloat16,
+    which roughly halves a delta. Restoring it is then lossy, at the precision `FlatAdamW` keeps
+    its moments in with `bf16_states`. Deltas are several times smaller than full checkpoints
+    only when much of the model is frozen.
+    """
+    base = Path(base)
+    if base_tensors is None:
+        base_tensors, base_metadata = load_tensors(base)
+        if "delta" in base_metadata:
+            raise ValueError(f"{base} is itself a delta; deltas must be taken against a full checkpoint")
+
+    stored: dict[str, torch.Tensor] = {}
+    delta = {"base": base.name, "encoded": [], "unchanged": [], "reduced": {}}
+    for name, tensor in tensors.items():
+        base_tensor = base_tensors.get(name)
+        if base_tensor is None or base_tensor.shape != tensor.shape or base_tensor.dtype != tensor.dtype:
+            stored[name] = tensor
+        elif torch.equal(_as_bytes(tensor), _as_bytes(base_tensor)):
+            delta["unchanged"].append(name)
+        elif (
+            optimizer_state_dtype is not None
+            and name.startswith("optimizer.state.")
+            and tensor.is_floating_point()
+            and tensor.element_size() > torch.empty((), dtype=optimizer_state_dtype).element_size()
+        ):
+            stored[name] = _encode_delta(tensor.to(optimizer_state_dtype), base_tensor.to(optimizer_state_dtype), level)
+            delta["reduced"][name] = str(optimizer_state_dtype).removeprefix("torch.")
+        else:
+            stored[name] = _encode_delta(tensor, base_tensor, level)
+            delta["encoded"].append(name)
+
+    save_tensors(stored, out, {**(metadata or {}), "delta": delta})
+
+
+def load_resolved_tensors(src: str | os.PathLike, mmap_file: bool = True) -> tuple[dict[str, torch.Tensor], dict]:
+    """
+    `load_tensors`, except that a delta file written by `save_delta_tensors` is replayed
+    on top of its base to give the full set of tensors.
+    """
+    tensors, metadata = load_tensors(src, mmap_file=mmap_file)
+    delta = metadata.pop("delta", None)
+    if delta is None:
+        return tensors, metadata
+
+    base_tensors, _ = load_tensors(Path(src).parent / delta["base"], mmap_file=mmap_file)
+    for name in delta["unchanged"]:
+        tensors[name] = base_tensors[name]
+    for name in delta["encoded"]:
+        tensors[name] = _decode_delta(tensors[name], base_tensors[name])
+    for name, dtype in delta.get("reduced", {}).items():
+        base_tensor = base_tensors[name]
+        tensors[name] = _decode_delta(tensors[name], base_tensor.to(_DTYPES[dtype])).to(base_tensor.dtype)
+    return tensors, metadata
+
+
+def save_checkpoint(
+    model: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    iteration: int,
+    out: str | os.PathLike | typing.BinaryIO | typing.IO[bytes],
+    format: str = "torch",
+    shard_size_mb: float = 512,
+    max_workers: int | None = None,
+    base: str | os.PathLike | None = None,
+):
+    """
+    Serialize the model, optimizer and iteration to `out`.
+
+    Args:
+        format: "torch" for a `torch.save` pickle, "tensors" for the memory-mappable
+            tensor-store format (see `save_tensors`), "sharded" to write `out` as a
+            directory of tensor-store shards of about `shard_size_mb` each, in parallel
+            (see `save_sharded_tensors`), or "delta" to store only what changed relative
+            to `base`, a "tensors" checkpoint in the same directory (see `save_delta_tensors`).
+    """
+    if format == "tensors":
+        tensors, metadata = _flatten_checkpoint(model, optimizer, iteration)
+        save_tensors(tensors, out, metadata)
+        return
+    if format == "sharded":
+        tensors, metadata = _flatten_checkpoint(model, optimizer, iteration)
+        save_sharded_tensors(tensors, out, metadata, shard_size_mb=shard_size_mb, max_workers=max_workers)
+        return
+    if format == "delta":
+        if base is None:
+            raise ValueError("A delta checkpoint needs a base checkpoint")
+        tensors, metadata = _flatten_checkpoint(model, optimizer, iteration)
+        save_delta_tensors(tensors, out, base, metadata)
+        return
+    if format != "torch":
+        raise ValueError(f"Unknown checkpoint format: {format}")
+
+    checkpoint = {
+        "model_state_dict": model.state_dict(),
+        "optimizer_state_dict": optimizer.state_dict(),
+        "iteration": iteration,
+    }
+    if isinstance(out, (str, os.PathLike)):
+        atomic_save(checkpoint, out)
+    else:
+        torch.save(checkpoint, out)
+
+
+def load_checkpoint(
+    src: str | os.PathLike | typing.BinaryIO | typing.IO[bytes],
+    model: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    mmap_file: bool = True,
+) -> int:
+    """
+    Restore a checkpoint written by `save_checkpoint` in any format and return its iteration.
+
+    Tensor-store checkpoints (single file or sharded) are memory-mapped when `mmap_file` is
+    set. The model weights and the optimizer state are then copied into place as usual: the
+    optimizer holds references to the model's parameters, so they must not be replaced (use
+    `load_model_weights` to map the weights of a model that is not trained).
+    Delta checkpoints are replayed on top of their base transparently.
+    """
+    if is_sharded(src) or is_tensor_store(src):
+        if is_sharded(src):
+            tensors, metadata = load_sharded_tensors(src, mmap_file=mmap_file)
+        elif isinstance(src, (str, os.PathLike)):
+            tensors, metadata = load_resolved_tensors(src, mmap_file=mmap_file)
+        else:
+            tensors, metadata = load_tensors(src, mmap_file=mmap_file)
+            if "delta" in metadata:
+                raise ValueError("A delta checkpoint must be loaded from its path, next to its base")
+        _load_model_tensors(model, tensors, assign=False)
+        optimizer.load_state_dict(_unflatten_optimizer_state(tensors, metadata, optimizer))
+        return metadata["iteration"]
+
+    checkpoint = torch.load(src)
+    model.load_state_dict(checkpoint["model_state_dict"])
+    optimizer.load_state_dict(checkpoint["optimizer_state_dict"])
+    return checkpoint["iteration"]
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints from a background thread so training can continue during the write.
+
+    `save()` only snapshots the model and optimizer state into host memory (page-locked
+    when CUDA is available, so device-to-host copies are asynchronous) and returns.
+    Serialization, fsync and the atomic rename happen on a worker thread, and only the
+    newest `keep_last_k` checkpoints in `directory` are kept.
+
+    At most one write is in flight: a `save()` issued while the previous one is still being
+    written waits for it first, which also lets the host buffers be reused between saves.
+    """
+
+    def __init__(self, directory: str | os.PathLike, keep_last_k: int | None = 3, prefix: str = "checkpoint"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep_last_k = keep_last_k
+        self.prefix = prefix
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending: Future | None = None
+        self._buffers: dict[tuple, torch.Tensor] = {}
+        self._pin_memory = torch.cuda.is_available()
+
+    def path_for(self, iteration: int) -> Path:
+        return self.directory / f"{self.prefix}_{iteration:08d}.pt"
+
+    def checkpoints(self) -> list[Path]:
+        """
+        Completed checkpoints in `directory`, oldest first.
+        """
+        return sorted(self.directory.glob(f"{self.prefix}_*.pt"))
+
+    def latest(self) -> Path | None:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def _snapshot(self, obj: typing.Any, key: tuple = ()) -> typing.Any:
+        """
+        Copy every tensor in a (nested) state dict into a host buffer owned by the checkpointer.
+        """
+        if torch.is_tensor(obj):
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, device="cpu", pin_memory=self._pin_memory)
+                self._buffers[key] = buffer
+            return buffer.copy_(obj.detach(), non_blocking=True)
+        if isinstance(obj, dict):
+            return {k: self._snapshot(v, key + (k,)) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v, key + (i,)) for i, v in enumerate(obj))
+        return obj
+
+    def save(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, iteration: int) -> Future:
+        """
+        Snapshot the state and schedule it to be written as `path_for(iteration)`.
+        """
+        self.wait()
+        checkpoint = self._snapshot(
+            {
+                "model_state_dict": model.state_dict(),
+                "optimizer_state_dict": optimizer.state_dict(),
+                "iteration": iteration,
+            }
+        )
+        if self._pin_memory:
+            # Make sure the non-blocking device-to-host copies have landed
+            torch.cuda.synchronize()
+
+        self._pending = self._executor.submit(self._write, checkpoint, self.path_for(iteration))
+        return self._pending
+
+    def _write(self, checkpoint: dict, path: Path):
+        atomic_save(checkpoint, path)
+        if self.keep_last_k is not None:
+            for stale in self.checkpoints()[: -self.keep_last_k]:
+                stale.unlink(missing_ok=True)
+
+    def wait(self):
+        """
+        Block until the in-flight write (if any) is on disk, re-raising its exception.
+        """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DeltaCheckpointer:
+    """
+    Saves a full tensor-store checkpoint every `full_every` saves and deltas against the
+    most recent full checkpoint in between (see `save_delta_tensors`).
+
+    Deltas are always taken against a full checkpoint rather than the previous delta, so
+    restoring any checkpoint reads at most two files. The tensors of the current base are
+    kept in host memory (one checkpoint's worth), so writing a delta never reads the base
+    back. When a new full checkpoint is written, all but the newest `keep_last_bases` full
+    checkpoints are removed along with their deltas.
+
+    `optimizer_state_dtype` is passed on to `save_delta_tensors`; see there for the sizes
+    to expect.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        full_every: int = 10,
+        keep_last_bases: int | None = 2,
+        prefix: str = "checkpoint",
+        optimizer_state_dtype: torch.dtype | None = None,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.full_every = full_every
+        self.keep_last_bases = keep_last_bases
+        self.prefix = prefix
+        self.optimizer_state_dtype = optimizer_state_dtype
+        self._saves_since_base = 0
+        self._base: Path | None = None
+        self._base_tensors: dict[str, torch.Tensor] | None = None
+
+    def save(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, iteration: int) -> Path:
+        tensors, metadata = _flatten_checkpoint(model, optimizer, iteration)
+        if self._base is None or self._saves_since_base >= self.full_every - 1:
+            path = self.directory / f"{self.prefix}_{iteration:08d}.tensors"
+            save_tensors(tensors, path, metadata)
+            # The state dicts alias the live parameters and optimizer state, so copy them
+            self._base_tensors = {name: t.detach().to("cpu", copy=True) for name, t in tensors.items()}
+            self._base = path
+            self._saves_since_base = 0
+            self._prune()
+        else:
+            path = self.directory / f"{self._base.stem}.delta_{iteration:08d}.tensors"
+            save_delta_tensors(
+                tensors,
+                path,
+                self._base,
+                metadata,
+                base_tensors=self._base_tensors,
+                optimizer_state_dtype=self.optimizer_state_dtype,
+            )
+            self._saves_since_base += 1
+        return path
+
+    def checkpoints(self) -> list[Path]:
+        """
+        Completed full and delta checkpoints in `directory`, oldest first.
+        """
+        # The iteration is the last "_"-separated field of both kinds of names
+        return sorted(self.directory.glob(f"{self.prefix}_*.tensors"), key=lambda p: p.name.rsplit("_", 1)[-1])
+
+    def latest(self) -> Path | None:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def _prune(self):
+        if self.keep_last_bases is None:
+            return
+        bases = sorted(p for p in self.directory.glob(f"{self.prefix}_*.tensors") if ".delta_" not in p.name)
+        for stale in bases[: -self.keep_last_bases]:
+            for delta in self.directory.glob(f"{stale.stem}.delta_*.tensors"):
+                delta.unlink(missing_ok=True)
+            stale.unlink(missing_ok=True)
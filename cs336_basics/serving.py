@@ -0,0 +1,439 @@
+"""
+Continuous-batching inference for TransformerLM behind a small asyncio HTTP server.
+
+New requests are prefilled as soon as KV memory is available and then join the running
+decode batch; finished sequences leave it at the next step. Keys and values live in a
+PagedKVCache, a pool of fixed-size blocks shared by all sequences, so memory is reserved in
+proportion to each request rather than for the model's full context length. With
+`prefix_cache_bytes`, prompts sharing a prefix with earlier ones only prefill the new suffix.
+With `quantize_kv_cache`, the pool stores int8 keys and values, so about twice as many
+sequences fit in the memory of a bf16 pool (four times that of an fp32 one).
+
+Example:
+    engine = InferenceEngine(model, tokenizer)
+    asyncio.run(serve(engine, port=8000))
+
+    curl -s localhost:8000/generate -d '{"prompt": "Once upon a time", "max_new_tokens": 64}'
+"""
+
+import asyncio
+import json
+import math
+from collections import deque
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Any
+
+import torch
+
+from cs336_basics.generation import sample_next_token
+from cs336_basics.model import Int8KVBuffer, TransformerLM
+from cs336_basics.prefix_cache import PrefixCache
+
+
+class PagedKVCache:
+    """
+    Keys and values of many sequences in a shared pool of `num_blocks` blocks of `block_size`
+    token slots per layer. Each sequence owns a list of blocks (its block table).
+    With `quantize`, the pool stores int8 keys and values (see Int8KVBuffer).
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        num_blocks: int,
+        block_size: int,
+        num_heads: int,
+        d_k: int,
+        window_size: int | None = None,
+        quantize: bool = False,
+        device=None,
+        dtype=None,
+    ):
+        shape = (num_layers, num_blocks, num_heads, block_size, d_k)
+        buffer_cls = Int8KVBuffer if quantize else torch.zeros
+        self.keys = buffer_cls(shape, device=device, dtype=dtype)
+        self.values = buffer_cls(shape, device=device, dtype=dtype)
+        self.num_blocks, self.block_size = num_blocks, block_size
+        # Sliding-window attention span of the model, if any
+        self.window_size = window_size
+        self.free_blocks = list(range(num_blocks))
+        self.block_tables: dict[int, list[int]] = {}
+        self.seq_lens: dict[int, int] = {}
+
+    def allocate(self, seq_id: int, max_tokens: int) -> bool:
+        """Reserve blocks for up to `max_tokens` tokens of a new sequence; False if the pool is too full."""
+        num_blocks = math.ceil(max_tokens / self.block_size)
+        if num_blocks > len(self.free_blocks):
+            return False
+        self.block_tables[seq_id] = [self.free_blocks.pop() for _ in range(num_blocks)]
+        self.seq_lens[seq_id] = 0
+        return True
+
+    def free(self, seq_id: int):
+        self.free_blocks.extend(self.block_tables.pop(seq_id))
+        del self.seq_lens[seq_id]
+
+    def batch(self, seq_ids: list[int]) -> "PagedBatch":
+        return PagedBatch(self, seq_ids)
+
+    def _slots(self, seq_id: int, start: int, end: int) -> tuple[torch.Tensor, torch.Tensor]:
+        positions = torch.arange(start, end, device=self.keys.device)
+        table = torch.tensor(self.block_tables[seq_id], device=self.keys.device)
+        return table[positions // self.block_size], positions % self.block_size
+
+    def append(self, seq_id: int, keys: torch.Tensor, values: torch.Tensor):
+        """Append (num_layers, num_heads, n, d_k) keys and values to a sequence, e.g. from a PrefixCache."""
+        start = self.seq_lens[seq_id]
+        blocks, offsets = self._slots(seq_id, start, start + keys.shape[2])
+        # Indexing gives (n, num_layers, num_heads, d_k)
+        self.keys[:, blocks, :, offsets] = keys.permute(2, 0, 1, 3).to(self.keys.dtype)
+        self.values[:, blocks, :, offsets] = values.permute(2, 0, 1, 3).to(self.values.dtype)
+        self.seq_lens[seq_id] += keys.shape[2]
+
+    def read(self, seq_id: int, length: int) -> tuple[torch.Tensor, torch.Tensor]:
+        """The (num_layers, num_heads, length, d_k) keys and values of a sequence's first `length` tokens."""
+        blocks, offsets = self._slots(seq_id, 0, length)
+        # Indexing gives (length, num_layers, num_heads, d_k)
+        keys = self.keys[:, blocks, :, offsets].permute(1, 2, 0, 3)
+        values = self.values[:, blocks, :, offsets].permute(1, 2, 0, 3)
+        return keys, values
+
+
+class PagedBatch:
+    """
+    A batch of sequences of a PagedKVCache, passed as `kv_cache` to TransformerLM. It provides
+    the same interface as KVCache; each sequence continues from its own length.
+    """
+
+    def __init__(self, cache: PagedKVCache, seq_ids: list[int]):
+        self.cache = cache
+        self.seq_ids = seq_ids
+        device = cache.keys.device
+        self.lengths = torch.tensor([cache.seq_lens[s] for s in seq_ids], device=device)
+        max_blocks = max(len(cache.block_tables[s]) for s in seq_ids)
+        # Pad the block tables with block 0; slots past a sequence's length are masked anyway
+        self.block_tables = torch.tensor(
+            [cache.block_tables[s] + [0] * (max_blocks - len(cache.block_tables[s])) for s in seq_ids],
+            device=device,
+        )
+
+    def positions(self, num_new: int) -> torch.Tensor:
+        return self.lengths[:, None] + torch.arange(num_new, device=self.lengths.device)
+
+    def mask(self, num_new: int) -> torch.Tensor:
+        end = int(self.lengths.max()) + num_new
+        key_slots = torch.arange(end, device=self.lengths.device)
+        query_slots = self.positions(num_new)[..., None]
+        mask = key_slots <= query_slots
+        if self.cache.window_size is not None:
+            mask &= key_slots > query_slots - self.cache.window_size
+        return mask.unsqueeze(1)
+
+    def update(self, layer_idx: int, k: torch.Tensor, v: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        block_size = self.cache.block_size
+        positions = self.positions(k.shape[-2])
+        blocks = self.block_tables.gather(1, positions // block_size)
+        offsets = positions % block_size
+        # (batch, num_new) block/offset indices around the head slice: values are (batch, num_new, heads, d_k)
+        self.cache.keys[layer_idx, blocks, :, offsets] = k.transpose(1, 2).to(self.cache.keys.dtype)
+        self.cache.values[layer_idx, blocks, :, offsets] = v.transpose(1, 2).to(self.cache.values.dtype)
+
+        end = int(self.lengths.max()) + k.shape[-2]
+
+        def gather(pool: torch.Tensor) -> torch.Tensor:
+            # (batch, max_blocks, heads, block_size, d_k) -> (batch, heads, max_blocks * block_size, d_k)
+            blocks = pool[layer_idx, self.block_tables].transpose(1, 2)
+            return blocks.flatten(2, 3)[:, :, :end]
+
+        return gather(self.cache.keys), gather(self.cache.values)
+
+    def advance(self, num_new: int):
+        self.lengths += num_new
+        for seq_id in self.seq_ids:
+            self.cache.seq_lens[seq_id] += num_new
+
+
+@dataclass
+class _Request:
+    seq_id: int
+    prompt_ids: list[int]
+    max_new_tokens: int
+    temperature: float
+    top_k: int | None
+    top_p: float | None
+    # Text pieces, then None when done, or the exception that failed the request
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    token_ids: list[int] = field(default_factory=list)
+    text: str = ""
+    next_input: int = 0
+    # Set when the caller stops consuming the output, so the scheduler drops the request
+    cancelled: bool = False
+
+
+class InferenceEngine:
+    """
+    Serves generation requests for `model` with continuous batching.
+
+    `tokenizer` needs `encode(str) -> list[int]` and `decode(list[int]) -> str`. Call `run()`
+    (e.g. as a background task) to process requests submitted through `generate()`.
+    """
+
+    def __init__(
+        self,
+        model: TransformerLM,
+        tokenizer: Any,
+        num_blocks: int = 256,
+        block_size: int = 16,
+        max_batch_size: int = 16,
+        eos_token: str = "<|endoftext|>",
+        prefix_cache_bytes: int = 0,
+        quantize_kv_cache: bool = False,
+    ):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        eos_ids = tokenizer.encode(eos_token)
+        self.eos_token_id = eos_ids[0] if len(eos_ids) == 1 else None
+
+        attn = model.layers[0].attn
+        self.cache = PagedKVCache(
+            len(model.layers),
+            num_blocks,
+            block_size,
+            attn.num_kv_heads,
+            attn.d_k,
+            window_size=attn.window_size,
+            quantize=quantize_kv_cache,
+            device=model.ln_final.weight.device,
+            dtype=model.autocast_dtype or model.ln_final.weight.dtype,
+        )
+        # Keys/values of recent prompts, so that shared prefixes (e.g. system prompts) are not recomputed
+        self.prefix_cache = PrefixCache(prefix_cache_bytes) if prefix_cache_bytes > 0 else None
+        self._next_seq_id = 0
+        self._waiting: deque[_Request] = deque()
+        self._running: list[_Request] = []
+        self._wakeup = asyncio.Event()
+
+    async def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 256,
+        temperature: float = 1.0,
+        top_k: int | None = None,
+        top_p: float | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Submit a request and yield its completion as text, piece by piece.
+
+        Invalid arguments raise ValueError before the request is queued, as does a request that
+        needs more KV cache slots than the whole pool has; an error while the request is being
+        processed is raised here, and only fails this request. When the caller stops iterating
+        (e.g. its task is cancelled), the request is dropped and its slots are freed.
+        """
+        prompt_ids = self.tokenizer.encode(prompt)
+        if not prompt_ids:
+            raise ValueError("prompt must not be empty")
+        if len(prompt_ids) > self.model.context_length:
+            raise ValueError(f"prompt is longer than the context length {self.model.context_length}")
+        if max_new_tokens < 1:
+            raise ValueError("max_new_tokens must be positive")
+        if temperature < 0:
+            raise ValueError(f"temperature must be non-negative, got {temperature}")
+        if top_k is not None and top_k < 1:
+            raise ValueError(f"top_k must be at least 1, got {top_k}")
+        if top_p is not None and not 0 < top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {top_p}")
+        # The last sampled token is never fed back, hence the + 1
+        max_new_tokens = min(max_new_tokens, self.model.context_length - len(prompt_ids) + 1)
+        capacity = self.cache.num_blocks * self.cache.block_size
+        if len(prompt_ids) + max_new_tokens - 1 > capacity:
+            raise ValueError(
+                f"prompt and max_new_tokens need {len(prompt_ids) + max_new_tokens - 1} KV cache slots, "
+                f"more than the pool's {capacity}"
+            )
+
+        request = _Request(self._next_seq_id, prompt_ids, max_new_tokens, temperature, top_k, top_p)
+        self._next_seq_id += 1
+        self._waiting.append(request)
+        self._wakeup.set()
+
+        try:
+            while (piece := await request.queue.get()) is not None:
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            # No-op for a finished request; otherwise the scheduler frees it after its current step
+            request.cancelled = True
+            if request in self._waiting:
+                self._waiting.remove(request)
+
+    async def run(self):
+        """Schedule forever: admit waiting requests, run one decode step, deliver the new tokens."""
+        while True:
+            if not self._waiting and not self._running:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            admitted = []
+            while self._waiting and len(self._running) + len(admitted) < self.max_batch_size:
+                request = self._waiting[0]
+                # Reserve every slot the request can use, so that running sequences never run out of blocks
+                max_tokens = len(request.prompt_ids) + request.max_new_tokens - 1
+                if not self.cache.allocate(request.seq_id, max_tokens):
+                    break
+                admitted.append(self._waiting.popleft())
+            # `generate` only accepts requests that fit the empty pool
+            assert admitted or self._running
+
+            # The model runs in a worker thread so that the event loop keeps serving connections
+            decoding = list(self._running)
+            try:
+                await asyncio.to_thread(self._step, admitted, decoding)
+            # Whatever the model raises, fail the requests of this step only and keep serving the others
+            except Exception as e:  # noqa: BLE001
+                for request in admitted + decoding:
+                    self.cache.free(request.seq_id)
+                    request.queue.put_nowait(e)
+                self._running = []
+                continue
+
+            for request in admitted + decoding:
+                self._deliver(request)
+            self._running = [r for r in admitted + decoding if r.seq_id in self.cache.seq_lens]
+
+    @torch.no_grad()
+    def _step(self, admitted: list[_Request], decoding: list[_Request]):
+        # Newly admitted requests are prefilled one at a time, since their prompt lengths differ
+        for request in admitted:
+            prompt_ids, num_cached = request.prompt_ids, 0
+            if self.prefix_cache is not None:
+                # Leave at least the last prompt token uncached; its logits give the first new token
+                num_cached, keys, values = self.prefix_cache.match(prompt_ids[:-1])
+                if num_cached:
+                    self.cache.append(request.seq_id, keys, values)
+
+            prompt = torch.tensor([prompt_ids[num_cached:]], device=self.cache.keys.device)
+            logits = self.model(prompt, kv_cache=self.cache.batch([request.seq_id]))[:, -1]
+            self._sample([request], logits)
+
+            if self.prefix_cache is not None:
+                self.prefix_cache.insert(prompt_ids, *self.cache.read(request.seq_id, len(prompt_ids)))
+
+        if decoding:
+            in_indices = torch.tensor([[r.next_input] for r in decoding], device=self.cache.keys.device)
+            logits = self.model(in_indices, kv_cache=self.cache.batch([r.seq_id for r in decoding]))[:, -1]
+            self._sample(decoding, logits)
+
+    def _sample(self, requests: list[_Request], logits: torch.Tensor):
+        # One vectorized sampling call per distinct set of sampling parameters
+        groups: dict[tuple, list[int]] = {}
+        for i, r in enumerate(requests):
+            groups.setdefault((r.temperature, r.top_k, r.top_p), []).append(i)
+        for (temperature, top_k, top_p), rows in groups.items():
+            token_ids = sample_next_token(logits[rows], temperature, top_k, top_p)
+            for i, token_id in zip(rows, token_ids.tolist()):
+                requests[i].next_input = token_id
+
+    def _deliver(self, request: _Request):
+        token_id = request.next_input
+        finished = token_id == self.eos_token_id or request.cancelled
+        if not finished:
+            request.token_ids.append(token_id)
+            decoded = self.tokenizer.decode(request.token_ids)
+            # A token may end inside a multi-byte character, which decodes to U+FFFD until completed
+            if not decoded.endswith("\ufffd"):
+                request.queue.put_nowait(decoded[len(request.text) :])
+                request.text = decoded
+            finished = len(request.token_ids) == request.max_new_tokens
+        if finished:
+            self.cache.free(request.seq_id)
+            request.queue.put_nowait(None)
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _handle_http(engine: InferenceEngine, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Minimal HTTP/1.1 handler for `POST /generate` with a JSON body holding `prompt` and,
+    optionally, `max_new_tokens`, `temperature`, `top_k`, `top_p` and `stream`. Responds with
+    `{"text": ...}`, or with the text as a chunked stream when `stream` is true.
+    """
+
+    async def respond(status: str, body: dict):
+        data = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + data
+        )
+        await writer.drain()
+
+    try:
+        method, path, _ = (await reader.readline()).decode().split(" ", 2)
+        headers = {}
+        while (line := (await reader.readline()).decode().strip()) != "":
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        if (method, path) != ("POST", "/generate"):
+            await respond("404 Not Found", {"error": f"unknown endpoint {method} {path}"})
+            return
+        try:
+            params = json.loads(body)
+            prompt = params.pop("prompt")
+            stream = params.pop("stream", False)
+            pieces = engine.generate(prompt, **params)
+            first = await anext(pieces, "")
+        except (ValueError, KeyError, TypeError) as e:
+            await respond("400 Bad Request", {"error": repr(e)})
+            return
+        # Any other error comes from the model's step (see `InferenceEngine.run`)
+        except Exception as e:  # noqa: BLE001
+            await respond("500 Internal Server Error", {"error": repr(e)})
+            return
+
+        if not stream:
+            await respond("200 OK", {"text": first + "".join([piece async for piece in pieces])})
+            return
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\nTransfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+
+        def write_chunk(text: str):
+            # An empty chunk would terminate the response
+            if data := text.encode():
+                writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        write_chunk(first)
+        try:
+            async for piece in pieces:
+                write_chunk(piece)
+                await writer.drain()
+        finally:
+            # If the client disconnected (drain raises), the request is dropped now rather than decoded to the end
+            await pieces.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(engine: InferenceEngine, host: str = "127.0.0.1", port: int = 8000) -> asyncio.Server:
+    """Start the engine's scheduler and an HTTP server for it (see `_handle_http`)."""
+    task = asyncio.create_task(engine.run())
+    # Keep a reference so the scheduler task is not garbage collected while serving
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return await asyncio.start_server(lambda r, w: _handle_http(engine, r, w), host, port)
+
+
+async def serve(engine: InferenceEngine, host: str = "127.0.0.1", port: int = 8000):
+    server = await start_server(engine, host, port)
+    async with server:
+        await server.serve_forever()
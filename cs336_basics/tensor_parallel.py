@@ -0,0 +1,210 @@
+"""
+Megatron-style tensor parallelism for TransformerLM (Shoeybi et al., 2019).
+
+Within each block, the attention heads and the SwiGLU hidden units are split across the ranks
+of the default process group. `q/k/v_proj` and `ffn.w1/w3` are split column-wise (by output
+feature), so every rank computes its own heads and hidden units from the full input without
+communication; `output_proj` and `ffn.w2` are split row-wise (by input feature), and their
+partial outputs are summed with one all-reduce per sublayer. In backward, the gradient of
+each sublayer input is all-reduced once. Embeddings, norms and the LM head stay replicated.
+
+`tensor_parallel_lm` builds the sharded model directly, so no rank ever holds the full blocks;
+`parallelize_tensor` shards an existing model in place.
+"""
+
+import math
+
+import torch
+import torch.distributed as dist
+from torch import nn
+
+from cs336_basics.distributed import get_rank, get_world_size
+from cs336_basics.model import Embedding, Linear, RMSNorm, RotaryPositionalEmbedding, TransformerLM
+
+
+class _CopyToTensorParallel(torch.autograd.Function):
+    """Identity in forward; sums the gradient over ranks in backward."""
+
+    @staticmethod
+    def forward(ctx, x: torch.Tensor) -> torch.Tensor:
+        return x.view_as(x)
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> torch.Tensor:
+        grad_output = grad_output.clone(memory_format=torch.contiguous_format)
+        dist.all_reduce(grad_output)
+        return grad_output
+
+
+class _ReduceFromTensorParallel(torch.autograd.Function):
+    """Sums the partial outputs over ranks in forward; identity in backward."""
+
+    @staticmethod
+    def forward(ctx, x: torch.Tensor) -> torch.Tensor:
+        x = x.clone(memory_format=torch.contiguous_format)
+        dist.all_reduce(x)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> torch.Tensor:
+        return grad_output
+
+
+def _copy_input_to_tensor_parallel(module, args):
+    x, *rest = args
+    return (_CopyToTensorParallel.apply(x), *rest)
+
+
+class TensorParallelLinear(Linear):
+    """
+    This rank's shard of a `Linear(in_features, out_features)`.
+
+    `split_dim=0` keeps a slice of the output features (column parallel: the output stays
+    split across ranks); `split_dim=1` keeps a slice of the input features (row parallel: the
+    input must be split the same way, and the partial outputs are all-reduced).
+
+    Loading a state dict accepts either this shard or the full, unsharded weight.
+    """
+
+    def __init__(self, in_features: int, out_features: int, split_dim: int, device=None, dtype=None):
+        world_size = get_world_size()
+        shape = [out_features, in_features]
+        assert shape[split_dim] % world_size == 0, f"{shape[split_dim]} features over {world_size} ranks"
+        shape[split_dim] //= world_size
+        super().__init__(shape[1], shape[0], device=device, dtype=dtype)
+        # Initialized like the matching slice of the full Linear, not like a Linear of the shard's shape
+        std = math.sqrt(2 / (in_features + out_features))
+        nn.init.trunc_normal_(self.weight, std=std, a=-3 * std, b=3 * std)
+        self.rank, self.world_size = get_rank(), world_size
+        self.split_dim = split_dim
+        self.full_shape = (out_features, in_features)
+
+    @classmethod
+    def from_linear(cls, linear: Linear, split_dim: int) -> "TensorParallelLinear":
+        weight = linear.weight
+        module = cls(linear.in_features, linear.out_features, split_dim, device=weight.device, dtype=weight.dtype)
+        with torch.no_grad():
+            module.weight.copy_(module.shard(weight))
+        return module
+
+    def shard(self, weight: torch.Tensor) -> torch.Tensor:
+        """This rank's part of a full (out_features, in_features) weight."""
+        return weight.chunk(self.world_size, dim=self.split_dim)[self.rank]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        y = super().forward(x)
+        return _ReduceFromTensorParallel.apply(y) if self.split_dim == 1 else y
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        key = prefix + "weight"
+        if key in state_dict and tuple(state_dict[key].shape) == self.full_shape:
+            state_dict[key] = self.shard(state_dict[key])
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
+def _shard_blocks(model: TransformerLM, shard_linear) -> TransformerLM:
+    """Replace the projections of every block by `shard_linear(linear, split_dim)`."""
+    world_size = get_world_size()
+    for layer in model.layers:
+        attn, ffn = layer.attn, layer.ffn
+        assert attn.num_heads % world_size == 0 and attn.num_kv_heads % world_size == 0
+
+        # Heads are contiguous in the projections, so each rank gets whole heads, and the query
+        # heads of a rank share exactly the key/value heads of that rank
+        attn.q_proj = shard_linear(attn.q_proj, 0)
+        attn.k_proj = shard_linear(attn.k_proj, 0)
+        attn.v_proj = shard_linear(attn.v_proj, 0)
+        attn.output_proj = shard_linear(attn.output_proj, 1)
+        # Per-rank sizes
+        attn.num_heads //= world_size
+        attn.num_kv_heads //= world_size
+        attn.d_model //= world_size
+
+        ffn.w1 = shard_linear(ffn.w1, 0)
+        ffn.w3 = shard_linear(ffn.w3, 0)
+        ffn.w2 = shard_linear(ffn.w2, 1)
+
+        for sublayer in (attn, ffn):
+            sublayer.register_forward_pre_hook(_copy_input_to_tensor_parallel)
+    return model
+
+
+def parallelize_tensor(model: TransformerLM) -> TransformerLM:
+    """
+    Shard the blocks of `model` in place across the ranks of the default process group.
+
+    `model` must hold the same weights on every rank (same seed), or they can be loaded after
+    sharding from an unsharded state dict. The number of query and key/value heads and d_ff
+    must be divisible by the world size. A KV cache from `init_kv_cache` then only holds this
+    rank's heads.
+
+    Every rank needs the full model first; use `tensor_parallel_lm` for models that do not fit.
+    """
+    return _shard_blocks(model, TensorParallelLinear.from_linear)
+
+
+def tensor_parallel_lm(
+    vocab_size: int,
+    context_length: int,
+    d_model: int,
+    num_layers: int,
+    num_heads: int,
+    d_ff: int,
+    rope_theta: float = 10000.0,
+    compile: bool = False,
+    device=None,
+    dtype=None,
+    **kwargs,
+) -> TransformerLM:
+    """
+    A `TransformerLM` with these arguments, built with its blocks already sharded as by
+    `parallelize_tensor`: each rank only ever allocates its slice of the projections.
+
+    Weights are randomly initialized; `load_state_dict` with an unsharded state dict (e.g. a
+    checkpoint of the full model) keeps each rank's slice of it.
+    """
+    # The meta device gives the model's structure without storage; every module is then
+    # replaced by one on `device`, the projections by this rank's shard only
+    model = TransformerLM(
+        vocab_size,
+        context_length,
+        d_model,
+        num_layers,
+        num_heads,
+        d_ff,
+        rope_theta=rope_theta,
+        device="meta",
+        dtype=dtype,
+        **kwargs,
+    )
+    model.token_embeddings = Embedding(vocab_size, d_model, device=device, dtype=dtype)
+    model.ln_final = RMSNorm(d_model, device=device, dtype=dtype)
+    model.lm_head = Linear(d_model, vocab_size, device=device, dtype=dtype)
+    rope = RotaryPositionalEmbedding(rope_theta, d_model // num_heads, context_length, device=device)
+    for layer in model.layers:
+        layer.ln1 = RMSNorm(d_model, device=device, dtype=dtype)
+        layer.ln2 = RMSNorm(d_model, device=device, dtype=dtype)
+        layer.attn.rope = rope
+
+    def shard_linear(linear: Linear, split_dim: int) -> TensorParallelLinear:
+        return TensorParallelLinear(linear.in_features, linear.out_features, split_dim, device=device, dtype=dtype)
+
+    _shard_blocks(model, shard_linear)
+    assert not any(t.is_meta for t in [*model.parameters(), *model.buffers()])
+    if compile:
+        model.compile_blocks()
+    return model
+
+
+def unsharded_state_dict(model: TransformerLM) -> dict[str, torch.Tensor]:
+    """
+    The state dict of a tensor-parallel `model` with the full weights, as before sharding.
+    This is a collective: every rank must call it, and every rank gets the full state dict.
+    """
+    state_dict = model.state_dict()
+    for name, module in model.named_modules():
+        if isinstance(module, TensorParallelLinear):
+            shards = [torch.empty_like(module.weight) for _ in range(module.world_size)]
+            dist.all_gather(shards, module.weight.detach().contiguous())
+            state_dict[f"{name}.weight"] = torch.cat(shards, dim=module.split_dim)
+    return state_dict
@@ -0,0 +1,341 @@
+"""
+Train a TransformerLM on pre-tokenized data.
+
+The training and validation sets are flat binary files of token ids (e.g. written with
+`np.array(ids, dtype=np.uint16).tofile(path)`), read through `np.memmap`.
+
+Example:
+    uv run python -m cs336_basics.train \
+        --train-data data/ts_train.bin --val-data data/ts_valid.bin \
+        --context-length 256 --d-model 512 --num-layers 4 --num-heads 16 --d-ff 1344 \
+        --batch-size 64 --max-iters 5000 --log-jsonl runs/ts.jsonl
+
+Data parallelism: add `--world-size N` to spawn N local processes (gloo by default), or launch
+with `torchrun --nproc-per-node N -m cs336_basics.train ...`. `--batch-size` is per process.
+`--shard-optimizer-states` additionally splits the optimizer state across the processes.
+"""
+
+import argparse
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from cs336_basics.data import build_eot_index, get_batch, get_packed_batch
+from cs336_basics.distributed import GradientAllReducer, ShardedOptimizer, get_rank, get_world_size, spawn
+from cs336_basics.model import TransformerLM
+from cs336_basics.nn_utils import clip_gradients
+from cs336_basics.optimizer import AdamW, CosineLRScheduler, FlatAdamW
+from cs336_basics.serialization import AsyncCheckpointer, load_checkpoint
+
+
+def get_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # Data
+    parser.add_argument("--train-data", required=True, help="Binary file of training token ids")
+    parser.add_argument("--val-data", default=None, help="Binary file of validation token ids")
+    parser.add_argument("--data-dtype", default="uint16", help="NumPy dtype of the token id files")
+    parser.add_argument(
+        "--eot-token-id", type=int, default=None, help="Pack documents: no attention across this end-of-text token"
+    )
+
+    # Model
+    parser.add_argument("--vocab-size", type=int, default=10_000)
+    parser.add_argument("--context-length", type=int, default=256)
+    parser.add_argument("--d-model", type=int, default=512)
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--num-heads", type=int, default=16)
+    parser.add_argument("--num-kv-heads", type=int, default=None, help="Key/value heads for GQA (1 for MQA)")
+    parser.add_argument("--window-size", type=int, default=None, help="Sliding-window attention span")
+    parser.add_argument("--d-ff", type=int, default=1344)
+    parser.add_argument("--rope-theta", type=float, default=10000.0)
+
+    # Optimization
+    parser.add_argument("--batch-size", type=int, default=64, help="Sequences per micro-batch")
+    parser.add_argument("--grad-accum-steps", type=int, default=1, help="Micro-batches per optimizer step")
+    parser.add_argument("--max-iters", type=int, default=5000)
+    parser.add_argument("--max-lr", type=float, default=1e-3)
+    parser.add_argument("--min-lr", type=float, default=1e-4)
+    parser.add_argument("--warmup-iters", type=int, default=200)
+    parser.add_argument("--weight-decay", type=float, default=0.1)
+    parser.add_argument("--beta1", type=float, default=0.9)
+    parser.add_argument("--beta2", type=float, default=0.95)
+    parser.add_argument("--max-grad-norm", type=float, default=1.0)
+    parser.add_argument("--optimizer", choices=["adamw", "flat-adamw"], default="adamw")
+    parser.add_argument("--bf16-optimizer-states", action="store_true", help="bf16 moments (flat-adamw only)")
+    parser.add_argument("--loss-chunk-size", type=int, default=1024, help="Positions per LM head + loss chunk")
+    parser.add_argument("--bf16", action="store_true", help="Run matmuls under bf16 autocast (fp32 master weights)")
+    parser.add_argument(
+        "--recompute", choices=["block", "attn"], default=None, help="Recompute block or attention activations"
+    )
+    parser.add_argument("--recompute-every", type=int, default=1, help="Apply --recompute to every k-th block")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the transformer blocks")
+    parser.add_argument("--compile-cache-dir", default=None, help="Persistent inductor cache directory")
+
+    # Evaluation, checkpointing and logging
+    parser.add_argument("--eval-interval", type=int, default=500)
+    parser.add_argument("--eval-batches", type=int, default=20)
+    parser.add_argument("--checkpoint-dir", default=None)
+    parser.add_argument("--checkpoint-interval", type=int, default=1000)
+    parser.add_argument("--keep-last-checkpoints", type=int, default=3)
+    parser.add_argument("--resume", default=None, help="Checkpoint to resume from")
+    parser.add_argument("--log-interval", type=int, default=10)
+    parser.add_argument("--log-jsonl", default=None, help="Append metrics to this JSONL file")
+    parser.add_argument("--wandb-project", default=None, help="Log metrics to this wandb project")
+    parser.add_argument("--peak-flops", type=float, default=None, help="Peak FLOP/s per process, for MFU")
+
+    parser.add_argument("--world-size", type=int, default=1, help="Data-parallel processes to spawn locally")
+    parser.add_argument("--dist-backend", default="gloo")
+    parser.add_argument("--bucket-size-mb", type=float, default=25.0, help="Gradient all-reduce bucket size")
+    parser.add_argument(
+        "--shard-optimizer-states", action="store_true", help="Each process keeps 1/world-size of the optimizer state"
+    )
+
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def flops_per_token(model: TransformerLM, context_length: int) -> float:
+    """
+    Approximate training FLOPs per token: 6 per non-embedding parameter (forward + backward
+    matmuls) plus the attention score and weighted-sum matmuls.
+    """
+    num_params = sum(p.numel() for p in model.parameters()) - model.token_embeddings.weight.numel()
+    num_layers = len(model.layers)
+    d_model = model.token_embeddings.weight.shape[1]
+    return 6 * num_params + 12 * num_layers * d_model * context_length
+
+
+class MetricsLogger:
+    """
+    Sends metrics to wandb and/or a local JSONL file.
+    """
+
+    def __init__(self, jsonl_path: str | None, wandb_project: str | None, config: dict):
+        self.jsonl_path = jsonl_path
+        if jsonl_path is not None:
+            Path(jsonl_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.wandb = None
+        if wandb_project is not None:
+            import wandb
+
+            self.wandb = wandb
+            wandb.init(project=wandb_project, config=config)
+
+    def log(self, metrics: dict, step: int):
+        if self.jsonl_path is not None:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps({"step": step, **metrics}) + "\n")
+        if self.wandb is not None:
+            self.wandb.log(metrics, step=step)
+
+    def close(self):
+        if self.wandb is not None:
+            self.wandb.finish()
+
+
+class StepTimer:
+    """
+    Accumulates wall-clock time per phase. On CUDA the device is synchronized at each phase
+    boundary, otherwise asynchronous kernel launches would be charged to the wrong phase.
+    """
+
+    def __init__(self, device: torch.device):
+        self.sync = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+        self.totals: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        self.sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sync()
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def pop(self) -> dict[str, float]:
+        totals, self.totals = self.totals, {}
+        return totals
+
+
+def sample_batch(
+    dataset: np.ndarray, eot_index: np.ndarray | None, args: argparse.Namespace
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor | None]:
+    """(inputs, targets, document_ids), with document ids only in packed-document mode."""
+    if eot_index is None:
+        return *get_batch(dataset, args.batch_size, args.context_length, args.device), None
+    return get_packed_batch(dataset, args.batch_size, args.context_length, args.device, eot_index)
+
+
+@torch.no_grad()
+def evaluate(
+    model: TransformerLM, dataset: np.ndarray, args: argparse.Namespace, eot_index: np.ndarray | None = None
+) -> float:
+    model.eval()
+    losses = []
+    for _ in range(args.eval_batches):
+        x, y, document_ids = sample_batch(dataset, eot_index, args)
+        losses.append(model.loss(x, y, chunk_size=args.loss_chunk_size, document_ids=document_ids).item())
+    model.train()
+    return float(np.mean(losses))
+
+
+def train(args: argparse.Namespace):
+    # With data parallelism, every rank samples its own batches from the shared token files
+    rank, world_size = get_rank(), get_world_size()
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed + rank)
+    device = torch.device(args.device)
+    if device.type == "cuda" and world_size > 1:
+        device = torch.device("cuda", rank % torch.cuda.device_count())
+        args.device = str(device)
+
+    train_data = np.memmap(args.train_data, dtype=args.data_dtype, mode="r")
+    val_data = np.memmap(args.val_data, dtype=args.data_dtype, mode="r") if args.val_data else None
+    train_eot_index = val_eot_index = None
+    if args.eot_token_id is not None:
+        train_eot_index = build_eot_index(train_data, args.eot_token_id)
+        if val_data is not None:
+            val_eot_index = build_eot_index(val_data, args.eot_token_id)
+
+    model = TransformerLM(
+        vocab_size=args.vocab_size,
+        context_length=args.context_length,
+        d_model=args.d_model,
+        num_layers=args.num_layers,
+        num_heads=args.num_heads,
+        num_kv_heads=args.num_kv_heads,
+        window_size=args.window_size,
+        d_ff=args.d_ff,
+        rope_theta=args.rope_theta,
+        autocast_dtype=torch.bfloat16 if args.bf16 else None,
+        recompute=args.recompute,
+        recompute_every=args.recompute_every,
+        device=device,
+    )
+    if args.compile:
+        if args.compile_cache_dir is not None:
+            # Read by inductor when it first resolves its cache paths, i.e. on the first compile
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = args.compile_cache_dir
+        import torch._inductor.config as inductor_config
+
+        # Cache compiled FX graphs on disk too, so that later jobs skip most of the compile time
+        inductor_config.fx_graph_cache = True
+        model.compile_blocks()
+        model.warmup(args.batch_size)
+    optimizer_kwargs = {"lr": args.max_lr, "betas": (args.beta1, args.beta2), "weight_decay": args.weight_decay}
+    if args.optimizer == "flat-adamw":
+        optimizer_cls = FlatAdamW
+        optimizer_kwargs["bf16_states"] = args.bf16_optimizer_states
+    else:
+        optimizer_cls = AdamW
+    if args.shard_optimizer_states:
+        optimizer = ShardedOptimizer(model.parameters(), optimizer_cls, **optimizer_kwargs)
+    else:
+        optimizer = optimizer_cls(model.parameters(), **optimizer_kwargs)
+
+    start_iter = 0
+    if args.resume is not None:
+        start_iter = load_checkpoint(args.resume, model, optimizer)
+    grad_reducer = GradientAllReducer(model, args.bucket_size_mb) if world_size > 1 else None
+    scheduler = CosineLRScheduler(
+        optimizer, args.max_lr, args.min_lr, args.warmup_iters, args.max_iters, last_iter=start_iter - 1
+    )
+
+    # Only rank 0 checkpoints, evaluates and logs; the replicas are identical
+    checkpointer = None
+    if args.checkpoint_dir is not None and rank == 0:
+        checkpointer = AsyncCheckpointer(args.checkpoint_dir, keep_last_k=args.keep_last_checkpoints)
+    if rank == 0:
+        logger = MetricsLogger(args.log_jsonl, args.wandb_project, vars(args))
+    else:
+        logger = MetricsLogger(None, None, {})
+
+    tokens_per_step = args.batch_size * args.grad_accum_steps * args.context_length * world_size
+    step_flops = flops_per_token(model, args.context_length) * tokens_per_step
+    timer = StepTimer(device)
+    window_start, window_steps = time.perf_counter(), 0
+
+    for it in range(start_iter, args.max_iters):
+        for micro_step in range(args.grad_accum_steps):
+            with timer.phase("data"):
+                x, y, document_ids = sample_batch(train_data, train_eot_index, args)
+            with timer.phase("forward"):
+                loss = model.loss(x, y, chunk_size=args.loss_chunk_size, document_ids=document_ids)
+                loss = loss / args.grad_accum_steps
+            # Gradients are all-reduced during the backward pass of the last micro-batch only
+            last_micro_step = micro_step == args.grad_accum_steps - 1
+            sync_context = grad_reducer.no_sync() if grad_reducer and not last_micro_step else nullcontext()
+            with timer.phase("backward"), sync_context:
+                loss.backward()
+
+        with timer.phase("optim"):
+            if grad_reducer is not None:
+                grad_reducer.synchronize()
+            grad_norm = clip_gradients(model.parameters(), args.max_grad_norm)
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            lr = scheduler.step()
+        window_steps += 1
+
+        if (it + 1) % args.log_interval == 0:
+            elapsed = time.perf_counter() - window_start
+            phases = timer.pop()
+            metrics = {
+                "train/loss": loss.item() * args.grad_accum_steps,
+                "train/grad_norm": grad_norm.item() if grad_norm is not None else 0.0,
+                "train/lr": lr,
+                "perf/tokens_per_sec": tokens_per_step * window_steps / elapsed,
+                "perf/step_time": elapsed / window_steps,
+                **{f"perf/{name}_time": total / window_steps for name, total in phases.items()},
+            }
+            if args.peak_flops is not None:
+                metrics["perf/mfu"] = step_flops * window_steps / elapsed / (args.peak_flops * world_size)
+            logger.log(metrics, step=it + 1)
+            window_start, window_steps = time.perf_counter(), 0
+
+        if val_data is not None and rank == 0 and (it + 1) % args.eval_interval == 0:
+            logger.log({"val/loss": evaluate(model, val_data, args, val_eot_index)}, step=it + 1)
+            window_start, window_steps = time.perf_counter(), 0
+            timer.pop()
+
+        if args.checkpoint_dir is not None and ((it + 1) % args.checkpoint_interval == 0 or it + 1 == args.max_iters):
+            if isinstance(optimizer, ShardedOptimizer):
+                # Collective: every rank sends its slice of the optimizer state to rank 0
+                optimizer.consolidate_state_dict()
+            if checkpointer is not None:
+                checkpointer.save(model, optimizer, it + 1)
+
+    if checkpointer is not None:
+        checkpointer.close()
+    logger.close()
+    return model
+
+
+def main(argv: list[str] | None = None):
+    args = get_args(argv)
+    if args.device.startswith("cuda"):
+        torch.backends.cuda.matmul.allow_tf32 = True
+    if "RANK" in os.environ:
+        # Launched by torchrun, one process per rank
+        torch.distributed.init_process_group(args.dist_backend)
+        try:
+            train(args)
+        finally:
+            torch.distributed.destroy_process_group()
+    elif args.world_size > 1:
+        spawn(train, args.world_size, args, backend=args.dist_backend)
+    else:
+        train(args)
+
+
+if __name__ == "__main__":
+    main()
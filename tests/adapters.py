@@ -29,20 +29,11 @@ def run_linear(
     Returns:
         Float[Tensor, "... d_out"]: The transformed output of your linear module.
     """
-    import torch
-    from torch import nn
+    from cs336_basics.model import Linear
 
-    class Linear(nn.Module):
-        def __init__(self, in_features, out_features, device=None, dtype=None):
-            super.__init__()
-
-            self.W = nn.Parameter(torch.empty((out_features, in_features), device=device, dtype=dtype))
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-             return torch.einsum('bi, oi -> bi', x, self.W)
-
-    raise NotImplementedError
+    linear = Linear(d_in, d_out)
+    linear.load_state_dict({"weight": weights})
+    return linear(in_features)
 
 
 def run_embedding(
@@ -63,21 +54,11 @@ def run_embedding(
     Returns:
         Float[Tensor, "... d_model"]: Batch of embeddings returned by your Embedding layer.
     """
-    import torch
-    from torch import nn
+    from cs336_basics.model import Embedding
 
-    class Embedding(nn.Module):
-        def __init__(self, num_embeddings, embedding_dim, device=None, dtype=None):
-            super().__init__()
-
-            self.embedding = nn.Parameter(torch.empty((num_embeddings, embedding_dim), device=device, dtype=dtype))
-
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, token_ids: torch.Tensor) -> torch.Tensor:
-            return self.embedding[token_ids]
-
-    raise NotImplementedError
+    embedding = Embedding(vocab_size, d_model)
+    embedding.load_state_dict({"weight": weights})
+    return embedding(token_ids)
 
 
 def run_swiglu(
@@ -102,45 +83,11 @@ def run_swiglu(
     Returns:
         Float[Tensor, "... d_model"]: Output embeddings of the same shape as the input embeddings.
     """
-    # Example:
-    # If your state dict keys match, you can use `load_state_dict()`
-    # swiglu.load_state_dict(weights)
-    # You can also manually assign the weights
-    # swiglu.w1.weight.data = w1_weight
-    # swiglu.w2.weight.data = w2_weight
-    # swiglu.w3.weight.data = w3_weight
-    import torch
-    from torch import nn
-    import math
-
-    class SwiGLUFeedForward(nn.Module):
-        def __init__(self, d_model: int, device=None, dtype=None):
-            super.__init__()
-
-            d_ff_raw = d_model * 8 / 3
-
-            d_ff = int(math.ceil(d_ff_raw / 64) * 64)
-
-            self.w1 = nn.Parameter(torch.empty(d_model, 2 * d_ff, device=device, dtype=dtype))
-            self.b1 = nn.Parameter(torch.zero(2 * d_ff, device=device, dtype=dtype))
-
-            self.w2 = nn.Parameter(torch.empty(d_ff, d_model, device=device, dtype=dtype))
-            self.b2 = nn.Parameter(torch.zeros(d_model, device=device, dtype=dtype))
-
-            nn.init.trunc_normal_(self.w1)
-            nn.init.trunc_normal_(self.w2)
+    from cs336_basics.model import SwiGLU
 
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            x_proj = torch.einsum("bsd, dk -> bsk", x, self.w1) + self.b1
-
-            value, gate = x_proj.chunk(2, dim=1)
-
-            x_act = value * torch.nn.functional.relu(gate)
-
-            out = torch.einsum("bsd, dk -> bsk", x_act, self.w2) + self.b2
-            return out
-
-    raise NotImplementedError
+    swiglu = SwiGLU(d_model, d_ff)
+    swiglu.load_state_dict({"w1.weight": w1_weight, "w2.weight": w2_weight, "w3.weight": w3_weight})
+    return swiglu(in_features)
 
 
 def run_scaled_dot_product_attention(
@@ -161,41 +108,9 @@ def run_scaled_dot_product_attention(
     Returns:
         Float[Tensor, " ... queries d_v"]: Output of SDPA
     """
-    import torch
-    from torch import nn
-    import math
-
-    def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
-        x_max = torch.amax(x, dim, keepdim=True)
-        x_stable = x - x_max
-
-        exp_x = torch.exp(x_stable)
-        sum_exp = torch.sum(exp_x, dim, keepdim=True)
-
-        return exp_x / sum_exp
-
-    def scaled_dot_product_attention(q, k, v, mask=None):
-        """
-        :param q: (..., seq_len_q, d_k)
-        :param k: (..., seq_len_k, d_k)
-        :param v: (..., seq_len_v, d_v)
-        :param mask: optional (..., seq_len_q, seq_len_k) of bool
-        :return: output (..., seq_len_q, d_v)
-        """
-
-        d_k = q.size(-1)
-
-        scores = torch.einsum('...ik, ...jk -> ...ij', q, k) / math.sqrt(d_k)
-
-        if mask is not None:
-            scores = scores.masked_fill(~mask, float('-inf'))
-
-        attn_weights = softmax(scores, dim=-1)
-
-        output = torch.einsum('...ik, ...jk -> ...ij', attn_weights, v)
+    from cs336_basics.model import scaled_dot_product_attention
 
-        return output
-    raise NotImplementedError
+    return scaled_dot_product_attention(Q, K, V, mask=mask)
 
 
 def run_multihead_self_attention(
@@ -229,100 +144,18 @@ def run_multihead_self_attention(
         Float[Tensor, " ... sequence_length d_out"]: Tensor with the output of running your optimized, batched multi-headed attention
         implementation with the given QKV projection weights and input features.
     """
-    import torch
-    from torch import nn
-    import math
-
-    def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
-        x_max = torch.amax(x, dim, keepdim=True)
-        x_stable = x - x_max
-
-        exp_x = torch.exp(x_stable)
-        sum_exp = torch.sum(exp_x, dim, keepdim=True)
-
-        return exp_x / sum_exp
-
-    class Linear(nn.Module):
-        def __init__(self, in_features, out_features, device=None, dtype=None):
-            super.__init__()
-
-            self.W = nn.Parameter(
-                torch.empty((out_features, in_features), device=device, dtype=dtype))
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            return torch.einsum('bi, oi -> bi', x, self.W)
-
-    def scaled_dot_product_attention(q, k, v, mask=None):
-        """
-        :param q: (..., seq_len_q, d_k)
-        :param k: (..., seq_len_k, d_k)
-        :param v: (..., seq_len_v, d_v)
-        :param mask: optional (..., seq_len_q, seq_len_k) of bool
-        :return: output (..., seq_len_q, d_v)
-        """
-
-        d_k = q.size(-1)
-
-        scores = torch.einsum('...ik, ...jk -> ...ij', q, k) / math.sqrt(d_k)
-
-        if mask is not None:
-            scores = scores.masked_fill(~mask, float('-inf'))
-
-        attn_weights = softmax(scores, dim=-1)
-
-        output = torch.einsum('...ik, ...jk -> ...ij', attn_weights, v)
-
-        return output
-
-    class MultiHeadSelfAttention(nn.Module):
-        def __init__(self, d_model: int, num_heads: int, rope: nn.Module):
-            super.__init__()
-            assert d_model % num_heads == 0
+    from cs336_basics.model import MultiHeadSelfAttention
 
-            self.d_model = d_model
-            self.num_heads = num_heads
-            self.d_k = d_model // num_heads
-            self.d_v = self.d_k
-
-            self.q_proj = Linear(d_model, d_model)
-            self.k_proj = Linear(d_model, d_model)
-            self.v_proj = Linear(d_model, d_model)
-            self.out_proj = Linear(d_model, d_model)
-
-            self.rope = rope
-
-        def forward(self, x: torch.Tensor, token_positions: torch.Tensor) -> torch.Tensor:
-            batch_size, seq_len, _ = x.shape
-
-            q = self.q_proj(x)
-            k = self.k_proj(x)
-            v = self.v_proj(x)
-
-            # Reshape: (batch_size, seq_len, num_heads, d_k) -> (batch, num_heads, seq_len, d_k)
-            def split_heads(t):
-                return t.view(batch_size, seq_len, self.num_heads, self.d_k).transpose(1, 2)
-
-            q = split_heads(q)
-            k = split_heads(k)
-            v = split_heads(v)
-
-            # Apply RoPE
-            q = self.rope(q, token_positions)
-            k = self.rope(k, token_positions)
-
-            # Create casual mask
-            casual_mask = torch.triu(torch.ones(seq_len, seq_len))
-
-            # Compute scaled dot-product attention
-            attn_output = scaled_dot_product_attention(q, k, v, mask=casual_mask)
-
-            # Merge_heads: (batch, num_heads, seq_len, d_k) -> (batch, seq_len, d_k)
-            attn_output = torch.einsum('bnld-> bld', attn_output).reshape(batch_size, seq_len, self.d_model)
-
-            return self.out_proj(attn_output)
-
-    raise NotImplementedError
+    mha = MultiHeadSelfAttention(d_model, num_heads)
+    mha.load_state_dict(
+        {
+            "q_proj.weight": q_proj_weight,
+            "k_proj.weight": k_proj_weight,
+            "v_proj.weight": v_proj_weight,
+            "output_proj.weight": o_proj_weight,
+        }
+    )
+    return mha(in_features)
 
 
 def run_multihead_self_attention_with_rope(
@@ -362,7 +195,19 @@ def run_multihead_self_attention_with_rope(
         Float[Tensor, " ... sequence_length d_out"]: Tensor with the output of running your optimized, batched multi-headed attention
         implementation with the given QKV projection weights and input features.
     """
-    raise NotImplementedError
+    from cs336_basics.model import MultiHeadSelfAttention, RotaryPositionalEmbedding
+
+    rope = RotaryPositionalEmbedding(theta, d_model // num_heads, max_seq_len)
+    mha = MultiHeadSelfAttention(d_model, num_heads, rope=rope)
+    mha.load_state_dict(
+        {
+            "q_proj.weight": q_proj_weight,
+            "k_proj.weight": k_proj_weight,
+            "v_proj.weight": v_proj_weight,
+            "output_proj.weight": o_proj_weight,
+        }
+    )
+    return mha(in_features, token_positions)
 
 
 def run_rope(
@@ -384,7 +229,10 @@ def run_rope(
     Returns:
         Float[Tensor, " ... sequence_length d_k"]: Tensor with RoPEd input.
     """
-    raise NotImplementedError
+    from cs336_basics.model import RotaryPositionalEmbedding
+
+    rope = RotaryPositionalEmbedding(theta, d_k, max_seq_len)
+    return rope(in_query_or_key, token_positions)
 
 
 def run_transformer_block(
@@ -457,167 +305,12 @@ def run_transformer_block(
         Float[Tensor, "batch sequence_length d_model"] Tensor with the output of
         running the Transformer block on the input features while using RoPE.
     """
-    import torch
-    from torch import nn, optim
-    import math
-
-    # Multi head self attention
-    def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
-        x_max = torch.amax(x, dim, keepdim=True)
-        x_stable = x - x_max
-
-        exp_x = torch.exp(x_stable)
-        sum_exp = torch.sum(exp_x, dim, keepdim=True)
-
-        return exp_x / sum_exp
-
-    class Linear(nn.Module):
-        def __init__(self, in_features, out_features, device=None, dtype=None):
-            super.__init__()
-
-            self.W = nn.Parameter(
-                torch.empty((out_features, in_features), device=device, dtype=dtype))
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            return torch.einsum('bi, oi -> bi', x, self.W)
-
-    def scaled_dot_product_attention(q, k, v, mask=None):
-        """
-        :param q: (..., seq_len_q, d_k)
-        :param k: (..., seq_len_k, d_k)
-        :param v: (..., seq_len_v, d_v)
-        :param mask: optional (..., seq_len_q, seq_len_k) of bool
-        :return: output (..., seq_len_q, d_v)
-        """
-
-        d_k = q.size(-1)
-
-        scores = torch.einsum('...ik, ...jk -> ...ij', q, k) / math.sqrt(d_k)
-
-        if mask is not None:
-            scores = scores.masked_fill(~mask, float('-inf'))
-
-        attn_weights = softmax(scores, dim=-1)
-
-        output = torch.einsum('...ik, ...jk -> ...ij', attn_weights, v)
-
-        return output
-
-    class MultiHeadSelfAttention(nn.Module):
-        def __init__(self, d_model: int, num_heads: int, rope: nn.Module):
-            super.__init__()
-            assert d_model % num_heads == 0
-
-            self.d_model = d_model
-            self.num_heads = num_heads
-            self.d_k = d_model // num_heads
-            self.d_v = self.d_k
-
-            self.q_proj = Linear(d_model, d_model)
-            self.k_proj = Linear(d_model, d_model)
-            self.v_proj = Linear(d_model, d_model)
-            self.out_proj = Linear(d_model, d_model)
-
-            self.rope = rope
-
-        def forward(self, x: torch.Tensor, token_positions: torch.Tensor) -> torch.Tensor:
-            batch_size, seq_len, _ = x.shape
-
-            q = self.q_proj(x)
-            k = self.k_proj(x)
-            v = self.v_proj(x)
-
-            # Reshape: (batch_size, seq_len, num_heads, d_k) -> (batch, num_heads, seq_len, d_k)
-            def split_heads(t):
-                return t.view(batch_size, seq_len, self.num_heads, self.d_k).transpose(1, 2)
-
-            q = split_heads(q)
-            k = split_heads(k)
-            v = split_heads(v)
-
-            # Apply RoPE
-            q = self.rope(q, token_positions)
-            k = self.rope(k, token_positions)
-
-            # Create casual mask
-            casual_mask = torch.triu(torch.ones(seq_len, seq_len))
-
-            # Compute scaled dot-product attention
-            attn_output = scaled_dot_product_attention(q, k, v, mask=casual_mask)
+    from cs336_basics.model import RotaryPositionalEmbedding, TransformerBlock
 
-            # Merge_heads: (batch, num_heads, seq_len, d_k) -> (batch, seq_len, d_k)
-            attn_output = torch.einsum('bnld-> bld', attn_output).reshape(batch_size, seq_len, self.d_model)
-
-            return self.out_proj(attn_output)
-
-    # RMS norm
-    class RMSNorm(nn.Module):
-        def __init__(self, d_model: int, eps: float = 1e-5, device=None, dtype=None):
-            super.__init__()
-            self.eps = eps
-
-            # Learnable scale parameter
-            self.weight = nn.Parameter(torch.ones(d_model, device=device, dtype=dtype))
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            in_dtype = x.dtype
-            x = x.to(dtype=torch.float32)
-
-            rms = torch.sqrt(torch.sum(x * x, dim=-1, keepdim=True) + self.eps)
-
-            normed = x / rms
-
-            result = torch.einsum('bsd, d -> bsd', normed, self.weight)
-            return result.to(dtype=in_dtype)
-
-    # Feed forward
-    class SwiGLUFeedForward(nn.Module):
-        def __init__(self, d_model: int, device=None, dtype=None):
-            super.__init__()
-
-            d_ff_raw = d_model * 8 / 3
-
-            d_ff = int(math.ceil(d_ff_raw / 64) * 64)
-
-            self.w1 = nn.Parameter(torch.empty(d_model, 2 * d_ff, device=device, dtype=dtype))
-            self.b1 = nn.Parameter(torch.zero(2 * d_ff, device=device, dtype=dtype))
-
-            self.w2 = nn.Parameter(torch.empty(d_ff, d_model, device=device, dtype=dtype))
-            self.b2 = nn.Parameter(torch.zeros(d_model, device=device, dtype=dtype))
-
-            nn.init.trunc_normal_(self.w1)
-            nn.init.trunc_normal_(self.w2)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            x_proj = torch.einsum("bsd, dk -> bsk", x, self.w1) + self.b1
-
-            value, gate = x_proj.chunk(2, dim=1)
-
-            x_act = value * torch.nn.functional.relu(gate)
-
-            out = torch.einsum("bsd, dk -> bsk", x_act, self.w2) + self.b2
-            return out
-
-    class transformer_block(nn.Module):
-        def __init__(self, d_model: int, num_heads: int, d_ff: int):
-            super.__init__()
-            self.norm1 = RMSNorm(d_model, eps=1e-5)
-            self.norm2 = RMSNorm(d_model, eps=1e-5)
-
-            self.mha = MultiHeadSelfAttention(d_model, num_heads, rope=self)
-            self.ff = SwiGLUFeedForward(d_model, device=None, dtype=None)
-
-        def forward(self, x: torch.Tensor, token_positions: torch.tensor) -> torch.Tensor:
-            # Sublayer 1: MHA with residual
-            x = x + self.mha(self.norm1(x), token_positions)
-
-            # Sublayer 2: FF with residual
-            x = x + self.ff(self.norm2(x))
-
-            return x
-
-    raise NotImplementedError
+    rope = RotaryPositionalEmbedding(theta, d_model // num_heads, max_seq_len)
+    block = TransformerBlock(d_model, num_heads, d_ff, rope=rope)
+    block.load_state_dict(weights)
+    return block(in_features)
 
 
 def run_transformer_lm(
@@ -699,227 +392,11 @@ def run_transformer_lm(
         Float[Tensor, "batch_size sequence_length vocab_size"]: Tensor with the predicted unnormalized
         next-word distribution for each token.
     """
-    import torch
-    from torch import nn, optim
-    import math
-
-    # Multi head self attention
-    def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
-        x_max = torch.amax(x, dim, keepdim=True)
-        x_stable = x - x_max
-
-        exp_x = torch.exp(x_stable)
-        sum_exp = torch.sum(exp_x, dim, keepdim=True)
-
-        return exp_x / sum_exp
-
-    class Linear(nn.Module):
-        def __init__(self, in_features, out_features, device=None, dtype=None):
-            super.__init__()
+    from cs336_basics.model import TransformerLM
 
-            self.W = nn.Parameter(
-                torch.empty((out_features, in_features), device=device, dtype=dtype))
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            return torch.einsum('bi, oi -> bi', x, self.W)
-
-    def scaled_dot_product_attention(q, k, v, mask=None):
-        """
-        :param q: (..., seq_len_q, d_k)
-        :param k: (..., seq_len_k, d_k)
-        :param v: (..., seq_len_v, d_v)
-        :param mask: optional (..., seq_len_q, seq_len_k) of bool
-        :return: output (..., seq_len_q, d_v)
-        """
-
-        d_k = q.size(-1)
-
-        scores = torch.einsum('...ik, ...jk -> ...ij', q, k) / math.sqrt(d_k)
-
-        if mask is not None:
-            scores = scores.masked_fill(~mask, float('-inf'))
-
-        attn_weights = softmax(scores, dim=-1)
-
-        output = torch.einsum('...ik, ...jk -> ...ij', attn_weights, v)
-
-        return output
-
-    class MultiHeadSelfAttention(nn.Module):
-        def __init__(self, d_model: int, num_heads: int, rope: nn.Module):
-            super.__init__()
-            assert d_model % num_heads == 0
-
-            self.d_model = d_model
-            self.num_heads = num_heads
-            self.d_k = d_model // num_heads
-            self.d_v = self.d_k
-
-            self.q_proj = Linear(d_model, d_model)
-            self.k_proj = Linear(d_model, d_model)
-            self.v_proj = Linear(d_model, d_model)
-            self.out_proj = Linear(d_model, d_model)
-
-            self.rope = rope
-
-        def forward(self, x: torch.Tensor, token_positions: torch.Tensor) -> torch.Tensor:
-            batch_size, seq_len, _ = x.shape
-
-            q = self.q_proj(x)
-            k = self.k_proj(x)
-            v = self.v_proj(x)
-
-            # Reshape: (batch_size, seq_len, num_heads, d_k) -> (batch, num_heads, seq_len, d_k)
-            def split_heads(t):
-                return t.view(batch_size, seq_len, self.num_heads, self.d_k).transpose(1, 2)
-
-            q = split_heads(q)
-            k = split_heads(k)
-            v = split_heads(v)
-
-            # Apply RoPE
-            q = self.rope(q, token_positions)
-            k = self.rope(k, token_positions)
-
-            # Create casual mask
-            casual_mask = torch.triu(torch.ones(seq_len, seq_len))
-
-            # Compute scaled dot-product attention
-            attn_output = scaled_dot_product_attention(q, k, v, mask=casual_mask)
-
-            # Merge_heads: (batch, num_heads, seq_len, d_k) -> (batch, seq_len, d_k)
-            attn_output = torch.einsum('bnld-> bld', attn_output).reshape(batch_size, seq_len, self.d_model)
-
-            return self.out_proj(attn_output)
-
-    # RMS norm
-    class RMSNorm(nn.Module):
-        def __init__(self, d_model: int, eps: float = 1e-5, device=None, dtype=None):
-            super.__init__()
-            self.eps = eps
-
-            # Learnable scale parameter
-            self.weight = nn.Parameter(torch.ones(d_model, device=device, dtype=dtype))
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            in_dtype = x.dtype
-            x = x.to(dtype=torch.float32)
-
-            rms = torch.sqrt(torch.sum(x * x, dim=-1, keepdim=True) + self.eps)
-
-            normed = x / rms
-
-            result = torch.einsum('bsd, d -> bsd', normed, self.weight)
-            return result.to(dtype=in_dtype)
-
-    # Feed forward
-    class SwiGLUFeedForward(nn.Module):
-        def __init__(self, d_model: int, device=None, dtype=None):
-            super.__init__()
-
-            d_ff_raw = d_model * 8 / 3
-
-            d_ff = int(math.ceil(d_ff_raw / 64) * 64)
-
-            self.w1 = nn.Parameter(torch.empty(d_model, 2 * d_ff, device=device, dtype=dtype))
-            self.b1 = nn.Parameter(torch.zero(2 * d_ff, device=device, dtype=dtype))
-
-            self.w2 = nn.Parameter(torch.empty(d_ff, d_model, device=device, dtype=dtype))
-            self.b2 = nn.Parameter(torch.zeros(d_model, device=device, dtype=dtype))
-
-            nn.init.trunc_normal_(self.w1)
-            nn.init.trunc_normal_(self.w2)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            x_proj = torch.einsum("bsd, dk -> bsk", x, self.w1) + self.b1
-
-            value, gate = x_proj.chunk(2, dim=1)
-
-            x_act = value * torch.nn.functional.relu(gate)
-
-            out = torch.einsum("bsd, dk -> bsk", x_act, self.w2) + self.b2
-            return out
-
-    class Transformer_block(nn.Module):
-        def __init__(self, d_model: int, num_heads: int, d_ff: int):
-            super.__init__()
-            self.norm1 = RMSNorm(d_model, eps=1e-5)
-            self.norm2 = RMSNorm(d_model, eps=1e-5)
-
-            self.mha = MultiHeadSelfAttention(d_model, num_heads, rope=self)
-            self.ff = SwiGLUFeedForward(d_model, device=None, dtype=None)
-
-        def forward(self, x: torch.Tensor, token_positions: torch.tensor) -> torch.Tensor:
-            # Sublayer 1: MHA with residual
-            x = x + self.mha(self.norm1(x), token_positions)
-
-            # Sublayer 2: FF with residual
-            x = x + self.ff(self.norm2(x))
-
-            return x
-
-    # Embedding
-    class Embedding(nn.Module):
-        def __init__(self, num_embeddings, embedding_dim, device=None, dtype=None):
-            super().__init__()
-
-            self.embedding = nn.Parameter(torch.empty((num_embeddings, embedding_dim), device=device, dtype=dtype))
-
-            torch.nn.init.trunc_normal_(self.W.data, a=-3.0, b=3.0)
-
-        def forward(self, token_ids: torch.Tensor) -> torch.Tensor:
-            return self.embedding[token_ids]
-
-    class TransformerLM(nn.Module):
-        def __init__(self,
-                     vocab_size: int,
-                     context_length: int,
-                     num_layers: int,
-                     d_model: int,
-                     num_heads: int,
-                     d_ff: int,
-                     rope: nn.Module
-                     ):
-            super().__init__()
-            self.embedding = Embedding(vocab_size, d_model)
-            self.context_length = context_length
-            self.num_layers = num_layers
-
-            self.blocks = nn.ModuleList([
-                Transformer_block(d_model, num_heads, d_ff)
-                for _ in range(num_layers)
-            ]
-            )
-
-            self.final_norm = RMSNorm(d_model, eps=1e-5)
-            self.lm.head = Linear(d_model, vocab_size)
-
-        def forward(self, token_ids: torch.Tensor) -> torch.Tensor:
-            """
-            :param token_ids: (batch, seq_len)
-            :return: (batch, seq_len, vocab_size)
-            """
-
-            batch_size, seq_len, _ = token_ids.shape
-
-            # Embedding
-            x = self.embedding(token_ids)
-
-            # Positional information will be added via RoPE inside attention blocks
-            token_positions = torch.arange(seq_len, device=token_ids.device).unsqueeze(0)  # (1, seq_len)
-
-            # Transformer blocks
-            for block in self.blocks:
-                x = block(x, token_positions)
-
-            # Norm + add to vocab
-            x = self.final_norm(x)
-            logits = self.lm.head(x)  # (batch, seq_len, vocab_size)
-
-            return logits
-
-    raise NotImplementedError
+    model = TransformerLM(vocab_size, context_length, d_model, num_layers, num_heads, d_ff, rope_theta)
+    model.load_state_dict(weights)
+    return model(in_indices)
 
 
 def run_rmsnorm(
@@ -942,29 +419,11 @@ def run_rmsnorm(
         Float[Tensor,"... d_model"]: Tensor of with the same shape as `in_features` with the output of running
         RMSNorm of the `in_features`.
     """
-    import torch
-    from torch import nn
-
-    class RMSNorm(nn.Module):
-        def __init__(self, d_model: int, eps: float = 1e-5, device=None, dtype=None):
-            super.__init__()
-            self.eps = eps
-
-            # Learnable scale parameter
-            self.weight = nn.Parameter(torch.ones(d_model, device=device, dtype=dtype))
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            in_dtype = x.dtype
-            x = x.to(dtype=torch.float32)
+    from cs336_basics.model import RMSNorm
 
-            rms = torch.sqrt(torch.sum(x * x, dim=-1, keepdim=True) + self.eps)
-
-            normed = x / rms
-
-            result = torch.einsum('bsd, d -> bsd', normed, self.weight)
-            return result.to(dtype=in_dtype)
-
-    raise NotImplementedError
+    rmsnorm = RMSNorm(d_model, eps=eps)
+    rmsnorm.load_state_dict({"weight": weights})
+    return rmsnorm(in_features)
 
 
 def run_silu(in_features: Float[Tensor, " ..."]) -> Float[Tensor, " ..."]:
@@ -978,38 +437,9 @@ def run_silu(in_features: Float[Tensor, " ..."]) -> Float[Tensor, " ..."]:
         Float[Tensor,"..."]: of with the same shape as `in_features` with the output of applying
         SiLU to each element.
     """
-    import torch
-    from torch import nn
-    import math
-
-    class SwiGLUFeedForward(nn.Module):
-        def __init__(self, d_model: int, device=None, dtype=None):
-            super.__init__()
-
-            d_ff_raw = d_model * 8 / 3
-
-            d_ff = int(math.ceil(d_ff_raw / 64) * 64)
-
-            self.w1 = nn.Parameter(torch.empty(d_model, 2 * d_ff, device=device, dtype=dtype))
-            self.b1 = nn.Parameter(torch.zero(2 * d_ff, device=device, dtype=dtype))
-
-            self.w2 = nn.Parameter(torch.empty(d_ff, d_model, device=device, dtype=dtype))
-            self.b2 = nn.Parameter(torch.zeros(d_model, device=device, dtype=dtype))
-
-            nn.init.trunc_normal_(self.w1)
-            nn.init.trunc_normal_(self.w2)
-
-        def forward(self, x: torch.Tensor) -> torch.Tensor:
-            x_proj = torch.einsum("bsd, dk -> bsk", x, self.w1) + self.b1
+    from cs336_basics.model import silu
 
-            value, gate = x_proj.chunk(2, dim=1)
-
-            x_act = value * torch.nn.functional.relu(gate)
-
-            out = torch.einsum("bsd, dk -> bsk", x_act, self.w2) + self.b2
-            return out
-
-    raise NotImplementedError
+    return silu(in_features)
 
 
 def run_get_batch(
@@ -1032,27 +462,9 @@ def run_get_batch(
         is the sampled input sequences, and the second tuple item is the corresponding
         language modeling labels.
     """
-    import torch
-    import numpy as np
-    import numpy.typing as npt
-
-    def run_get_batch(dataset: npt.NDArray, batch_size: int, context_length: int, device: str) -> tuple[
-        torch.Tensor, torch.Tensor]:
-        # Sample random starting indices
-        max_start = len(dataset) - context_length - 1
-        starts = np.random.randint(0, max_start, size=batch_size)
-
-        # Create inputs and targets
-        inputs = np.stack(dataset[i: i + context_length] for i in starts)
-        targets = np.stack(dataset[i + 1: i + 1 + context_length] for i in starts)
-
-        # Converts to torch tensor
-        inputs_tensor = torch.tensor(inputs, dtype=torch.long, device=device)
-        targets_tensor = torch.tensor(targets, dtype=torch.long, device=device)
+    from cs336_basics.data import get_batch
 
-        return inputs_tensor, targets_tensor
-
-    raise NotImplementedError
+    return get_batch(dataset, batch_size, context_length, device)
 
 
 def run_softmax(in_features: Float[Tensor, " ..."], dim: int) -> Float[Tensor, " ..."]:
@@ -1068,19 +480,9 @@ def run_softmax(in_features: Float[Tensor, " ..."], dim: int) -> Float[Tensor, "
         Float[Tensor, "..."]: Tensor of with the same shape as `in_features` with the output of
         softmax normalizing the specified `dim`.
     """
-    import torch
-    from torch import nn
+    from cs336_basics.nn_utils import softmax
 
-    def softmax(x: torch.Tensor, dim: int) -> torch.Tensor:
-        x_max = torch.amax(x, dim, keepdim=True)
-        x_stable = x - x_max
-
-        exp_x = torch.exp(x_stable)
-        sum_exp = torch.sum(exp_x, dim, keepdim=True)
-
-        return exp_x / sum_exp
-
-    raise NotImplementedError
+    return softmax(in_features, dim)
 
 
 def run_cross_entropy(inputs: Float[Tensor, " batch_size vocab_size"], targets: Int[Tensor, " batch_size"]) -> Float[Tensor, ""]:
@@ -1096,29 +498,9 @@ def run_cross_entropy(inputs: Float[Tensor, " batch_size vocab_size"], targets:
     Returns:
         Float[Tensor, ""]: The average cross-entropy loss across examples.
     """
-    import torch
-    from numpy.ma.core import soften_mask
-    from torch import nn
-
-    def cross_entropy_loss(logits: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
-        """
-        Computes the cross entropy between logits and targets.
-        """
-        max_logits = logits.max(dim=-1, keepdim=True)[0]
-        logits_stable = logits - max_logits
-        exp_logits = torch.exp(logits_stable)
-        softmax_denominator = exp_logits.sum(dim=-1, keepdim=True)
+    from cs336_basics.nn_utils import cross_entropy
 
-        softmax_probs = exp_logits / softmax_denominator
-
-        # Gather probabilities of the correct tokens
-        correct_token_probs = softmax_probs.gather(-1, targets.unsqueeze(-1)).squeeze(-1)
-
-        # Cross entropy loss
-        loss = -torch.log(correct_token_probs)
-
-        return loss.mean()
-    raise NotImplementedError
+    return cross_entropy(inputs, targets)
 
 
 def run_gradient_clipping(parameters: Iterable[torch.nn.Parameter], max_l2_norm: float) -> None:
@@ -1130,90 +512,18 @@ def run_gradient_clipping(parameters: Iterable[torch.nn.Parameter], max_l2_norm:
 
     The gradients of the parameters (parameter.grad) should be modified in-place.
     """
-    import torch
-    from torch import nn
-
-    def clip_gradients(params, max_norm, eps=1e-6):
-        total_norm = 0
-        for p in params:
-            if p.grad is not None:
-                grad = p.grad.data
-                total_norm += torch.sum(grad ** 2).item()
-        total_norm = torch.sqrt(total_norm + eps)
-
-        if total_norm > max_norm:
-            scale = max_norm / (total_norm + eps)
-            for p in params:
-                if p.grad is not None:
-                    p.grad.data.mul_(scale)
+    from cs336_basics.nn_utils import clip_gradients
 
-    raise NotImplementedError
+    clip_gradients(parameters, max_l2_norm)
 
 
 def get_adamw_cls() -> type[torch.optim.Optimizer]:
     """
     Returns a torch.optim.Optimizer that implements AdamW.
     """
-    import torch
-    from torch.optim import Optimizer
-    import math
-
-    class AdamW(Optimizer):
-        def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0):
-            defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
-            super().__init__(params, defaults)
-
-        def step(self, closure=None):
-            loss = closure() if closure is not None else None
-
-            for group in self.param_groups:
-                for param in group['params']:
-                    if param.grad is None:
-                        continue
-                    grad = param.grad.data
-                    if grad.is_sparse:
-                        raise RuntimeError('Adam does not support sparse gradients')
-
-                    state = self.state[param]
-
-                    # Step count
-                    if 'step' not in state:
-                        state['step'] = 0
-                        state['exp_avg'] = torch.zeros_like(param.data)  # m
-                        state['exp_avg_sq'] = torch.zeros_like(param.data)  # v
-
-                    state['step'] += 1
-                    step = state['step']
-                    m, v = state['exp_avg'], state['exp_avg_sq']
-
-                    beta1, beta2 = group['betas']
-                    eps = group['eps']
-                    lr = group['lr']
-                    weight_decay = group['weight_decay']
-
-                    # Update first moment estimate
-                    m.mul_(beta1).add_(1 - beta1, grad)
-
-                    # Update second moment estimate
-                    v.mul_(beta2).addcmul(1 - beta2, grad, grad)
+    from cs336_basics.optimizer import AdamW
 
-                    # Compute bias correction
-                    bias_correction1 = 1 - beta1 ** step
-                    bias_correction2 = 1 - beta2 ** step
-
-                    step_size = lr * math.sqrt(bias_correction2) / bias_correction1
-
-                    # Parameter update
-                    denom = v.sqrt().add_(eps)
-                    param.data.addcdiv_(m, denom, value=-step_size)
-
-                    # Apply weight decay
-                    if weight_decay != 0:
-                        param.data.add_(param.data, alpha=-lr * weight_decay)
-
-            return loss
-
-    raise NotImplementedError
+    return AdamW
 
 
 def run_get_lr_cosine_schedule(
@@ -1241,19 +551,9 @@ def run_get_lr_cosine_schedule(
     Returns:
         Learning rate at the given iteration under the specified schedule.
     """
-    import torch
-    from torch import nn
-    import math
-
-    def cosine_learning_rate_schedule(t, alpha_max, alpha_min, T_w, T_c):
-        if t < T_w:
-            alpha_t = t / T_w * alpha_max
-        elif T_w <= t <= T_c:
-            alpha_t = alpha_min + 1 / 2 * (1 + math.cos((t - T_w) / (T_c - T_w)) * math.pi) * (alpha_max - alpha_min)
-        else:
-            alpha_t = alpha_min
-        return alpha_t
-    raise NotImplementedError
+    from cs336_basics.optimizer import get_lr_cosine_schedule
+
+    return get_lr_cosine_schedule(it, max_learning_rate, min_learning_rate, warmup_iters, cosine_cycle_iters)
 
 
 def run_save_checkpoint(
@@ -1261,6 +561,7 @@ def run_save_checkpoint(
     optimizer: torch.optim.Optimizer,
     iteration: int,
     out: str | os.PathLike | BinaryIO | IO[bytes],
+    **kwargs,
 ):
     """
     Given a model, optimizer, and an iteration number, serialize them to disk.
@@ -1271,27 +572,18 @@ def run_save_checkpoint(
         iteration (int): Serialize this value, which represents the number of training iterations
             we've completed.
         out (str | os.PathLike | BinaryIO | IO[bytes]): Path or file-like object to serialize the model, optimizer, and iteration to.
+        **kwargs: Forwarded to `save_checkpoint`, e.g. `format="sharded", shard_size_mb=...`.
     """
-    import torch
-    from torch import nn
-    import os
-    import typing
-
-    def save_checkpoint(model: torch.nn.Module, optimizer: torch.optim.Optimizer, iteration: int,
-                        out: str | os.PathLike | typing.BinaryIO | typing.IO[bytes]):
-        checkpoint = {
-            'model_state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'iteration': iteration,
-        }
-        return torch.save(checkpoint, out)
-    raise NotImplementedError
+    from cs336_basics.serialization import save_checkpoint
+
+    save_checkpoint(model, optimizer, iteration, out, **kwargs)
 
 
 def run_load_checkpoint(
     src: str | os.PathLike | BinaryIO | IO[bytes],
     model: torch.nn.Module,
     optimizer: torch.optim.Optimizer,
+    **kwargs,
 ):
     """
     Given a serialized checkpoint (path or file-like object), restore the
@@ -1303,23 +595,13 @@ def run_load_checkpoint(
         src (str | os.PathLike | BinaryIO | IO[bytes]): Path or file-like object to serialized checkpoint.
         model (torch.nn.Module): Restore the state of this model.
         optimizer (torch.optim.Optimizer): Restore the state of this optimizer.
+        **kwargs: Forwarded to `load_checkpoint`.
     Returns:
         int: the previously-serialized number of iterations.
     """
-    import torch
-    from torch import nn
-    import os
-    import typing
-
-    def load_checkpoint(src: str | os.PathLike | typing.BinaryIO | typing.IO[bytes], model: torch.nn.Module,
-                        optimizer: torch.optim.Optimizer):
-        checkpoint = torch.load(src)
-        model.load_state_dict(checkpoint['model_state_dict'])
-        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-        iteration = checkpoint['iteration']
-        return model, optimizer, iteration
+    from cs336_basics.serialization import load_checkpoint
 
-    raise NotImplementedError
+    return load_checkpoint(src, model, optimizer, **kwargs)
 
 
 def get_tokenizer(
@@ -3,6 +3,8 @@ from __future__ import annotations
 import pathlib
 from functools import lru_cache
 
+import torch
+
 FIXTURES_PATH = (pathlib.Path(__file__).resolve().parent) / "fixtures"
 
 
@@ -52,3 +54,37 @@ def gpt2_bytes_to_unicode() -> dict[int, str]:
     characters = [chr(n) for n in cs]
     d = dict(zip(bs, characters))
     return d
+
+
+def are_optimizers_equal(optimizer1_state_dict, optimizer2_state_dict, atol=1e-8, rtol=1e-5):
+    # Check if the keys of the main dictionaries are equal (e.g., 'state', 'param_groups')
+    if set(optimizer1_state_dict.keys()) != set(optimizer2_state_dict.keys()):
+        return False
+
+    # Check parameter groups are identical
+    if optimizer1_state_dict["param_groups"] != optimizer2_state_dict["param_groups"]:
+        return False
+
+    # Check states
+    state1 = optimizer1_state_dict["state"]
+    state2 = optimizer2_state_dict["state"]
+    if set(state1.keys()) != set(state2.keys()):
+        return False
+
+    for key in state1:
+        # Assuming state contents are also dictionaries
+        if set(state1[key].keys()) != set(state2[key].keys()):
+            return False
+
+        for sub_key in state1[key]:
+            item1 = state1[key][sub_key]
+            item2 = state2[key][sub_key]
+
+            # If both items are tensors, use torch.allclose
+            if torch.is_tensor(item1) and torch.is_tensor(item2):
+                if not torch.allclose(item1, item2, atol=atol, rtol=rtol):
+                    return False
+            # For non-tensor items, check for direct equality
+            elif item1 != item2:
+                return False
+    return True
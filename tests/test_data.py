@@ -3,6 +3,9 @@ from collections import Counter
 
 import numpy as np
 import pytest
+import torch
+
+from cs336_basics.data import build_eot_index, cu_seqlens, get_packed_batch
 
 from .adapters import run_get_batch
 
@@ -70,3 +73,25 @@ def test_get_batch():
             device="cuda:99",
         )
         assert "CUDA error" in str(excinfo.value) or "Torch not compiled with CUDA enabled" in str(excinfo.value)
+
+
+def test_get_packed_batch():
+    eot = 0
+    rng = np.random.default_rng(0)
+    dataset = rng.integers(1, 50, size=1000)
+    dataset[rng.choice(1000, size=60, replace=False)] = eot
+
+    eot_index = build_eot_index(dataset, eot, chunk_size=64)
+    np.testing.assert_array_equal(eot_index, np.flatnonzero(dataset == eot))
+
+    x, y, document_ids = get_packed_batch(dataset, batch_size=16, context_length=24, device="cpu", eot_index=eot_index)
+    assert x.shape == y.shape == document_ids.shape == (16, 24)
+    assert (document_ids[:, 0] == 0).all()
+    # A new document starts right after each end-of-text token
+    expected_starts = x[:, :-1] == eot
+    assert torch.equal(document_ids[:, 1:] - document_ids[:, :-1], expected_starts.long())
+
+
+def test_cu_seqlens():
+    document_ids = torch.tensor([[0, 0, 1, 1, 1, 2], [0, 1, 1, 1, 1, 1]])
+    assert cu_seqlens(document_ids).tolist() == [0, 2, 5, 6, 7, 12]
@@ -0,0 +1,93 @@
+from contextlib import nullcontext
+
+import torch
+import torch.distributed as dist
+
+from cs336_basics.distributed import GradientAllReducer, ShardedOptimizer, spawn
+from cs336_basics.model import TransformerLM
+from cs336_basics.optimizer import AdamW
+
+from .common import are_optimizers_equal
+
+
+def _make_model():
+    return TransformerLM(vocab_size=32, context_length=8, d_model=16, num_layers=2, num_heads=2, d_ff=32)
+
+
+def _batches(rank: int):
+    # Two micro-batches per rank, different on each rank
+    generator = torch.Generator().manual_seed(100 + rank)
+    return [torch.randint(0, 32, (2, 9), generator=generator) for _ in range(2)]
+
+
+def _all_reduce_worker(world_size: int):
+    rank = dist.get_rank()
+    # Different initializations on purpose: the reducer broadcasts rank 0's parameters
+    torch.manual_seed(rank)
+    model = _make_model()
+    reducer = GradientAllReducer(model, bucket_size_mb=0.005)
+    assert len(reducer.buckets) > 1
+
+    for i, batch in enumerate(_batches(rank)):
+        with reducer.no_sync() if i == 0 else nullcontext():
+            model.loss(batch[:, :-1], batch[:, 1:]).backward()
+    reducer.synchronize()
+
+    # Reference: the same model on one process, averaging the gradients of every rank's batches
+    torch.manual_seed(0)
+    reference = _make_model()
+    for r in range(world_size):
+        for batch in _batches(r):
+            (reference.loss(batch[:, :-1], batch[:, 1:]) / world_size).backward()
+
+    for (name, p), expected in zip(model.named_parameters(), reference.parameters()):
+        torch.testing.assert_close(p.grad, expected.grad, atol=1e-6, rtol=1e-5, msg=name)
+
+
+def test_gradient_all_reducer():
+    spawn(_all_reduce_worker, 2, 2)
+
+
+def _sharded_optimizer_worker(world_size: int):
+    rank = dist.get_rank()
+    torch.manual_seed(0)
+    model = _make_model()
+    torch.manual_seed(0)
+    reference = _make_model()
+    optimizer = ShardedOptimizer(model.parameters(), AdamW, lr=1e-2, weight_decay=0.1)
+    reference_optimizer = AdamW(reference.parameters(), lr=1e-2, weight_decay=0.1)
+
+    num_params = sum(p.numel() for p in model.parameters())
+    assert optimizer._shards[0]["shard"].numel() == -(-num_params // world_size)
+
+    def train_step(model, optimizer, batch):
+        model.loss(batch[:, :-1], batch[:, 1:]).backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    # Every rank sees the same batches, so no gradient all-reduce is needed
+    batches = _batches(0)
+    for batch in batches:
+        train_step(model, optimizer, batch)
+        train_step(reference, reference_optimizer, batch)
+    for p, expected in zip(model.parameters(), reference.parameters()):
+        torch.testing.assert_close(p, expected)
+
+    # The consolidated state dict has the layout of the unsharded optimizer
+    optimizer.consolidate_state_dict(to=0)
+    if rank == 0:
+        assert are_optimizers_equal(optimizer.state_dict(), reference_optimizer.state_dict(), atol=1e-6)
+
+    # Loading a full state dict keeps each rank's slice
+    restored = ShardedOptimizer(model.parameters(), AdamW, lr=1e-2, weight_decay=0.1)
+    restored.load_state_dict(reference_optimizer.state_dict())
+    train_step(model, restored, batches[0])
+    train_step(reference, reference_optimizer, batches[0])
+    for p, expected in zip(model.parameters(), reference.parameters()):
+        torch.testing.assert_close(p, expected)
+
+
+def test_sharded_optimizer():
+    spawn(_sharded_optimizer_worker, 2, 2)
+    # A world size that does not divide the parameter count, so the last slice is padded
+    spawn(_sharded_optimizer_worker, 3, 3)
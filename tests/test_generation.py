@@ -0,0 +1,207 @@
+import numpy
+import pytest
+import torch
+
+from cs336_basics.generation import generate, sample_next_token, sampling_probs, speculative_generate, stream_text
+from cs336_basics.model import TransformerLM
+
+
+def _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+    return model
+
+
+@torch.no_grad()
+def test_kv_cache_matches_full_forward(
+    ts_state_dict, in_indices, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta
+):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    expected = model(in_indices)
+
+    # Prefill half of the sequence, then decode the rest one token at a time
+    prefill_len = in_indices.shape[-1] // 2
+    kv_cache = model.init_kv_cache(in_indices.shape[0], in_indices.shape[-1])
+    logits = [model(in_indices[:, :prefill_len], kv_cache=kv_cache)]
+    for i in range(prefill_len, in_indices.shape[-1]):
+        logits.append(model(in_indices[:, i : i + 1], kv_cache=kv_cache))
+    numpy.testing.assert_allclose(torch.cat(logits, dim=1).numpy(), expected.numpy(), atol=1e-5)
+
+
+@torch.no_grad()
+def test_int8_kv_cache(ts_state_dict, in_indices, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    expected = model(in_indices)
+
+    kv_cache = model.init_kv_cache(in_indices.shape[0], in_indices.shape[-1], quantize=True)
+    assert kv_cache.keys.data.dtype == torch.int8 and kv_cache.keys.scales.shape[-1] == 1
+    logits = torch.cat([model(in_indices[:, i : i + 1], kv_cache=kv_cache) for i in range(in_indices.shape[-1])], 1)
+
+    # Negligible change in the logits and in the loss (log perplexity)
+    assert torch.linalg.vector_norm(logits - expected) / torch.linalg.vector_norm(expected) < 0.02
+    targets = in_indices[:, 1:]
+    loss = torch.nn.functional.cross_entropy(logits[:, :-1].flatten(0, 1), targets.flatten())
+    expected_loss = torch.nn.functional.cross_entropy(expected[:, :-1].flatten(0, 1), targets.flatten())
+    assert abs(loss - expected_loss) < 0.01 * expected_loss
+
+
+@torch.no_grad()
+def test_kv_cache_grouped_query_attention(in_indices, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    torch.manual_seed(0)
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta, num_kv_heads=2)
+    expected = model(in_indices)
+
+    kv_cache = model.init_kv_cache(in_indices.shape[0], in_indices.shape[-1])
+    assert kv_cache.keys.shape[2] == 2
+    logits = [model(in_indices[:, i : i + 1], kv_cache=kv_cache) for i in range(in_indices.shape[-1])]
+    numpy.testing.assert_allclose(torch.cat(logits, dim=1).numpy(), expected.numpy(), atol=1e-5)
+
+
+@torch.no_grad()
+def test_ring_kv_cache_sliding_window(in_indices, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    torch.manual_seed(0)
+    window_size = 3
+    model = TransformerLM(
+        vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta, window_size=window_size
+    )
+    expected = model(in_indices)
+
+    # Prefill a chunk longer than the window, then decode one token at a time
+    kv_cache = model.init_kv_cache(in_indices.shape[0], in_indices.shape[-1])
+    assert kv_cache.keys.shape[-2] == window_size
+    prefill_len = 5
+    logits = [model(in_indices[:, :prefill_len], kv_cache=kv_cache)]
+    for i in range(prefill_len, in_indices.shape[-1]):
+        logits.append(model(in_indices[:, i : i + 1], kv_cache=kv_cache))
+    numpy.testing.assert_allclose(torch.cat(logits, dim=1).numpy(), expected.numpy(), atol=1e-5)
+
+    # Left-padded batches give the same completions as single prompts
+    prompts = [[11, 12, 13, 14, 15, 16], [21, 22]]
+    batched = generate(model, prompts, max_new_tokens=6, temperature=0)
+    for prompt, completion in zip(prompts, batched):
+        assert generate(model, [prompt], max_new_tokens=6, temperature=0) == [completion]
+
+
+@torch.no_grad()
+def test_int8_ring_kv_cache(in_indices, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    torch.manual_seed(0)
+    window_size = 3
+    model = TransformerLM(
+        vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta, window_size=window_size
+    )
+    expected = model(in_indices)
+
+    kv_cache = model.init_kv_cache(in_indices.shape[0], in_indices.shape[-1], quantize=True)
+    assert kv_cache.keys.shape[-2] == window_size and kv_cache.keys.data.dtype == torch.int8
+    prefill_len = 5
+    logits = [model(in_indices[:, :prefill_len], kv_cache=kv_cache)]
+    for i in range(prefill_len, in_indices.shape[-1]):
+        logits.append(model(in_indices[:, i : i + 1], kv_cache=kv_cache))
+    logits = torch.cat(logits, dim=1)
+    assert torch.linalg.vector_norm(logits - expected) / torch.linalg.vector_norm(expected) < 0.02
+
+
+def test_generate_left_padded_batch(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    prompts = [[11, 12, 13, 14, 15, 16], [21, 22], [31, 32, 33, 34]]
+
+    batched = generate(model, prompts, max_new_tokens=8, temperature=0)
+    for prompt, completion in zip(prompts, batched):
+        assert len(completion) == 8
+        assert generate(model, [prompt], max_new_tokens=8, temperature=0) == [completion]
+
+    # Sequences stop at the end-of-text token; the others keep going
+    eos_token_id = batched[1][2]
+    stopped = generate(model, prompts, max_new_tokens=8, temperature=0, eos_token_id=eos_token_id)
+    for completion, full in zip(stopped, batched):
+        assert completion == (full[: full.index(eos_token_id)] if eos_token_id in full else full)
+
+
+def test_sample_next_token():
+    torch.manual_seed(0)
+    logits = torch.randn(4, 50)
+    greedy = logits.argmax(dim=-1)
+    assert torch.equal(sample_next_token(logits, temperature=0), greedy)
+    assert torch.equal(sample_next_token(logits, top_k=1), greedy)
+    assert torch.equal(sample_next_token(logits, top_p=1e-6), greedy)
+
+    samples = torch.stack([sample_next_token(logits, top_k=3) for _ in range(100)])
+    top3 = torch.topk(logits, 3, dim=-1).indices
+    assert (samples[..., None] == top3).any(dim=-1).all()
+
+
+class _CharTokenizer:
+    """One token per character, with <|endoftext|> as id 0."""
+
+    def encode(self, text):
+        if text == "<|endoftext|>":
+            return [0]
+        return [ord(c) for c in text]
+
+    def decode(self, ids):
+        return "".join(chr(i) for i in ids)
+
+
+def test_stream_text(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+    pieces = list(stream_text(model, tokenizer, "Once", max_new_tokens=6, temperature=0))
+
+    expected = generate(model, [tokenizer.encode("Once")], max_new_tokens=6, temperature=0, eos_token_id=0)[0]
+    assert "".join(pieces) == tokenizer.decode(expected)
+
+
+def test_speculative_generate_greedy(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    torch.manual_seed(0)
+    draft_model = TransformerLM(vocab_size, n_keys, d_model, 1, n_heads, d_ff, rope_theta=theta)
+    prompt = [11, 12, 13, 14]
+
+    expected = generate(model, [prompt], max_new_tokens=9, temperature=0)[0]
+    for draft in (draft_model, model):
+        for num_speculative in (1, 3):
+            actual = speculative_generate(
+                model, draft, prompt, max_new_tokens=9, num_speculative=num_speculative, temperature=0
+            )
+            assert actual == expected
+
+    # Up to the full context, however many tokens are drafted
+    expected = generate(model, [prompt], max_new_tokens=n_keys - len(prompt) + 1, temperature=0)[0]
+    actual = speculative_generate(
+        model, draft_model, prompt, max_new_tokens=n_keys - len(prompt) + 1, num_speculative=3, temperature=0
+    )
+    assert actual == expected
+
+
+def test_speculative_generate_rejects_sliding_window():
+    torch.manual_seed(0)
+    model = TransformerLM(vocab_size=5, context_length=8, d_model=16, num_layers=1, num_heads=2, d_ff=32)
+    windowed = TransformerLM(
+        vocab_size=5, context_length=8, d_model=16, num_layers=1, num_heads=2, d_ff=32, window_size=4
+    )
+    for target, draft in ((windowed, model), (model, windowed)):
+        with pytest.raises(ValueError, match="sliding-window"):
+            speculative_generate(target, draft, [1, 2], max_new_tokens=4, temperature=0)
+
+
+def test_speculative_generate_distribution():
+    # With a tiny vocabulary, the empirical distribution of sampled tokens must match the target's
+    torch.manual_seed(0)
+    model = TransformerLM(vocab_size=5, context_length=8, d_model=16, num_layers=1, num_heads=2, d_ff=32)
+    draft_model = TransformerLM(vocab_size=5, context_length=8, d_model=16, num_layers=1, num_heads=2, d_ff=32)
+    prompt = [1, 2]
+    generator = torch.Generator().manual_seed(0)
+
+    num_samples = 2000
+    counts = torch.zeros(5, 5)
+    for _ in range(num_samples):
+        first, second = speculative_generate(
+            model, draft_model, prompt, max_new_tokens=2, num_speculative=2, generator=generator
+        )
+        counts[first, second] += 1
+
+    with torch.no_grad():
+        first_probs = sampling_probs(model(torch.tensor([prompt]))[0, -1])
+        second_probs = sampling_probs(model(torch.tensor([prompt + [t] for t in range(5)]))[:, -1])
+    expected = first_probs[:, None] * second_probs
+    numpy.testing.assert_allclose((counts / num_samples).numpy(), expected.numpy(), atol=0.04)
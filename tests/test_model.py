@@ -1,5 +1,6 @@
 from einops import rearrange
 import numpy
+import pytest
 import torch
 import torch.nn.functional as F
 
@@ -16,6 +17,7 @@ from .adapters import (
     run_linear, 
     run_embedding,
 )
+from cs336_basics.model import MultiHeadSelfAttention, TransformerLM, scaled_dot_product_attention
 
 
 def test_linear(numpy_snapshot, ts_state_dict, in_embeddings, d_model, d_ff):
@@ -239,3 +241,145 @@ def test_silu_matches_pytorch():
     expected_output = F.silu(x)
     actual_output = run_silu(x)
     numpy.testing.assert_allclose(actual_output.detach().numpy(), expected_output.detach().numpy(), atol=1e-6)
+
+
+def test_transformer_lm_bf16_autocast(
+    vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta, ts_state_dict, in_indices
+):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+    expected_logits = model(in_indices).detach()
+    expected_loss = model.loss(in_indices[:, :-1], in_indices[:, 1:])
+
+    model.autocast_dtype = torch.bfloat16
+    logits = model(in_indices).detach()
+    # The final norm and the LM head run in fp32, so the logits are fp32 too
+    assert logits.dtype == torch.float32
+    # bf16 keeps 8 significant bits, so every matmul input of the blocks is rounded by up to 2^-9
+    # relative; compared with the fp32 run of the same model, the logits as a whole must stay
+    # within a few of those roundings compounded over the layers
+    relative_error = torch.linalg.vector_norm(logits - expected_logits) / torch.linalg.vector_norm(expected_logits)
+    assert relative_error < 0.03
+    assert (logits.argmax(dim=-1) == expected_logits.argmax(dim=-1)).float().mean() > 0.9
+
+    loss = model.loss(in_indices[:, :-1], in_indices[:, 1:])
+    assert loss.dtype == torch.float32
+    numpy.testing.assert_allclose(loss.item(), expected_loss.item(), rtol=1e-2)
+
+    # Master weights and their gradients stay in fp32
+    loss.backward()
+    for p in model.parameters():
+        assert p.dtype == torch.float32
+        assert p.grad is not None and p.grad.dtype == torch.float32
+
+
+def test_transformer_lm_recompute(
+    vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta, ts_state_dict, in_indices
+):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+
+    def loss_and_grads():
+        model.zero_grad()
+        loss = model.loss(in_indices[:, :-1], in_indices[:, 1:])
+        loss.backward()
+        return loss.item(), {name: p.grad.clone() for name, p in model.named_parameters()}
+
+    expected_loss, expected_grads = loss_and_grads()
+    for policy, every in [("block", 1), ("attn", 1), ("block", 2)]:
+        model.set_recompute(policy, every)
+        loss, grads = loss_and_grads()
+        assert loss == pytest.approx(expected_loss)
+        for name, grad in grads.items():
+            numpy.testing.assert_allclose(grad.numpy(), expected_grads[name].numpy(), atol=1e-6, err_msg=name)
+
+
+def test_transformer_lm_compile_blocks(
+    vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta, ts_state_dict, in_indices
+):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+    expected_full = model(in_indices)
+    expected_truncated = model(in_indices[..., : in_indices.shape[-1] // 2])
+
+    model.compile_blocks(backend="aot_eager")
+    model.warmup(batch_size=2, seq_lens=[n_keys, n_keys // 2])
+    assert all(p.grad is None for p in model.parameters())
+    # Gradients accumulated before a warmup are kept
+    model.lm_head.weight.grad = torch.ones_like(model.lm_head.weight)
+    model.warmup(batch_size=2, seq_lens=[n_keys // 2])
+    assert (model.lm_head.weight.grad == 1).all()
+    assert all(p.grad is None for name, p in model.named_parameters() if name != "lm_head.weight")
+    # Compiling does not wrap the parameters, so checkpoints keep their keys
+    assert model.state_dict().keys() == ts_state_dict[0].keys()
+
+    numpy.testing.assert_allclose(model(in_indices).detach().numpy(), expected_full.detach().numpy(), atol=1e-5)
+    numpy.testing.assert_allclose(
+        model(in_indices[..., : in_indices.shape[-1] // 2]).detach().numpy(),
+        expected_truncated.detach().numpy(),
+        atol=1e-5,
+    )
+
+
+def test_grouped_query_attention_matches_repeated_kv_heads(in_embeddings, d_model, n_heads):
+    torch.manual_seed(0)
+    for num_kv_heads in (2, 1):
+        gqa = MultiHeadSelfAttention(d_model, n_heads, num_kv_heads=num_kv_heads)
+        assert gqa.k_proj.weight.shape == (num_kv_heads * d_model // n_heads, d_model)
+
+        # Standard MHA whose key/value heads are copies of the shared GQA heads
+        mha = MultiHeadSelfAttention(d_model, n_heads)
+        state_dict = gqa.state_dict()
+        for name in ("k_proj.weight", "v_proj.weight"):
+            heads = state_dict[name].unflatten(0, (num_kv_heads, -1))
+            state_dict[name] = heads.repeat_interleave(n_heads // num_kv_heads, dim=0).flatten(0, 1)
+        mha.load_state_dict(state_dict)
+
+        numpy.testing.assert_allclose(
+            gqa(in_embeddings).detach().numpy(), mha(in_embeddings).detach().numpy(), atol=1e-6
+        )
+
+
+def test_sliding_window_attention(d_model, n_heads):
+    torch.manual_seed(0)
+    x = torch.randn(2, 23, d_model)
+    positions = torch.arange(x.shape[-2])
+
+    def heads(t):
+        return t.unflatten(-1, (-1, d_model // n_heads)).transpose(1, 2)
+
+    for window_size, num_kv_heads in [(1, None), (4, None), (5, 2), (23, None)]:
+        attn = MultiHeadSelfAttention(d_model, n_heads, num_kv_heads=num_kv_heads, window_size=window_size)
+
+        # Reference: full attention with an explicit band mask
+        band = (positions[None, :] <= positions[:, None]) & (positions[None, :] > positions[:, None] - window_size)
+        group_size = n_heads // attn.num_kv_heads
+        q = heads(attn.q_proj(x))
+        k = heads(attn.k_proj(x)).repeat_interleave(group_size, dim=1)
+        v = heads(attn.v_proj(x)).repeat_interleave(group_size, dim=1)
+        expected = attn.output_proj(scaled_dot_product_attention(q, k, v, band).transpose(1, 2).flatten(-2))
+
+        numpy.testing.assert_allclose(attn(x).detach().numpy(), expected.detach().numpy(), atol=1e-6)
+
+
+def test_transformer_lm_packed_documents(
+    vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta, ts_state_dict, in_indices
+):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+
+    # Two rows packing documents of different lengths
+    lengths = [[3, 5, in_indices.shape[-1] - 8], [in_indices.shape[-1] - 2, 2]]
+    document_ids = torch.stack([torch.repeat_interleave(torch.arange(len(row)), torch.tensor(row)) for row in lengths])
+    packed = model(in_indices[:2], document_ids=document_ids)
+
+    # Each document on its own gives the same logits: no attention across documents, and
+    # RoPE only sees relative positions
+    for row, row_lengths in enumerate(lengths):
+        start = 0
+        for length in row_lengths:
+            alone = model(in_indices[row : row + 1, start : start + length])
+            numpy.testing.assert_allclose(
+                packed[row : row + 1, start : start + length].detach().numpy(), alone.detach().numpy(), atol=1e-4
+            )
+            start += length
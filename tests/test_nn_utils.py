@@ -2,6 +2,8 @@ import numpy
 import torch
 import torch.nn.functional as F
 
+from cs336_basics.nn_utils import chunked_cross_entropy, clip_gradients
+
 from .adapters import run_cross_entropy, run_gradient_clipping, run_softmax
 
 
@@ -86,3 +88,35 @@ def test_gradient_clipping():
             t1_c_grad.detach().numpy(),
             atol=1e-6,
         )
+
+
+def test_gradient_clipping_returns_total_norm():
+    tensors = [torch.nn.Parameter(torch.randn((5, 5))) for _ in range(3)]
+    for t in tensors:
+        t.grad = torch.randn_like(t)
+    expected_norm = torch.linalg.vector_norm(torch.cat([t.grad.flatten() for t in tensors]))
+
+    total_norm = clip_gradients(tensors, max_l2_norm=1e-2)
+    numpy.testing.assert_allclose(total_norm.item(), expected_norm.item(), rtol=1e-6)
+    clipped_norm = torch.linalg.vector_norm(torch.cat([t.grad.flatten() for t in tensors]))
+    numpy.testing.assert_allclose(clipped_norm.item(), 1e-2, rtol=1e-4)
+
+    assert clip_gradients([torch.nn.Parameter(torch.zeros(2))], max_l2_norm=1.0) is None
+
+
+def test_chunked_cross_entropy_matches_full_logits():
+    torch.manual_seed(0)
+    hidden = torch.randn(2, 7, 16, requires_grad=True)
+    weight = torch.randn(50, 16, requires_grad=True)
+    targets = torch.randint(0, 50, (2, 7))
+
+    expected = F.cross_entropy((hidden @ weight.T).view(-1, 50), targets.view(-1))
+    expected_grads = torch.autograd.grad(expected, (hidden, weight))
+
+    # A chunk size that does not divide the 14 positions exercises the ragged last chunk
+    actual = chunked_cross_entropy(hidden, weight, targets, chunk_size=4)
+    actual_grads = torch.autograd.grad(actual, (hidden, weight))
+
+    numpy.testing.assert_allclose(actual.detach().numpy(), expected.detach().numpy(), atol=1e-5)
+    for actual_grad, expected_grad in zip(actual_grads, expected_grads):
+        numpy.testing.assert_allclose(actual_grad.numpy(), expected_grad.numpy(), atol=1e-5)
@@ -1,7 +1,10 @@
 import numpy
 import torch
 
+from cs336_basics.optimizer import CosineLRScheduler, FlatAdamW, lr_cosine_schedule
+
 from .adapters import get_adamw_cls, run_get_lr_cosine_schedule
+from .common import are_optimizers_equal
 
 
 def _optimize(opt_class) -> torch.Tensor:
@@ -50,6 +53,66 @@ def test_adamw(numpy_snapshot):
     )
 
 
+def test_flat_adamw_matches_pytorch():
+    pytorch_weights = _optimize(torch.optim.AdamW)
+    flat_weights = _optimize(FlatAdamW)
+    numpy.testing.assert_allclose(flat_weights.numpy(), pytorch_weights.numpy(), atol=1e-6)
+
+
+def test_flat_adamw_bf16_states():
+    pytorch_weights = _optimize(torch.optim.AdamW)
+    flat_weights = _optimize(lambda params, **kwargs: FlatAdamW(params, bf16_states=True, **kwargs))
+    numpy.testing.assert_allclose(flat_weights.numpy(), pytorch_weights.numpy(), atol=1e-2)
+
+
+def test_flat_adamw_state_dict_layout():
+    torch.manual_seed(42)
+    model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    reference_model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    reference_model.load_state_dict(model.state_dict())
+    opt = FlatAdamW(model.parameters(), lr=1e-3, weight_decay=0.01)
+    reference_opt = get_adamw_cls()(reference_model.parameters(), lr=1e-3, weight_decay=0.01)
+    for _ in range(10):
+        x = torch.rand(3)
+        for m, o in ((model, opt), (reference_model, reference_opt)):
+            o.zero_grad()
+            m(x).sum().backward()
+            o.step()
+    assert are_optimizers_equal(opt.state_dict(), reference_opt.state_dict(), atol=1e-6)
+
+    # A per-parameter checkpoint can be loaded back into the flat layout
+    new_opt = FlatAdamW(model.parameters(), lr=1e-3, weight_decay=0.01)
+    new_opt.load_state_dict(reference_opt.state_dict())
+    new_opt.zero_grad()
+    new_opt.step()
+    assert are_optimizers_equal(new_opt.state_dict(), reference_opt.state_dict())
+
+
+def test_flat_adamw_chunks_and_skipped_params():
+    torch.manual_seed(42)
+    model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    reference_model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    reference_model.load_state_dict(model.state_dict())
+    # Chunks smaller than a parameter, so parameters are split across chunks
+    opt = FlatAdamW(model.parameters(), lr=1e-3, weight_decay=0.01, chunk_size=5)
+    reference_opt = get_adamw_cls()(reference_model.parameters(), lr=1e-3, weight_decay=0.01)
+    for it in range(10):
+        x = torch.rand(3)
+        for m, o in ((model, opt), (reference_model, reference_opt)):
+            o.zero_grad()
+            m(x).sum().backward()
+            if it % 3 == 1:
+                # No gradient for the first layer's bias: its state and value must not change
+                m[0].bias.grad = None
+            o.step()
+    numpy.testing.assert_allclose(
+        torch.nn.utils.parameters_to_vector(model.parameters()).detach().numpy(),
+        torch.nn.utils.parameters_to_vector(reference_model.parameters()).detach().numpy(),
+        atol=1e-6,
+    )
+    assert are_optimizers_equal(opt.state_dict(), reference_opt.state_dict(), atol=1e-6)
+
+
 def test_get_lr_cosine_schedule():
     max_learning_rate = 1
     min_learning_rate = 1 * 0.1
@@ -94,3 +157,42 @@ def test_get_lr_cosine_schedule():
         for it in range(25)
     ]
     numpy.testing.assert_allclose(numpy.array(actual_lrs), numpy.array(expected_lrs))
+
+
+def test_cosine_lr_scheduler():
+    kwargs = {"max_learning_rate": 1, "min_learning_rate": 0.1, "warmup_iters": 7, "cosine_cycle_iters": 21}
+    expected_lrs = [run_get_lr_cosine_schedule(it=it, **kwargs) for it in range(25)]
+
+    numpy.testing.assert_allclose(lr_cosine_schedule(numpy.arange(25), **kwargs), expected_lrs)
+
+    model = torch.nn.Linear(3, 2)
+    opt = torch.optim.SGD([{"params": model.weight}, {"params": model.bias}], lr=0.0)
+    scheduler = CosineLRScheduler(opt, **kwargs)
+    actual_lrs = [opt.param_groups[0]["lr"]]
+    for _ in range(24):
+        scheduler.step()
+        assert opt.param_groups[0]["lr"] == opt.param_groups[1]["lr"]
+        actual_lrs.append(opt.param_groups[0]["lr"])
+    numpy.testing.assert_allclose(actual_lrs, expected_lrs)
+
+    restored = CosineLRScheduler(opt, **kwargs)
+    restored.load_state_dict(scheduler.state_dict())
+    assert restored.last_iter == scheduler.last_iter
+
+
+def test_flat_adamw_fused_clipping():
+    def clipped_adamw(params, **kwargs):
+        params = list(params)
+        opt = get_adamw_cls()(params, **kwargs)
+        step = opt.step
+
+        def clip_then_step():
+            torch.nn.utils.clip_grad_norm_(params, 0.1)
+            step()
+
+        opt.step = clip_then_step
+        return opt
+
+    expected_weights = _optimize(clipped_adamw)
+    flat_weights = _optimize(lambda params, **kwargs: FlatAdamW(params, max_grad_norm=0.1, **kwargs))
+    numpy.testing.assert_allclose(flat_weights.numpy(), expected_weights.numpy(), atol=1e-6)
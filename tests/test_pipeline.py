@@ -0,0 +1,52 @@
+import torch
+import torch.distributed as dist
+
+from cs336_basics.distributed import spawn
+from cs336_basics.model import TransformerLM
+from cs336_basics.pipeline import PipelineStage, balance_stages, layer_costs
+
+_MODEL_KWARGS = {"vocab_size": 32, "context_length": 8, "d_model": 16, "num_layers": 3, "num_heads": 2, "d_ff": 32}
+
+
+def _make_model():
+    return TransformerLM(**_MODEL_KWARGS)
+
+
+def test_balance_stages():
+    assert balance_stages([1, 1, 1, 1, 4], 2) == [0, 4, 5]
+    assert balance_stages([3, 1, 1, 1, 3], 3) == [0, 1, 4, 5]
+    assert balance_stages([1, 2, 3], 3) == [0, 1, 2, 3]
+
+    costs = layer_costs(_make_model())
+    assert len(costs) == 3 and costs[0] == costs[1] < costs[2]
+
+
+def _pipeline_worker():
+    torch.manual_seed(0)
+    reference = _make_model()
+    stage = PipelineStage(**_MODEL_KWARGS, boundaries=[0, 2, 3])
+    assert not stage.load_state_dict(reference.state_dict(), strict=False).missing_keys
+    # Each rank builds only its own part of the model
+    assert list(stage.layers) == (["0", "1"] if dist.get_rank() == 0 else ["2"])
+    assert (stage.token_embeddings is None) == (dist.get_rank() == 1)
+    assert (stage.lm_head is None) == (dist.get_rank() == 0)
+
+    # Default boundaries come from the layer costs of the model
+    assert PipelineStage(**_MODEL_KWARGS).boundaries == balance_stages(layer_costs(reference), 2)
+
+    batch = torch.randint(0, 32, (8, 9), generator=torch.Generator().manual_seed(0))
+    loss = stage.train_step(batch[:, :-1], batch[:, 1:], num_micro_batches=4)
+    expected_loss = reference.loss(batch[:, :-1], batch[:, 1:])
+    expected_loss.backward()
+
+    if stage.is_last:
+        torch.testing.assert_close(loss, expected_loss)
+    else:
+        assert loss is None
+    expected = dict(reference.named_parameters())
+    for name, p in stage.named_parameters():
+        torch.testing.assert_close(p.grad, expected[name].grad, atol=1e-6, rtol=1e-5, msg=name)
+
+
+def test_pipeline_1f1b():
+    spawn(_pipeline_worker, 2)
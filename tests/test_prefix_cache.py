@@ -0,0 +1,41 @@
+import torch
+
+from cs336_basics.prefix_cache import PrefixCache
+
+
+def _kv(tokens):
+    # (num_layers=2, num_heads=1, len(tokens), d_k=1) tensors that encode the token ids
+    t = torch.tensor(tokens, dtype=torch.float32).view(1, 1, -1, 1)
+    return t.expand(2, 1, -1, 1), -t.expand(2, 1, -1, 1)
+
+
+def test_prefix_cache_match_and_split():
+    cache = PrefixCache(max_bytes=1 << 20)
+    assert cache.match([1, 2, 3]) == (0, None, None)
+
+    cache.insert([1, 2, 3, 4], *_kv([1, 2, 3, 4]))
+    cache.insert([1, 2, 5], *_kv([1, 2, 5]))  # splits the [1, 2, 3, 4] edge after [1, 2]
+
+    for tokens, expected in [([1, 2, 3, 4, 9], [1, 2, 3, 4]), ([1, 2, 5], [1, 2, 5]), ([1, 2, 6], [1, 2]), ([7], [])]:
+        length, keys, values = cache.match(tokens)
+        assert length == len(expected)
+        if expected:
+            expected_keys, expected_values = _kv(expected)
+            assert torch.equal(keys, expected_keys) and torch.equal(values, expected_values)
+
+    # The shared prefix is stored once: 5 distinct token slots
+    assert cache.num_bytes == 5 * 2 * (2 * 4)
+
+
+def test_prefix_cache_lru_eviction():
+    bytes_per_token = 2 * (2 * 4)
+    cache = PrefixCache(max_bytes=6 * bytes_per_token)
+    cache.insert([1, 2, 3], *_kv([1, 2, 3]))
+    cache.insert([4, 5, 6], *_kv([4, 5, 6]))
+    cache.match([1, 2, 3])  # [4, 5, 6] is now least recently used
+
+    cache.insert([7, 8], *_kv([7, 8]))
+    assert cache.num_bytes <= cache.max_bytes
+    assert cache.match([4, 5, 6])[0] == 0
+    assert cache.match([1, 2, 3])[0] == 3
+    assert cache.match([7, 8])[0] == 2
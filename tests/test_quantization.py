@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+
+from cs336_basics.model import Linear, TransformerLM
+from cs336_basics.quantization import QuantizedLinear, compare_outputs, model_bytes, quantize_model
+
+from .common import FIXTURES_PATH
+
+
+def test_quantized_linear():
+    torch.manual_seed(0)
+    linear = Linear(64, 32)
+    x = torch.randn(4, 64)
+
+    int8 = QuantizedLinear.from_linear(linear)
+    assert int8.qweight.dtype == torch.int8 and int8.scales.shape == (32, 1)
+    # Rounding error is at most half a quantization step per weight
+    assert ((int8.dequantize() - linear.weight).abs() <= int8.scales / 2 + 1e-6).all()
+    torch.testing.assert_close(int8(x), x @ int8.dequantize().T, atol=1e-5, rtol=1e-5)
+
+    int4 = QuantizedLinear.from_linear(linear, bits=4, group_size=16)
+    assert int4.qweight.shape == (32, 32) and int4.scales.shape == (32, 4)
+    half_steps = int4.scales.repeat_interleave(16, dim=1) / 2
+    assert ((int4.dequantize() - linear.weight).abs() <= half_steps + 1e-6).all()
+    torch.testing.assert_close(int4(x), x @ int4.dequantize().T, atol=1e-5, rtol=1e-5)
+    # Hence each output is off by at most sum_i |x_i| * (half a step of weight i)
+    with torch.no_grad():
+        assert ((int4(x) - linear(x)).abs() <= x.abs() @ half_steps.T + 1e-5).all()
+    # Dequantizing a few output channels at a time, with a partial last block
+    int4.block_rows = 5
+    torch.testing.assert_close(int4(x), x @ int4.dequantize().T, atol=1e-5, rtol=1e-5)
+
+    # A floating-point Linear state dict is quantized on load
+    loaded = QuantizedLinear(64, 32, bits=4, group_size=16)
+    assert loaded.qweight.dtype == torch.uint8 and loaded.scales.shape == (32, 4)
+    loaded.load_state_dict(linear.state_dict())
+    torch.testing.assert_close(loaded.dequantize(), int4.dequantize())
+
+
+def test_quantized_transformer_lm(
+    vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta, ts_state_dict, in_indices
+):
+    state_dict, _ = ts_state_dict
+    expected = torch.from_numpy(np.load(FIXTURES_PATH.parent / "_snapshots" / "test_transformer_lm.npz")["array"])
+
+    def build(bits=None, group_size=None):
+        model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+        if bits is not None:
+            quantize_model(model, bits, group_size)
+        model.load_state_dict(state_dict)
+        return model
+
+    fp32 = build()
+    int8 = build(bits=8)
+    int4 = build(bits=4, group_size=32)
+    linear_bytes = sum(m.weight.numel() * 4 for m in fp32.modules() if isinstance(m, Linear))
+    assert model_bytes(fp32) - model_bytes(int8) > 0.7 * linear_bytes
+
+    # Accuracy delta against the fp32 outputs of test_transformer_lm
+    with torch.no_grad():
+        int8_report = compare_outputs(expected, int8(in_indices))
+        int4_report = compare_outputs(expected, int4(in_indices))
+    assert int8_report["relative_error"] < 0.05 and int8_report["top1_agreement"] > 0.9
+
+    # int4 errors are bounded relative to the error its quantization step puts on the weights
+    # rather than by a fixed threshold: the output error stays within a small multiple of it
+    def weight_error(model):
+        errors, norms = 0.0, 0.0
+        for name, module in model.named_modules():
+            if isinstance(module, QuantizedLinear):
+                weight = state_dict[f"{name}.weight"]
+                errors += (module.dequantize() - weight).square().sum().item()
+                norms += weight.square().sum().item()
+        return (errors / norms) ** 0.5
+
+    assert int8_report["relative_error"] < int4_report["relative_error"] < 3 * weight_error(int4)
@@ -1,9 +1,19 @@
 import numpy
+import pytest
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from cs336_basics.serialization import (
+    AsyncCheckpointer,
+    DeltaCheckpointer,
+    load_model_weights,
+    load_sharded_tensors,
+    save_checkpoint,
+)
+
 from .adapters import get_adamw_cls, run_load_checkpoint, run_save_checkpoint
+from .common import are_optimizers_equal
 
 
 class _TestNet(nn.Module):
@@ -20,40 +30,6 @@ class _TestNet(nn.Module):
         return x
 
 
-def are_optimizers_equal(optimizer1_state_dict, optimizer2_state_dict, atol=1e-8, rtol=1e-5):
-    # Check if the keys of the main dictionaries are equal (e.g., 'state', 'param_groups')
-    if set(optimizer1_state_dict.keys()) != set(optimizer2_state_dict.keys()):
-        return False
-
-    # Check parameter groups are identical
-    if optimizer1_state_dict["param_groups"] != optimizer2_state_dict["param_groups"]:
-        return False
-
-    # Check states
-    state1 = optimizer1_state_dict["state"]
-    state2 = optimizer2_state_dict["state"]
-    if set(state1.keys()) != set(state2.keys()):
-        return False
-
-    for key in state1:
-        # Assuming state contents are also dictionaries
-        if set(state1[key].keys()) != set(state2[key].keys()):
-            return False
-
-        for sub_key in state1[key]:
-            item1 = state1[key][sub_key]
-            item2 = state2[key][sub_key]
-
-            # If both items are tensors, use torch.allclose
-            if torch.is_tensor(item1) and torch.is_tensor(item2):
-                if not torch.allclose(item1, item2, atol=atol, rtol=rtol):
-                    return False
-            # For non-tensor items, check for direct equality
-            elif item1 != item2:
-                return False
-    return True
-
-
 def test_checkpointing(tmp_path):
     torch.manual_seed(42)
     d_input = 100
@@ -119,3 +95,194 @@ def test_checkpointing(tmp_path):
         )
     # compare the optimizer state dicts
     assert are_optimizers_equal(original_optimizer_state, new_optimizer_state)
+
+
+def test_async_checkpointer(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3)
+
+    with AsyncCheckpointer(tmp_path, keep_last_k=2) as checkpointer:
+        for it in range(1, 5):
+            optimizer.zero_grad()
+            model(torch.rand(100)).sum().backward()
+            optimizer.step()
+            checkpointer.save(model, optimizer, iteration=it)
+        expected_model_state = {k: v.clone() for k, v in model.state_dict().items()}
+        expected_optimizer_state = optimizer.state_dict()
+
+        # Training continues while the last checkpoint is written; the snapshot is unaffected
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(1.0)
+
+    assert [p.name for p in checkpointer.checkpoints()] == ["checkpoint_00000003.pt", "checkpoint_00000004.pt"]
+    assert not list(tmp_path.glob(".*.tmp"))
+
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3)
+    assert run_load_checkpoint(src=checkpointer.latest(), model=new_model, optimizer=new_optimizer) == 4
+    for key, value in new_model.state_dict().items():
+        numpy.testing.assert_allclose(value.numpy(), expected_model_state[key].numpy())
+    assert are_optimizers_equal(expected_optimizer_state, new_optimizer.state_dict())
+
+
+def test_tensor_store_checkpoint(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    for _ in range(3):
+        optimizer.zero_grad()
+        model(torch.rand(100)).sum().backward()
+        optimizer.step()
+
+    serialization_path = tmp_path / "checkpoint.tensors"
+    save_checkpoint(model, optimizer, iteration=3, out=serialization_path, format="tensors")
+
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    assert run_load_checkpoint(src=serialization_path, model=new_model, optimizer=new_optimizer) == 3
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_allclose(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+    assert are_optimizers_equal(optimizer.state_dict(), new_optimizer.state_dict())
+
+    # Weights loaded for evaluation are views into the mapped file, which stays untouched
+    eval_model = load_model_weights(serialization_path, _TestNet())
+    x = torch.rand(100)
+    numpy.testing.assert_allclose(eval_model(x).detach().numpy(), model(x).detach().numpy())
+    with torch.no_grad():
+        eval_model.fc1.weight.zero_()
+    reloaded = load_model_weights(serialization_path, _TestNet())
+    numpy.testing.assert_allclose(reloaded.fc1.weight.detach().numpy(), model.fc1.weight.detach().numpy())
+
+
+def test_resume_from_tensor_store_checkpoint(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    optimizer.zero_grad()
+    model(torch.rand(100)).sum().backward()
+    optimizer.step()
+
+    serialization_path = tmp_path / "checkpoint.tensors"
+    save_checkpoint(model, optimizer, iteration=1, out=serialization_path, format="tensors")
+
+    # The memory-mapped load must leave the optimizer updating the model's own parameters
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    run_load_checkpoint(src=serialization_path, model=new_model, optimizer=new_optimizer)
+    loaded_weight = new_model.fc1.weight.detach().clone()
+    x = torch.rand(100)
+    for m, o in ((model, optimizer), (new_model, new_optimizer)):
+        o.zero_grad()
+        m(x).sum().backward()
+        o.step()
+    assert not torch.equal(new_model.fc1.weight.detach(), loaded_weight)
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_allclose(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+
+
+def test_sharded_checkpoint(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    for _ in range(3):
+        optimizer.zero_grad()
+        model(torch.rand(100)).sum().backward()
+        optimizer.step()
+
+    # fc1.weight alone is 80KB, so a 0.05MB shard limit splits the checkpoint into several shards
+    checkpoint_dir = tmp_path / "checkpoint"
+    run_save_checkpoint(model, optimizer, iteration=3, out=checkpoint_dir, format="sharded", shard_size_mb=0.05)
+    assert len(list(checkpoint_dir.glob("shard_*.tensors"))) > 1
+
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    assert run_load_checkpoint(src=checkpoint_dir, model=new_model, optimizer=new_optimizer) == 3
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_allclose(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+    assert are_optimizers_equal(optimizer.state_dict(), new_optimizer.state_dict())
+
+    tensors, metadata = load_sharded_tensors(checkpoint_dir, keys=["model.fc3.weight"])
+    assert list(tensors) == ["model.fc3.weight"]
+    assert metadata["iteration"] == 3
+    numpy.testing.assert_allclose(tensors["model.fc3.weight"].numpy(), model.fc3.weight.detach().numpy())
+
+    # Saving over the directory writes new shards instead of rewriting the listed ones in place,
+    # then removes the old ones
+    old_shards = {p.name for p in checkpoint_dir.glob("shard_*.tensors")}
+    optimizer.zero_grad()
+    model(torch.rand(100)).sum().backward()
+    optimizer.step()
+    run_save_checkpoint(model, optimizer, iteration=4, out=checkpoint_dir, format="sharded", shard_size_mb=0.05)
+    shards = {p.name for p in checkpoint_dir.glob("shard_*.tensors")}
+    assert shards and not shards & old_shards
+    assert run_load_checkpoint(src=checkpoint_dir, model=new_model, optimizer=new_optimizer) == 4
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_allclose(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+
+
+def test_delta_checkpoints(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    # fc3 stays frozen, so deltas skip it entirely
+    model.fc3.requires_grad_(False)
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+
+    checkpointer = DeltaCheckpointer(tmp_path, full_every=3, keep_last_bases=1)
+    for it in range(1, 6):
+        optimizer.zero_grad()
+        model(torch.rand(100)).sum().backward()
+        optimizer.step()
+        path = checkpointer.save(model, optimizer, iteration=it)
+
+    # Saves 1-3 form the first chain, 4 is the new base and 5 a delta against it
+    assert path.name == "checkpoint_00000004.delta_00000005.tensors"
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "checkpoint_00000004.delta_00000005.tensors",
+        "checkpoint_00000004.tensors",
+    ]
+    assert path.stat().st_size < (tmp_path / "checkpoint_00000004.tensors").stat().st_size
+
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    assert run_load_checkpoint(src=checkpointer.latest(), model=new_model, optimizer=new_optimizer) == 5
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_array_equal(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+    assert are_optimizers_equal(optimizer.state_dict(), new_optimizer.state_dict())
+
+
+def test_delta_checkpoint_sizes(tmp_path):
+    torch.manual_seed(42)
+    model = _TestNet()
+    optimizer = get_adamw_cls()(model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+
+    # Every parameter trains, so every tensor of the checkpoint changes between saves
+    lossless = DeltaCheckpointer(tmp_path / "lossless", full_every=2)
+    reduced = DeltaCheckpointer(tmp_path / "reduced", full_every=2, optimizer_state_dtype=torch.bfloat16)
+    for it in range(1, 3):
+        for _ in range(5):
+            optimizer.zero_grad()
+            model(torch.rand(100)).sum().backward()
+            optimizer.step()
+        lossless_path = lossless.save(model, optimizer, iteration=it)
+        reduced_path = reduced.save(model, optimizer, iteration=it * 5)
+
+    full_size = (tmp_path / "lossless" / "checkpoint_00000001.tensors").stat().st_size
+    assert lossless_path.stat().st_size < full_size
+    assert reduced_path.stat().st_size < 0.6 * full_size
+
+    # Lossless deltas restore bit-exactly; bfloat16 optimizer state to bfloat16 precision
+    new_model = _TestNet()
+    new_optimizer = get_adamw_cls()(new_model.parameters(), lr=1e-3, weight_decay=0.01, betas=(0.9, 0.999), eps=1e-8)
+    assert run_load_checkpoint(src=lossless_path, model=new_model, optimizer=new_optimizer) == 2
+    assert are_optimizers_equal(optimizer.state_dict(), new_optimizer.state_dict(), atol=0, rtol=0)
+    assert run_load_checkpoint(src=reduced_path, model=new_model, optimizer=new_optimizer) == 10
+    for key, value in model.state_dict().items():
+        numpy.testing.assert_array_equal(value.detach().numpy(), new_model.state_dict()[key].detach().numpy())
+    assert are_optimizers_equal(optimizer.state_dict(), new_optimizer.state_dict(), atol=0, rtol=2**-8)
+
+    # A checkpointer created after a restart finds the latest checkpoint on disk
+    assert DeltaCheckpointer(tmp_path / "reduced").latest() == reduced_path
+    with open(reduced_path, "rb") as f, pytest.raises(ValueError):
+        run_load_checkpoint(src=f, model=new_model, optimizer=new_optimizer)
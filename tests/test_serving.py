@@ -0,0 +1,210 @@
+import asyncio
+import json
+
+import pytest
+import torch
+
+from cs336_basics.generation import generate
+from cs336_basics.model import TransformerLM
+from cs336_basics.serving import InferenceEngine, PagedKVCache, start_server
+
+
+class _CharTokenizer:
+    """One token per character, with <|endoftext|> as id 0."""
+
+    def encode(self, text):
+        if text == "<|endoftext|>":
+            return [0]
+        return [ord(c) for c in text]
+
+    def decode(self, ids):
+        return "".join(chr(i) for i in ids)
+
+
+def _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = TransformerLM(vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, rope_theta=theta)
+    model.load_state_dict(ts_state_dict[0])
+    return model
+
+
+def test_paged_kv_cache_allocation():
+    cache = PagedKVCache(num_layers=1, num_blocks=4, block_size=4, num_heads=1, d_k=2)
+    assert cache.allocate(0, max_tokens=9)  # 3 blocks
+    assert not cache.allocate(1, max_tokens=8)
+    assert cache.allocate(1, max_tokens=4)
+    cache.free(0)
+    assert cache.allocate(2, max_tokens=12)
+    assert not set(cache.block_tables[1]) & set(cache.block_tables[2])
+
+
+def test_paged_kv_cache_int8():
+    torch.manual_seed(0)
+    cache = PagedKVCache(num_layers=2, num_blocks=4, block_size=4, num_heads=2, d_k=8, quantize=True)
+    assert cache.allocate(0, max_tokens=7)
+    keys, values = torch.randn(2, 2, 6, 8), torch.randn(2, 2, 6, 8)
+    cache.append(0, keys, values)
+    # Each stored vector is off by at most half a quantization step, amax / 254 (plus rounding)
+    read_keys, read_values = cache.read(0, 6)
+    torch.testing.assert_close(read_keys, keys, atol=keys.abs().max().item() / 250, rtol=0)
+    torch.testing.assert_close(read_values, values, atol=values.abs().max().item() / 250, rtol=0)
+
+    # Decode-time writes go through the same quantization
+    k = torch.randn(1, 2, 1, 8)
+    all_keys, _ = cache.batch([0]).update(1, k, k)
+    assert all_keys.shape == (1, 2, 7, 8)
+    torch.testing.assert_close(all_keys[:, :, 6:], k, atol=k.abs().max().item() / 250, rtol=0)
+
+
+def test_continuous_batching_matches_generate(
+    ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta
+):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+    prompts = ["Once upon", "The", "A dog ran", "Hi"]
+    max_new_tokens = [6, 4, 5, 7]
+
+    async def complete(engine, prompt, n, delay):
+        # Staggered arrivals join the batch while others are mid-decode
+        await asyncio.sleep(delay)
+        return "".join([piece async for piece in engine.generate(prompt, max_new_tokens=n, temperature=0)])
+
+    async def main():
+        # Small pool and batch, so some requests have to wait for others to finish
+        engine = InferenceEngine(model, tokenizer, num_blocks=6, block_size=4, max_batch_size=3)
+        runner = asyncio.create_task(engine.run())
+        try:
+            return await asyncio.gather(
+                *[complete(engine, p, n, 0.01 * i) for i, (p, n) in enumerate(zip(prompts, max_new_tokens))]
+            )
+        finally:
+            runner.cancel()
+            assert len(engine.cache.free_blocks) == 6
+
+    outputs = asyncio.run(main())
+    for prompt, n, output in zip(prompts, max_new_tokens, outputs):
+        expected = generate(model, [tokenizer.encode(prompt)], max_new_tokens=n, temperature=0, eos_token_id=0)[0]
+        assert output == tokenizer.decode(expected)
+
+
+def test_failed_request_does_not_stop_engine(
+    ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta
+):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+
+    async def complete(engine, prompt, **kwargs):
+        return "".join([piece async for piece in engine.generate(prompt, max_new_tokens=4, **kwargs)])
+
+    async def main():
+        engine = InferenceEngine(model, tokenizer, num_blocks=6, block_size=4)
+        runner = asyncio.create_task(engine.run())
+        try:
+            for kwargs in ({"top_k": 0}, {"top_p": 0.0}, {"temperature": -1.0}):
+                with pytest.raises(ValueError):
+                    await complete(engine, "Once", **kwargs)
+            # Token ids past the vocabulary fail inside the model's step
+            with pytest.raises(IndexError):
+                await complete(engine, chr(vocab_size + 1), temperature=0)
+            assert len(engine.cache.free_blocks) == 6
+            return await complete(engine, "Once", temperature=0)
+        finally:
+            runner.cancel()
+
+    output = asyncio.run(main())
+    expected = generate(model, [tokenizer.encode("Once")], max_new_tokens=4, temperature=0, eos_token_id=0)[0]
+    assert output == tokenizer.decode(expected)
+
+
+def test_oversized_and_cancelled_requests(
+    ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta
+):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+
+    async def complete(engine, prompt, n):
+        return "".join([piece async for piece in engine.generate(prompt, max_new_tokens=n, temperature=0)])
+
+    async def main():
+        # 8 slots in the whole pool
+        engine = InferenceEngine(model, tokenizer, num_blocks=2, block_size=4)
+        runner = asyncio.create_task(engine.run())
+        try:
+            # 4 prompt tokens + 8 new ones need 11 slots: rejected upfront instead of stalling the engine
+            with pytest.raises(ValueError):
+                await complete(engine, "Once", 8)
+
+            # A cancelled caller gets its blocks back, without decoding to max_new_tokens
+            task = asyncio.create_task(complete(engine, "Once", 5))
+            while len(engine.cache.free_blocks) == 2:
+                await asyncio.sleep(0)
+            task.cancel()
+            while len(engine.cache.free_blocks) < 2:
+                await asyncio.sleep(0.001)
+            assert not engine._running and not engine._waiting
+            return await complete(engine, "Once", 5)
+        finally:
+            runner.cancel()
+
+    output = asyncio.run(main())
+    expected = generate(model, [tokenizer.encode("Once")], max_new_tokens=5, temperature=0, eos_token_id=0)[0]
+    assert output == tokenizer.decode(expected)
+
+
+def test_http_endpoint(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+
+    async def post(port, body):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        data = json.dumps(body).encode()
+        writer.write(f"POST /generate HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b"\r\n\r\n")
+        return head.decode(), payload
+
+    async def main():
+        server = await start_server(InferenceEngine(model, tokenizer), port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            ok = await post(port, {"prompt": "Once", "max_new_tokens": 5, "temperature": 0})
+            streamed = await post(port, {"prompt": "Once", "max_new_tokens": 5, "temperature": 0, "stream": True})
+            bad = await post(port, {"max_new_tokens": 5})
+        return ok, streamed, bad
+
+    (ok_head, ok_body), (stream_head, stream_body), (bad_head, _) = asyncio.run(main())
+    expected = tokenizer.decode(
+        generate(model, [tokenizer.encode("Once")], max_new_tokens=5, temperature=0, eos_token_id=0)[0]
+    )
+    assert ok_head.startswith("HTTP/1.1 200") and json.loads(ok_body) == {"text": expected}
+    assert stream_head.startswith("HTTP/1.1 200") and "chunked" in stream_head
+    # Decode the chunked body: "<hex length>\r\n<data>\r\n" ... "0\r\n\r\n"
+    text, rest = b"", stream_body
+    while True:
+        size, _, rest = rest.partition(b"\r\n")
+        if int(size, 16) == 0:
+            break
+        text, rest = text + rest[: int(size, 16)], rest[int(size, 16) + 2 :]
+    assert text.decode() == expected
+    assert bad_head.startswith("HTTP/1.1 400")
+
+
+def test_prefix_cache_reuse(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta):
+    model = _load_model(ts_state_dict, vocab_size, n_keys, d_model, n_layers, n_heads, d_ff, theta)
+    tokenizer = _CharTokenizer()
+    prompts = ["Once upon a", "Once upon the", "Once upon a"]
+
+    async def main(engine):
+        runner = asyncio.create_task(engine.run())
+        outputs = []
+        # One request at a time, so later prompts find the earlier ones in the prefix cache
+        for prompt in prompts:
+            outputs.append("".join([p async for p in engine.generate(prompt, max_new_tokens=4, temperature=0)]))
+        runner.cancel()
+        return outputs
+
+    engine = InferenceEngine(model, tokenizer, prefix_cache_bytes=1 << 20)
+    outputs = asyncio.run(main(engine))
+    assert engine.prefix_cache.match(tokenizer.encode("Once upon the"))[0] == len("Once upon the")
+    assert outputs == asyncio.run(main(InferenceEngine(model, tokenizer)))
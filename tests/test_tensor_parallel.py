@@ -0,0 +1,57 @@
+import copy
+
+import torch
+import torch.distributed as dist
+
+from cs336_basics.distributed import spawn
+from cs336_basics.model import TransformerLM
+from cs336_basics.tensor_parallel import (
+    TensorParallelLinear,
+    parallelize_tensor,
+    tensor_parallel_lm,
+    unsharded_state_dict,
+)
+
+_CONFIG = {"vocab_size": 32, "context_length": 8, "d_model": 16, "num_layers": 2, "num_heads": 4, "d_ff": 32}
+
+
+def _make_model():
+    return TransformerLM(**_CONFIG, num_kv_heads=2)
+
+
+def _tensor_parallel_worker():
+    torch.manual_seed(0)
+    reference = _make_model()
+    model = parallelize_tensor(copy.deepcopy(reference))
+    assert model.layers[0].attn.q_proj.weight.shape == (8, 16)
+    assert model.layers[0].ffn.w2.weight.shape == (16, 16)
+
+    batch = torch.randint(0, 32, (2, 9), generator=torch.Generator().manual_seed(0))
+    loss = model.loss(batch[:, :-1], batch[:, 1:])
+    expected_loss = reference.loss(batch[:, :-1], batch[:, 1:])
+    torch.testing.assert_close(loss, expected_loss)
+
+    # Replicated parameters get the full gradient, sharded ones the matching slice of it
+    loss.backward()
+    expected_loss.backward()
+    modules = dict(model.named_modules())
+    for (name, p), expected in zip(model.named_parameters(), reference.parameters()):
+        module = modules[name.removesuffix(".weight")]
+        expected_grad = module.shard(expected.grad) if isinstance(module, TensorParallelLinear) else expected.grad
+        torch.testing.assert_close(p.grad, expected_grad, atol=1e-6, rtol=1e-5, msg=name)
+
+    # The unsharded state dict round-trips, and loads into a differently initialized model that
+    # was built already sharded
+    state_dict = unsharded_state_dict(model)
+    for key, value in reference.state_dict().items():
+        torch.testing.assert_close(state_dict[key], value, msg=key)
+    torch.manual_seed(dist.get_rank() + 1)
+    restored = tensor_parallel_lm(**_CONFIG, num_kv_heads=2)
+    assert restored.layers[0].attn.k_proj.weight.shape == (4, 16)
+    assert restored.layers[0].attn.num_heads == 2
+    restored.load_state_dict(reference.state_dict())
+    torch.testing.assert_close(restored(batch[:, :-1]), reference(batch[:, :-1]))
+
+
+def test_tensor_parallel():
+    spawn(_tensor_parallel_worker, 2)
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+
+from cs336_basics.train import get_args, main, train
+
+
+def test_train_smoke(tmp_path):
+    rng = np.random.default_rng(0)
+    train_path, val_path = tmp_path / "train.bin", tmp_path / "val.bin"
+    rng.integers(0, 64, size=4096, dtype=np.uint16).tofile(train_path)
+    rng.integers(0, 64, size=1024, dtype=np.uint16).tofile(val_path)
+    log_path = tmp_path / "metrics.jsonl"
+
+    args = get_args(
+        [
+            "--train-data", str(train_path),
+            "--val-data", str(val_path),
+            "--vocab-size", "64",
+            "--context-length", "16",
+            "--d-model", "32",
+            "--num-layers", "2",
+            "--num-heads", "2",
+            "--d-ff", "64",
+            "--batch-size", "4",
+            "--grad-accum-steps", "2",
+            "--max-iters", "6",
+            "--warmup-iters", "2",
+            "--log-interval", "2",
+            "--eval-interval", "3",
+            "--eval-batches", "2",
+            "--checkpoint-dir", str(tmp_path / "checkpoints"),
+            "--checkpoint-interval", "3",
+            "--log-jsonl", str(log_path),
+            "--peak-flops", "1e12",
+            "--device", "cpu",
+        ]
+    )
+    train(args)
+
+    records = [json.loads(line) for line in log_path.read_text().splitlines()]
+    train_records = [r for r in records if "train/loss" in r]
+    assert [r["step"] for r in train_records] == [2, 4, 6]
+    for key in ("perf/tokens_per_sec", "perf/mfu", "perf/data_time", "perf/forward_time", "perf/backward_time",
+                "perf/optim_time"):
+        assert all(r[key] > 0 for r in train_records)
+    assert [r["step"] for r in records if "val/loss" in r] == [3, 6]
+    assert sorted(p.name for p in (tmp_path / "checkpoints").iterdir()) == [
+        "checkpoint_00000003.pt",
+        "checkpoint_00000006.pt",
+    ]
+
+
+def test_train_data_parallel(tmp_path):
+    rng = np.random.default_rng(0)
+    train_path = tmp_path / "train.bin"
+    rng.integers(0, 64, size=4096, dtype=np.uint16).tofile(train_path)
+    log_path = tmp_path / "metrics.jsonl"
+
+    main(
+        [
+            "--train-data", str(train_path),
+            "--vocab-size", "64",
+            "--context-length", "16",
+            "--d-model", "32",
+            "--num-layers", "2",
+            "--num-heads", "2",
+            "--d-ff", "64",
+            "--batch-size", "4",
+            "--grad-accum-steps", "2",
+            "--max-iters", "4",
+            "--log-interval", "2",
+            "--checkpoint-dir", str(tmp_path / "checkpoints"),
+            "--log-jsonl", str(log_path),
+            "--world-size", "2",
+            "--bucket-size-mb", "0.01",
+            "--device", "cpu",
+        ]
+    )
+
+    # Only rank 0 logs and checkpoints
+    assert [json.loads(line)["step"] for line in log_path.read_text().splitlines()] == [2, 4]
+    assert [p.name for p in (tmp_path / "checkpoints").iterdir()] == ["checkpoint_00000004.pt"]